@@ -2,28 +2,58 @@ from langchain.document_loaders import DirectoryLoader
 from langchain.document_loaders import TextLoader
 from langchain.vectorstores import Chroma
 from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 import chromadb
+from collections import defaultdict
+import json
+import os
+import sys
 import streamlit as st
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from episode_store import chunk_splitter
+
 
 """
 One time script to run to create a vector datastore of all the documents in
 [./corpus/Mahabharata]
+
+Pass the changed-files list written by corpus/tiny_tales_scrape.py to re-index
+only those episodes in the existing datastore:
+
+    python VectorStore/create_db.py corpus/changed_files.json
 """
 
 
 API_KEY = st.secrets["OPEN_AI_KEY"]
 
-loader = DirectoryLoader('./corpus/Mahabharata',
-                         glob="**/*.txt", loader_cls=TextLoader)
-docs = loader.load()
-textSplitter = RecursiveCharacterTextSplitter(
-    chunk_size=1000,
-    chunk_overlap=0,
-    separators=[" ", ",", "\n"]
-)
-splitDocs = textSplitter.split_documents(docs)
+changedFiles = None
+if len(sys.argv) > 1:
+    with open(sys.argv[1], encoding="utf-8") as f:
+        # Paths relative to the repository root, matching the sources of a full build.
+        changedFiles = [os.path.relpath(path) for path in json.load(f)]
+
+if changedFiles is None:
+    loader = DirectoryLoader('./corpus/Mahabharata',
+                             glob="**/*.txt", loader_cls=TextLoader)
+    docs = loader.load()
+else:
+    docs = [doc for path in changedFiles for doc in TextLoader(path, encoding="utf-8").load()]
+splitDocs = chunk_splitter().split_documents(docs)
+# Record the order of chunks within each episode; EpisodeStore.stitch locates a
+# hit in its episode by this index.
+chunkCounts = defaultdict(int)
+for doc in splitDocs:
+    doc.metadata["chunk_index"] = chunkCounts[doc.metadata["source"]]
+    chunkCounts[doc.metadata["source"]] += 1
 client = chromadb.PersistentClient(path="./db")
-db = Chroma.from_documents(splitDocs, OpenAIEmbeddings(
-    openai_api_key=API_KEY), client=client)
+if changedFiles is None:
+    db = Chroma.from_documents(splitDocs, OpenAIEmbeddings(
+        openai_api_key=API_KEY), client=client)
+else:
+    db = Chroma(client=client, embedding_function=OpenAIEmbeddings(openai_api_key=API_KEY))
+    # Replace the old chunks of every changed episode.
+    for path in changedFiles:
+        db._collection.delete(where={"source": path})
+    if splitDocs:
+        db.add_documents(splitDocs)
+    print(f"Re-indexed {len(changedFiles)} episodes ({len(splitDocs)} chunks).")
@@ -0,0 +1,247 @@
+from enum import Enum
+import os
+import threading
+import time
+
+from cancellation import Cancelled
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request cannot be admitted.
+
+    Attributes:
+        status_code (int): 429 if the client is over its quota, 503 if a stage is full.
+        retry_after (int): Seconds the client should wait before retrying.
+    """
+
+    def __init__(self, status_code, retry_after, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.detail = detail
+
+
+class Service(Enum):
+    """
+    Represents how much of the pipeline is run for a request, from most to least work.
+    """
+    FULL = "full"
+    CACHED_FACES = "cached_faces"
+    TEXT_ONLY = "text_only"
+    CACHED_ONLY = "cached_only"
+
+
+# Stage depth (0 to 1) at or above which each degraded service level kicks in.
+DEGRADATION_LADDER = [
+    (0.9, Service.CACHED_ONLY),
+    (0.75, Service.TEXT_ONLY),
+    (0.5, Service.CACHED_FACES),
+]
+
+
+class Stage:
+    """
+    Bounds the concurrency and queue length of one pipeline stage.
+
+    At most concurrency requests run the stage at once and at most max_queue more
+    wait for a slot; anything beyond that is rejected immediately with a 503 rather
+    than adding to the backlog.
+
+    Example usage:
+
+    >>> stage = Stage("images", concurrency=4, max_queue=8)
+    >>> with stage.admit():
+    ...     illustrator.populateStore()
+    """
+
+    def __init__(self, name, concurrency, max_queue):
+        """
+        Initialize a Stage instance.
+
+        Args:
+            name (str): The name of the stage.
+            concurrency (int): Requests allowed to run the stage at once.
+            max_queue (int): Requests allowed to wait for a slot.
+        """
+        self.name = name
+        self.concurrency = concurrency
+        self.capacity = concurrency + max_queue
+        self.semaphore = threading.BoundedSemaphore(concurrency)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.average = 1.0
+
+    def depth(self):
+        """
+        Return the fraction of the stage's capacity in use, from 0 to 1.
+        """
+        return self.pending / self.capacity
+
+    def retry_after(self):
+        """
+        Estimate the seconds until a slot frees up, from the average time in the stage.
+        """
+        return max(1, round(self.average * self.pending / self.concurrency))
+
+    def admit(self):
+        """
+        Reserve a place in the stage without blocking.
+
+        Returns:
+            StageSlot: Context manager that waits for a slot and releases it on exit.
+
+        Raises:
+            Overloaded: If the stage and its queue are full.
+        """
+        with self.lock:
+            if self.pending >= self.capacity:
+                raise Overloaded(503, self.retry_after(), f"The {self.name} stage is at capacity.")
+            self.pending += 1
+        return StageSlot(self)
+
+    def _finish(self, duration):
+        """
+        Release a reservation, folding duration into the running average.
+        """
+        with self.lock:
+            self.pending -= 1
+            if duration is not None:
+                self.average = 0.8 * self.average + 0.2 * duration
+
+
+class StageSlot:
+    """
+    A reserved place in a Stage; entering it waits for a free slot.
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self.started = None
+        self.entered = False
+        self.cancelled = False
+
+    def __enter__(self):
+        with self.stage.lock:
+            if self.cancelled:
+                raise Cancelled()
+            self.entered = True
+        self.stage.semaphore.acquire()
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stage.semaphore.release()
+        self.stage._finish(time.monotonic() - self.started)
+        return False
+
+    def cancel(self):
+        """
+        Give up a reservation that was never entered. Does nothing once the slot has
+        been entered, since leaving it releases the reservation, and a cancelled slot
+        can no longer be entered.
+        """
+        with self.stage.lock:
+            if self.entered or self.cancelled:
+                return
+            self.cancelled = True
+        self.stage._finish(None)
+
+
+class ClientQuota:
+    """
+    Per-client token bucket limiting how often each client can start a request.
+
+    The quota is disabled when per_minute is None, since clients behind a shared
+    proxy or NAT would otherwise share one bucket.
+
+    Example usage:
+
+    >>> quota = ClientQuota(per_minute=6, burst=3)
+    >>> quota.take(request.client.host)
+    """
+
+    def __init__(self, per_minute, burst):
+        """
+        Initialize a ClientQuota instance.
+
+        Args:
+            per_minute (float): Requests a client may start per minute on average, or
+                None for no limit.
+            burst (int): Requests a client may start back to back.
+        """
+        self.rate = per_minute / 60 if per_minute else None
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, client):
+        """
+        Spend one request from client's bucket.
+
+        Raises:
+            Overloaded: If the client has no requests left.
+        """
+        if self.rate is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self.buckets[client] = (tokens, now)
+                raise Overloaded(429, max(1, round((1 - tokens) / self.rate)), "Too many requests.")
+            self.buckets[client] = (tokens - 1, now)
+
+
+class AdmissionController:
+    """
+    Admission control and graceful degradation for the story pipeline.
+
+    Holds one Stage per pipeline stage and a ClientQuota. Limits are read from
+    environment variables such as ADMISSION_STORY_CONCURRENCY and
+    ADMISSION_STORY_QUEUE. The per-client quota is off unless
+    ADMISSION_CLIENT_PER_MINUTE is set. The service level for a new request is chosen from the
+    deepest stage queue using DEGRADATION_LADDER.
+
+    Example usage:
+
+    >>> admission = AdmissionController()
+    >>> admission.quota.take(client)
+    >>> slot = admission.stages["request"].admit()
+    >>> service = admission.service()
+    """
+
+    STAGES = {
+        "request": (16, 16),
+        "story": (8, 16),
+        "faces": (4, 8),
+        "images": (4, 8),
+    }
+
+    def __init__(self):
+        """
+        Initialize an AdmissionController instance from the environment.
+        """
+        self.stages = {}
+        for name, (concurrency, max_queue) in AdmissionController.STAGES.items():
+            self.stages[name] = Stage(
+                name,
+                int(os.environ.get(f"ADMISSION_{name.upper()}_CONCURRENCY", concurrency)),
+                int(os.environ.get(f"ADMISSION_{name.upper()}_QUEUE", max_queue))
+            )
+        per_minute = os.environ.get("ADMISSION_CLIENT_PER_MINUTE")
+        self.quota = ClientQuota(
+            float(per_minute) if per_minute else None,
+            int(os.environ.get("ADMISSION_CLIENT_BURST", 3))
+        )
+
+    def service(self):
+        """
+        Return the service level for a new request given current queue depths.
+        """
+        depth = max(stage.depth() for stage in self.stages.values())
+        for threshold, service in DEGRADATION_LADDER:
+            if depth >= threshold:
+                return service
+        return Service.FULL
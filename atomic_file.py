@@ -0,0 +1,33 @@
+import os
+from pathlib import Path
+import tempfile
+
+
+def write_atomic(path, data):
+    """
+    Write data to path so that readers never see a partially written file.
+
+    The data is written to a uniquely named temporary file next to path, which then
+    replaces path in one step, so concurrent writers of the same file never share
+    a temporary file and the last one to finish wins.
+
+    Args:
+        path (str or Path): The file to write.
+        data (str or bytes): The contents; text is encoded as UTF-8.
+
+    Example usage:
+
+    >>> write_atomic("profiles/latest.json", json.dumps(summary))
+    """
+    path = Path(path)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    (descriptor, temporary) = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(data)
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
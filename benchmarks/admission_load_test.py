@@ -0,0 +1,133 @@
+"""
+Load-test scenario for admission control on /getstory/.
+
+Sends --multiple times the request stage's capacity (concurrency plus queue) of
+concurrent /getstory/ requests to the app in-process, each for a different story,
+and reports the latency of the admitted requests and of the rejections. Stories are
+written by a stub model that streams --chunks chunks of --chunk-seconds each, so
+no API key is needed. The store, shared state and LLM cache are temporary, so
+nothing is read from or written to a real deployment.
+
+With admission control the admitted requests should finish in about the time of
+a full pipeline, however many requests are sent, and the rest should be answered
+with 503 and a Retry-After right away.
+
+Usage:
+
+    python benchmarks/admission_load_test.py
+    python benchmarks/admission_load_test.py --multiple 10 --chunk-seconds 0.05
+"""
+import argparse
+import asyncio
+from collections import Counter
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema.messages import AIMessage, AIMessageChunk
+from langchain.schema.output import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from llm_cache import LLMCache
+from model_router import ModelRouter
+from shared_state import SharedState, SQLiteState
+from story_store import StoryStore
+import main as server
+
+
+class StubStoryModel(BaseChatModel):
+    """
+    Streams a short story in fixed-latency chunks.
+    """
+
+    chunks: int = 4
+    chunk_seconds: float = 0.1
+
+    @property
+    def _llm_type(self):
+        return "stub-story"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Once upon a time."))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for i in range(self.chunks):
+            time.sleep(self.chunk_seconds)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=f"Page {i} of the story.\n\n"))
+
+
+async def request_story(i):
+    """
+    Send one /getstory/ request to the app and return (status, seconds).
+    """
+    body = json.dumps({
+        "query": f"query {i}", "age": "adult", "language": "english", "imageGenStyle": "Comic", "color": "Color"
+    }).encode()
+    sent = []
+    messages = []
+
+    async def receive():
+        if not sent:
+            sent.append(True)
+            return {"type": "http.request", "body": body, "more_body": False}
+        # The client stays connected until the response is sent.
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/getstory/", "raw_path": b"/getstory/", "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": (f"10.0.{i // 256}.{i % 256}", 1234), "server": ("testserver", 80),
+    }
+    start = time.perf_counter()
+    await server.app(scope, receive, send)
+    status = next(m["status"] for m in messages if m["type"] == "http.response.start")
+    return status, time.perf_counter() - start
+
+
+async def run(count):
+    return await asyncio.gather(*[request_story(i) for i in range(count)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--multiple", type=float, default=5, help="Requests sent, as a multiple of capacity.")
+    parser.add_argument("--chunks", type=int, default=4, help="Chunks streamed per story.")
+    parser.add_argument("--chunk-seconds", type=float, default=0.1, help="Latency of each streamed chunk.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    state = SQLiteState(os.path.join(directory, "shared_state.sqlite3"))
+    SharedState._shared = state
+    LLMCache._shared = LLMCache(path=None, state=state)
+    model = StubStoryModel(chunks=args.chunks, chunk_seconds=args.chunk_seconds)
+    ModelRouter._shared = ModelRouter(factory=lambda name: model)
+    server.story_store = StoryStore(os.path.join(directory, "stories.sqlite3"))
+    server.StoryRetriever = lambda query: SimpleNamespace(retrieve=lambda: f"The source text for {query}.")
+
+    capacity = server.admission.stages["request"].capacity
+    count = int(capacity * args.multiple)
+    results = asyncio.run(run(count))
+
+    admitted = sorted(seconds for (status, seconds) in results if status == 200)
+    rejected = sorted(seconds for (status, seconds) in results if status != 200)
+    print(f"{count} requests at {args.multiple:g}x a request capacity of {capacity}")
+    print(f"statuses: {dict(Counter(status for (status, _) in results))}")
+    if admitted:
+        print(f"admitted {len(admitted)}: p50 {statistics.median(admitted):.2f}s "
+              f"p95 {admitted[int(len(admitted) * 0.95) - 1]:.2f}s max {admitted[-1]:.2f}s")
+    if rejected:
+        print(f"rejected {len(rejected)}: p50 {statistics.median(rejected):.3f}s max {rejected[-1]:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Before/after report of prompt tokens and latency for the context budget.
+
+Compares the prompts fetchCharacters and generatePrompt sent before ContextBudget
+(the whole story text, and the whole character JSON on every page) with the
+budgeted prompts they send now, on a benchmark set of:
+
+- the stories saved in story_jsons/, and
+- long stories made of 5, 15 and 40 consecutive corpus episodes, one page per
+  paragraph, standing in for "elaborate and descriptive" PageSz.LG stories.
+
+Character JSON holds an entry for every name in character_map.json that the story
+mentions, with descriptions of the length fetchCharacters returns. Summaries are
+produced by a stub that returns the largest summary the budget allows, so the
+budgeted token counts are upper bounds.
+
+Model latency is estimated from the token and call counts with --call-seconds and
+--token-ms, since it cannot be measured offline; the time spent in ContextBudget
+itself is measured.
+
+Usage:
+
+    python benchmarks/context_budget_report.py
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from context_budget import CharacterMatcher, ContextBudget, CHARACTER_STORY_BUDGET, PAGE_CHARACTER_BUDGET
+from episode_store import EpisodeStore
+
+CHARACTER_PROMPT = """
+        Your goal is to analyze the following story {story} 
+        and generate a JSON that maps from each character in the story to a physical description that you come up with. 
+        The description should be specific and just describe clothing, physical features, and facial features. 
+        The description should not be sentences, just comma-separated adjectives.
+        Infer gender and age of each character.
+        The keys should be 'description', 'name', 'attire', 'gender', 'age'.
+        """
+
+PAGE_PROMPT = """
+        Your goal is to take a page from a story and a JSON file containing 
+        descriptions of characters in the story and output a prompt that will be 
+        fed to an image generator such as DALL-E to generate an image for the scene. 
+        Here is the page {page} and here is the JSON {json}.
+        The image should be {color} and in this style {style}. The resulting prompt should 
+        not give directives, it should just describe the scene. It should also be two sentences
+        at most and should not include any narrative. Include the color and style at the end with commas.
+        """
+
+
+class StubRouter:
+    """
+    Answers summary requests with the longest summary fit_story keeps.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.budget = ContextBudget(0)
+
+    def predict(self, site, prompt):
+        self.calls += 1
+        self.prompt_tokens += self.budget.count(prompt)
+        return prompt
+
+
+def benchmark_set():
+    """
+    Return (name, pages) pairs for the stored stories and the long corpus stories.
+    """
+    stories = []
+    for path in sorted(glob.glob("story_jsons/*.json")):
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        stories.append((os.path.basename(path)[:12], [p["content"]["text"] for p in data["pages"]]))
+    episodes = EpisodeStore.shared()
+    for count in (5, 15, 40):
+        names = episodes.order[100:100 + count]
+        pages = [
+            paragraph.strip()
+            for name in names
+            for paragraph in episodes.episodes[name].split("\nInspired by:")[0].split("\n")[1:]
+            if paragraph.strip()
+        ]
+        stories.append((f"{count} episodes", pages))
+    return stories
+
+
+def characters_for(text):
+    """
+    Return character JSON with an entry for every known name mentioned in text.
+    """
+    with open("character_map.json", encoding="utf-8") as f:
+        names = json.load(f)
+    entries = {name: {"name": name.title()} for name in names}
+    characters = {}
+    for name in CharacterMatcher(entries).mentioned(text):
+        characters[name] = {
+            "description": "tall, broad-shouldered, dark-skinned, sharp eyes, thick black beard, stern expression",
+            "name": name.title(),
+            "attire": "golden armour over a white dhoti, jewelled crown, earrings, bow slung across the back",
+            "gender": "male",
+            "age": "35",
+        }
+    return characters
+
+
+def measure(pages):
+    """
+    Return prompt tokens and model calls before and after budgeting, and the
+    seconds spent in ContextBudget.
+    """
+    text = "\n\n".join(pages)
+    characters = characters_for(text)
+    counter = ContextBudget(0)
+    full_json = json.dumps(characters)
+    before = counter.count(CHARACTER_PROMPT.format(story=text))
+    before += sum(
+        counter.count(PAGE_PROMPT.format(page=page, json=full_json, color="Color", style="comic"))
+        for page in pages
+    )
+
+    router = StubRouter()
+    start = time.perf_counter()
+    budget = ContextBudget(CHARACTER_STORY_BUDGET)
+    after = budget.count(CHARACTER_PROMPT.format(story=budget.fit_story(text, router)))
+    page_budget = ContextBudget(PAGE_CHARACTER_BUDGET)
+    for page in pages:
+        compact = page_budget.compact_characters(characters, page)
+        after += page_budget.count(PAGE_PROMPT.format(page=page, json=compact, color="Color", style="comic"))
+    seconds = time.perf_counter() - start
+    after += router.prompt_tokens
+    calls = 1 + len(pages)
+    return {
+        "pages": len(pages),
+        "characters": len(characters),
+        "before_tokens": before,
+        "after_tokens": after,
+        "before_calls": calls,
+        "after_calls": calls + router.calls,
+        "budget_seconds": seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--call-seconds", type=float, default=0.5, help="Assumed fixed latency of a model call.")
+    parser.add_argument("--token-ms", type=float, default=0.2, help="Assumed prompt processing time per token.")
+    args = parser.parse_args()
+
+    def estimate(tokens, calls):
+        return calls * args.call_seconds + tokens * args.token_ms / 1000
+
+    print(f"{'story':<14}{'pages':>6}{'chars':>6}{'tokens before':>15}{'tokens after':>14}{'saved':>7}"
+          f"{'est. s before':>15}{'est. s after':>14}{'budget ms':>11}")
+    for (name, pages) in benchmark_set():
+        r = measure(pages)
+        saved = 1 - r["after_tokens"] / r["before_tokens"]
+        print(f"{name:<14}{r['pages']:>6}{r['characters']:>6}{r['before_tokens']:>15}{r['after_tokens']:>14}{saved:>7.0%}"
+              f"{estimate(r['before_tokens'], r['before_calls']):>15.1f}{estimate(r['after_tokens'], r['after_calls']):>14.1f}"
+              f"{r['budget_seconds'] * 1000:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Calibrates ImagePromptIndex's reuse threshold for an embedder.
+
+Builds labeled pairs of scene prompts from corpus sentences that mention a known
+character, in the "scene, style, color" shape StoryIllustrator writes:
+
+- same scene: a prompt and a rewording of it, with articles, synonyms and the
+  order of the style words changed, which should reuse one image, and
+- different scene: two prompts from different sentences about the same
+  character, and a prompt with its character swapped for another one, which
+  must not reuse an image.
+
+Prints the similarity percentiles of both kinds of pair and the lowest threshold
+that reuses an image for at most --max-false-reuse of the different-scene pairs,
+with the share of same-scene pairs it reuses. Put the result in REUSE_THRESHOLDS.
+
+The embedder is chosen by IMAGE_PROMPT_EMBEDDER as in the index, "local" by
+default; "openai" needs OPENAI_API_KEY and makes one embedding call per prompt.
+
+Usage:
+
+    python benchmarks/image_reuse_calibration.py
+    IMAGE_PROMPT_EMBEDDER=openai python benchmarks/image_reuse_calibration.py
+"""
+import argparse
+import json
+import os
+import random
+import re
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from episode_store import EpisodeStore
+from image_prompt_index import _default_embeddings, _scene
+
+STYLES = ["comic", "vibrant color", "dramatic lighting", "detailed"]
+
+SYNONYMS = {
+    "said": "spoke", "told": "said to", "palace": "court", "went": "walked", "saw": "watched",
+    "great": "mighty", "king": "ruler", "forest": "woods", "fought": "battled", "asked": "questioned",
+}
+
+
+def scene_sentences(limit):
+    """
+    Return (character, sentence) pairs for corpus sentences mentioning a known character.
+    """
+    with open("character_map.json", encoding="utf-8") as f:
+        names = [name for name in json.load(f) if len(name) > 3 and " " not in name]
+    episodes = EpisodeStore.shared()
+    pairs = []
+    for name in episodes.order:
+        body = episodes.episodes[name].split("\nInspired by:")[0]
+        for sentence in re.split(r"(?<=[.!?])\s*", body):
+            words = sentence.split()
+            if not 8 <= len(words) <= 30:
+                continue
+            mentioned = [n for n in names if re.search(rf"\b{n}\b", sentence, re.IGNORECASE)]
+            if mentioned:
+                pairs.append((mentioned[0], sentence.strip()))
+    random.Random(0).shuffle(pairs)
+    return pairs[:limit]
+
+
+def prompt(sentence, styles):
+    return f"{sentence.rstrip('.')}, {', '.join(styles)} ::3 --seed 100"
+
+
+def reword(sentence, rng):
+    """
+    Return sentence reworded the way two scene prompts for one page usually differ.
+    """
+    words = sentence.split()
+    words = [SYNONYMS.get(word, word) for word in words]
+    words = [word for word in words if word.lower() not in ("the", "a", "an") or rng.random() < 0.5]
+    return " ".join(words)
+
+
+def labeled_pairs(limit):
+    """
+    Return (same_scene, different_scene) lists of prompt pairs.
+    """
+    rng = random.Random(1)
+    sentences = scene_sentences(limit)
+    same = []
+    for (_, sentence) in sentences:
+        styles = rng.sample(STYLES, len(STYLES))
+        same.append((prompt(sentence, STYLES), prompt(reword(sentence, rng), styles)))
+    by_character = {}
+    for (character, sentence) in sentences:
+        by_character.setdefault(character, []).append(sentence)
+    different = [
+        (prompt(a, STYLES), prompt(b, STYLES))
+        for group in by_character.values()
+        for (a, b) in zip(group, group[1:])
+    ]
+    characters = sorted(by_character)
+    for (character, sentence) in sentences:
+        other = rng.choice([c for c in characters if c != character])
+        swapped = re.sub(rf"\b{character}\b", other.title(), sentence, flags=re.IGNORECASE)
+        different.append((prompt(sentence, STYLES), prompt(swapped, STYLES)))
+    return same, different
+
+
+def similarities(embeddings, pairs):
+    texts = sorted({_scene(text) for pair in pairs for text in pair})
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    row = {text: vector for (text, vector) in zip(texts, vectors)}
+    return np.array([float(row[_scene(a)] @ row[_scene(b)]) for (a, b) in pairs])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sentences", type=int, default=300, help="Corpus sentences to build pairs from.")
+    parser.add_argument("--max-false-reuse", type=float, default=0.01,
+                        help="Largest share of different-scene pairs allowed to reuse an image.")
+    args = parser.parse_args()
+
+    embeddings = _default_embeddings()
+    same, different = labeled_pairs(args.sentences)
+    same_scores = similarities(embeddings, same)
+    different_scores = similarities(embeddings, different)
+
+    print(f"embedder {type(embeddings).__name__}: {len(same)} same-scene, {len(different)} different-scene pairs")
+    for (label, scores) in (("same scene", same_scores), ("different scene", different_scores)):
+        p5, p50, p95 = np.percentile(scores, [5, 50, 95])
+        print(f"{label:<16} p5 {p5:.3f}  p50 {p50:.3f}  p95 {p95:.3f}  max {scores.max():.3f}")
+    threshold = float(np.quantile(different_scores, 1 - args.max_false_reuse))
+    threshold = float(np.ceil(threshold * 100) / 100)
+    print(f"threshold {threshold:.2f}: reuses {np.mean(same_scores >= threshold):.1%} of same-scene pairs "
+          f"and {np.mean(different_scores >= threshold):.1%} of different-scene pairs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Page-render latency with images fetched from a slow CDN and from the ImageStore.
+
+Starts a local HTTP server standing in for the image generator's CDN, which
+answers every request after --cdn-ms milliseconds with a --width pixel wide PNG,
+one per page of a --pages page story. It then times:
+
+- rendering the story's images from the CDN, as pages did before ImageStore,
+- localizing them, i.e. the first download into a temporary ImageStore,
+- localizing them again, which only looks up the URL index, and
+- rendering the story from /assets/ through the app, as the "page" variant.
+
+Usage:
+
+    python benchmarks/image_store_benchmark.py
+    python benchmarks/image_store_benchmark.py --pages 20 --cdn-ms 400
+"""
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.testclient import TestClient
+from PIL import Image
+import requests
+
+from image_store import ImageStore, VARIANT_FORMATS, VARIANT_WIDTHS
+import main as server
+
+
+def make_images(count, width):
+    """
+    Return count distinct PNG images as bytes.
+    """
+    images = []
+    for i in range(count):
+        data = io.BytesIO()
+        Image.effect_noise((width, width * 2 // 3), 40 + i).convert("RGB").save(data, format="PNG")
+        images.append(data.getvalue())
+    return images
+
+
+def start_cdn(images, delay):
+    """
+    Serve images at /<i>.png after delay seconds each, and return the server.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(delay)
+            data = images[int(self.path.strip("/").split(".")[0])]
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    cdn = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=cdn.serve_forever, daemon=True).start()
+    return cdn
+
+
+def timed(function, items):
+    """
+    Call function on each item and return the total seconds and the results.
+    """
+    start = time.perf_counter()
+    results = [function(item) for item in items]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=10, help="Pages, and so images, in the story.")
+    parser.add_argument("--cdn-ms", type=float, default=250, help="Latency of every CDN request.")
+    parser.add_argument("--width", type=int, default=1024, help="Width of the generated images.")
+    args = parser.parse_args()
+
+    images = make_images(args.pages, args.width)
+    cdn = start_cdn(images, args.cdn_ms / 1000)
+    urls = [f"http://127.0.0.1:{cdn.server_port}/{i}.png" for i in range(args.pages)]
+    session = requests.Session()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = ImageStore(root=os.path.join(directory, "assets"))
+        ImageStore._shared = store
+        app = TestClient(server.app)
+
+        cdn_seconds, fetched = timed(lambda url: session.get(url).content, urls)
+        first_seconds, local_urls = timed(store.localize, urls)
+        start = time.perf_counter()
+        store.pool.shutdown(wait=True)
+        variant_seconds = time.perf_counter() - start
+        repeat_seconds, repeated = timed(store.localize, urls)
+        assert repeated == local_urls
+        local_seconds, served = timed(lambda url: app.get(f"{url[:-len('original')]}page.webp").content, local_urls)
+        per_image = [
+            len(os.listdir(os.path.join(directory, "assets", url.split("/")[2]))) - 1 for url in local_urls
+        ]
+
+    cdn.shutdown()
+    print(f"{args.pages} pages, CDN latency {args.cdn_ms:g}ms")
+    print(f"render from CDN:    {cdn_seconds * 1e3:8.1f}ms  {sum(map(len, fetched)) / 1024:8.0f}KiB")
+    print(f"first localize:     {first_seconds * 1e3:8.1f}ms  "
+          f"(variants done {variant_seconds * 1e3:.0f}ms later)")
+    print(f"repeat localize:    {repeat_seconds / args.pages * 1e6:8.0f}us per image, no network")
+    print(f"render from assets: {local_seconds * 1e3:8.1f}ms  {sum(map(len, served)) / 1024:8.0f}KiB as page.webp")
+    expected = len(VARIANT_WIDTHS) * len(VARIANT_FORMATS)
+    print(f"variants per image: {statistics.mean(per_image):.0f} of {expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+Tokens and latency saved by generating only the pages that are shown.
+
+Builds a story from a corpus episode with a stub model that streams --segments
+segments of --segment-tokens tokens each, at --token-ms per token, whatever the
+prompt asks for, as a model that ignores the page limit in the prompt would.
+It compares:
+
+- before: a full story, truncated to --pages pages afterwards, as the visualizer did,
+- max_pages: a story streamed with max_pages=--pages, which stops the stream once
+  that many segments are complete, and
+- max_pages + continue: the same, followed by continue_story for --pages more,
+  for a reader who reads on.
+
+Prompt tokens are counted with ContextBudget; completion tokens are those the
+stub streamed before the stream was closed.
+
+Usage:
+
+    python benchmarks/lazy_pages_benchmark.py
+    python benchmarks/lazy_pages_benchmark.py --segments 30 --token-ms 20
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema.messages import AIMessage, AIMessageChunk
+from langchain.schema.output import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from context_budget import ContextBudget
+from episode_store import EpisodeStore
+from llm_cache import LLMCache
+from model_router import ModelRouter
+from shared_state import SharedState, SQLiteState
+from story import Story
+from story_config import StoryConfig
+
+# Tokens in each streamed chunk; a chunk ends a segment after its last one.
+CHUNK_TOKENS = 10
+
+
+class StubStreamingModel(BaseChatModel):
+    """
+    Streams a fixed number of segments and counts the tokens it sent.
+    """
+
+    segments: int = 19
+    segment_tokens: int = 150
+    token_seconds: float = 0.002
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def _llm_type(self):
+        return "stub-streaming"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = "".join(chunk.message.content for chunk in self._stream(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.prompt_tokens += ContextBudget(0).count(messages[-1].content)
+        for segment in range(self.segments):
+            for chunk in range(0, self.segment_tokens, CHUNK_TOKENS):
+                time.sleep(CHUNK_TOKENS * self.token_seconds)
+                self.completion_tokens += CHUNK_TOKENS
+                end = "\n\n" if chunk + CHUNK_TOKENS >= self.segment_tokens else ""
+                yield ChatGenerationChunk(message=AIMessageChunk(content=f"Segment {segment} words " + end))
+
+
+def run(model, text, max_pages, pages, more):
+    """
+    Build a story and return (pages kept, seconds to the first page, seconds in all).
+    """
+    model.prompt_tokens = model.completion_tokens = 0
+    story = Story(StoryConfig("adult", "english", text, "COMIC", "Color", max_pages=max_pages))
+    start = time.perf_counter()
+    first = []
+    if max_pages is None:
+        # The full story is only cut down once it is complete.
+        story.build_story()
+        story.build_pages()
+        story.pages = story.pages[:pages]
+    else:
+        story.build_story(on_segment=lambda segment: first.append(time.perf_counter() - start) if not first else None)
+        story.build_pages()
+    first_page = first[0] if first else time.perf_counter() - start
+    if more:
+        story.continue_story(more)
+    return len(story.pages), first_page, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pages", type=int, default=5, help="Pages shown up front.")
+    parser.add_argument("--segments", type=int, default=19, help="Segments the model writes if not stopped.")
+    parser.add_argument("--segment-tokens", type=int, default=150, help="Tokens per segment.")
+    parser.add_argument("--token-ms", type=float, default=2, help="Streaming latency per completion token.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    state = SQLiteState(os.path.join(directory, "shared_state.sqlite3"))
+    SharedState._shared = state
+    model = StubStreamingModel(segments=args.segments, segment_tokens=args.segment_tokens,
+                               token_seconds=args.token_ms / 1000)
+    ModelRouter._shared = ModelRouter(factory=lambda name: model)
+    episodes = EpisodeStore.shared()
+    text = episodes.episodes[episodes.order[0]]
+
+    scenarios = [("before", None, 0), ("max_pages", args.pages, 0), ("max_pages + continue", args.pages, args.pages)]
+    print(f"{args.segments} segments of {args.segment_tokens} tokens at {args.token_ms:g}ms per token")
+    print(f"{'scenario':<22}{'pages':>6}{'prompt':>8}{'completion':>12}{'first page':>12}{'total':>9}")
+    for (name, max_pages, more) in scenarios:
+        # A fresh cache, so every scenario calls the model.
+        LLMCache._shared = LLMCache(path=None, state=state)
+        Story._llm = None
+        (pages, first_page, seconds) = run(model, text, max_pages, args.pages, more)
+        print(f"{name:<22}{pages:>6}{model.prompt_tokens:>8}{model.completion_tokens:>12}"
+              f"{first_page:>11.2f}s{seconds:>8.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Replay of a synthetic /getstory/ trace through the LLMCache, reporting hit rates.
+
+Draws --requests requests for corpus episodes with Zipf-distributed popularity
+(exponent --zipf), each with a random age, image style and color, and runs the
+model calls of the story pipeline for each: the query transform, the story, the
+characters and one illustration prompt per page. Requests are asked for by the
+episode's title, and a --rephrased fraction of them by a reworded title, which
+misses story_query but nothing downstream of it.
+
+Models are stubbed with replies derived from a hash of the prompt, so identical
+prompts get identical replies as at temperature 0, and no API key is needed. The
+cache has an LRU of --max-entries in front of a temporary SQLite tier, as in a
+deployment; the report shows hits, misses and the hit rate per call site.
+
+Usage:
+
+    python benchmarks/llm_cache_replay.py
+    python benchmarks/llm_cache_replay.py --requests 2000 --zipf 1.3 --max-entries 256
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema.messages import AIMessage
+from langchain.schema.output import ChatGeneration, ChatResult
+
+from episode_store import EpisodeStore, EPISODE_NAME
+from llm_cache import LLMCache
+from model_router import ModelRouter
+from shared_state import SharedState, SQLiteState
+from story import Story
+from story_characters import StoryCharacters
+from story_config import StoryConfig, AgeRange, ImageGenStyle, Color
+from story_illustrator_query import StoryIllustratorQuery
+from story_query import StoryQuery
+
+NAMES = ["Karna", "Kunti", "Arjuna", "Krishna", "Draupadi", "Bhishma", "Drona", "Bhima"]
+
+
+class StubModel(BaseChatModel):
+    """
+    Replies deterministically to each prompt and counts its calls.
+    """
+
+    calls: int = 0
+
+    @property
+    def _llm_type(self):
+        return "stub-replay"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.calls += 1
+        prompt = messages[-1].content
+        seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+        if "functions" in kwargs:
+            names = random.Random(seed).sample(NAMES, 3)
+            characters = [
+                {"name": name, "description": "tall, dark-eyed", "attire": "silk", "gender": "male", "age": "30"}
+                for name in names
+            ]
+            arguments = json.dumps({"characters": characters})
+            message = AIMessage(content="", additional_kwargs={"function_call": {"name": "record_characters", "arguments": arguments}})
+        else:
+            pages = [f"{name} spoke at dawn, reply {seed}." for name in random.Random(seed).sample(NAMES, 4)]
+            message = AIMessage(content="\n\n".join(pages))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def trace(count, zipf, rephrased, seed=0):
+    """
+    Return count (query, episode text, age, style, color) requests.
+    """
+    episodes = EpisodeStore.shared()
+    names = list(episodes.order)
+    rng = random.Random(seed)
+    ranks = list(range(len(names)))
+    rng.shuffle(ranks)
+    weights = [1 / (rank + 1) ** zipf for rank in ranks]
+    requests = []
+    for name in rng.choices(names, weights, k=count):
+        match = EPISODE_NAME.search(name)
+        query = match.group(2) if match else name
+        if rng.random() < rephrased:
+            query = f"tell me the story of {query.lower()} {rng.randrange(1000)}"
+        requests.append((query, episodes.episodes[name], rng.choice(list(AgeRange)),
+                         rng.choice(list(ImageGenStyle)), rng.choice(list(Color))))
+    return requests
+
+
+def replay(request):
+    """
+    Make the model calls of the story pipeline for one request.
+    """
+    (query, text, age, style, color) = request
+    StoryQuery(query).transform_prompt()
+    config = StoryConfig(age.value, "english", text, style.value, color.value)
+    story = Story(config)
+    story.build_story()
+    story.build_pages()
+    characters = StoryCharacters(story, config)
+    characters.fetchCharacters()
+    for page in story.pages:
+        StoryIllustratorQuery(page, characters, config).generatePrompt()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=500, help="Number of requests to replay.")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of episode popularity.")
+    parser.add_argument("--rephrased", type=float, default=0.3, help="Fraction of queries with reworded titles.")
+    parser.add_argument("--max-entries", type=int, default=1024, help="Size of the in-memory LRU.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    state = SQLiteState(os.path.join(directory, "shared_state.sqlite3"))
+    SharedState._shared = state
+    cache = LLMCache(path=os.path.join(directory, "llm_cache.sqlite3"), max_entries=args.max_entries, state=state)
+    LLMCache._shared = cache
+    model = StubModel()
+    ModelRouter._shared = ModelRouter(factory=lambda name: model)
+
+    requests = trace(args.requests, args.zipf, args.rephrased)
+    start = time.perf_counter()
+    for request in requests:
+        replay(request)
+    seconds = time.perf_counter() - start
+
+    print(f"{len(requests)} requests over {len({r[1] for r in requests})} episodes in {seconds:.1f}s, "
+          f"{model.calls} model calls")
+    print(f"{'site':<22}{'hits':>8}{'misses':>8}{'hit rate':>10}")
+    total = {"hits": 0, "misses": 0}
+    for site in sorted(cache.stats):
+        stats = cache.stats[site]
+        calls = stats["hits"] + stats["misses"]
+        print(f"{site:<22}{stats['hits']:>8}{stats['misses']:>8}{stats['hits'] / calls:>10.0%}")
+        total = {key: total[key] + stats[key] for key in total}
+    print(f"{'all':<22}{total['hits']:>8}{total['misses']:>8}{total['hits'] / sum(total.values()):>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""
+Memory per cached story and serialization throughput, before and after slotting.
+
+Builds --stories stories of --pages pages over --texts corpus episodes, as a story
+cache holds them, and measures the memory each one takes with tracemalloc:
+
+- before: the layout the story types had before __slots__, reconstructed here.
+  Every object has a __dict__, every config holds its own copy of the source text
+  and a sha3_512 hasher, and every story holds its own ChatOpenAI client.
+- after: the current Page, PageContent, StoryConfig and Story, which share the
+  source text by text_id and one client between every story.
+
+It then times round trips of one story through nested dicts and json, as
+save_json did, and through StoryCodec, with and without the source text.
+
+Usage:
+
+    python benchmarks/story_memory_benchmark.py
+    python benchmarks/story_memory_benchmark.py --stories 5000 --pages 12
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.chat_models import ChatOpenAI
+
+from episode_store import EpisodeStore
+from page import Page
+from page_content import PageContent
+from story import Story
+from story_codec import StoryCodec, orjson
+from story_config import StoryConfig, AgeRange, Language, ImageGenStyle, Color, PageSz
+
+
+class LegacyPageContent:
+    def __init__(self, text, imageURL=None):
+        self.text = text
+        self.imageURL = imageURL
+
+
+class LegacyPage:
+    def __init__(self, content, pageNo):
+        self.content = content
+        self.pageNo = pageNo
+
+
+class LegacyStoryConfig:
+    def __init__(self, age, language, text, img_style, color=Color.COLOR, sz=PageSz.LG):
+        self.age = age
+        self.language = language
+        self.text = text
+        self.img_style = img_style
+        self.color = color
+        self.sz = sz
+        self.hasher = hashlib.sha3_512()
+        self.hasher.update(bytes(self.text, "utf-8"))
+        self.text_id = self.hasher.hexdigest()
+
+
+class LegacyStory:
+    def __init__(self, config):
+        self.config = config
+        self.pages = []
+        self.llm = ChatOpenAI(openai_api_key="sk-benchmark", temperature=0.0)
+        self.text = ""
+        self.name = f'{config.text_id}_{config.age}_{config.color}_{config.img_style}_{config.sz}'
+
+    def to_json(self):
+        config = self.config
+        return {
+            "config": {
+                "age": config.age.value, "language": config.language.value, "text": config.text,
+                "img_style": config.img_style.value, "color": config.color.value, "sz": config.sz.value,
+                "text_id": config.text_id
+            },
+            "pages": [
+                {"content": {"text": page.content.text, "imageURL": page.content.imageURL}, "pageNo": page.pageNo}
+                for page in self.pages
+            ],
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        config = data["config"]
+        story = cls(LegacyStoryConfig(
+            AgeRange(config["age"]), Language(config["language"]), config["text"],
+            ImageGenStyle(config["img_style"]), Color(config["color"]), PageSz(config["sz"])
+        ))
+        story.pages = [
+            LegacyPage(LegacyPageContent(page["content"]["text"], page["content"]["imageURL"]), page["pageNo"])
+            for page in data["pages"]
+        ]
+        return story
+
+
+def page_texts(count):
+    return [f"Page {i}: Karna stood by the river at dawn and spoke to Kunti of his armour. " * 3 for i in range(count)]
+
+
+def build_legacy(i, text, pages):
+    # The text arrives from retrieval as a new string for every request.
+    config = LegacyStoryConfig(AgeRange.ADULT, Language.ENGLISH, text.encode("utf-8").decode("utf-8"), ImageGenStyle.COMIC)
+    story = LegacyStory(config)
+    story.pages = [LegacyPage(LegacyPageContent(page, f"/assets/{i}/{n}"), n + 1) for (n, page) in enumerate(pages)]
+    return story
+
+
+def build_current(i, text, pages):
+    config = StoryConfig(AgeRange.ADULT, Language.ENGLISH, text.encode("utf-8").decode("utf-8"), ImageGenStyle.COMIC)
+    story = Story(config)
+    story.pages = [Page(PageContent(page, f"/assets/{i}/{n}"), n + 1) for (n, page) in enumerate(pages)]
+    return story
+
+
+def memory_per_story(build, texts, count, pages):
+    """
+    Return the bytes allocated per story for count stories built by build.
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    stories = [build(i, texts[i % len(texts)], pages) for i in range(count)]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del stories
+    return (after - before) / count
+
+
+def round_trips(encode, decode, story, repeat):
+    """
+    Return (round trips per second, encoded bytes) for story.
+    """
+    data = encode(story)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode(encode(story))
+    return repeat / (time.perf_counter() - start), len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stories", type=int, default=2000, help="Number of stories held in memory.")
+    parser.add_argument("--pages", type=int, default=8, help="Pages per story.")
+    parser.add_argument("--texts", type=int, default=20, help="Number of distinct source texts.")
+    parser.add_argument("--repeat", type=int, default=2000, help="Round trips timed per serializer.")
+    args = parser.parse_args()
+
+    episodes = EpisodeStore.shared()
+    texts = [episodes.episodes[name] for name in episodes.order[:args.texts]]
+    pages = page_texts(args.pages)
+    # Create the shared client up front, as a running server would have.
+    Story._llm = ChatOpenAI(openai_api_key="sk-benchmark", temperature=0.0)
+
+    legacy = memory_per_story(build_legacy, texts, args.stories, pages)
+    current = memory_per_story(build_current, texts, args.stories, pages)
+    print(f"{args.stories} stories of {args.pages} pages over {len(texts)} texts")
+    print(f"memory per story: before {legacy / 1024:.1f}KiB, after {current / 1024:.1f}KiB "
+          f"({1 - current / legacy:.0%} less)")
+
+    codec = StoryCodec()
+    print(f"{'serializer':<26}{'round trips/s':>14}{'bytes':>9}")
+    serializers = [
+        ("to_json + json (before)", build_legacy(0, texts[0], pages),
+         lambda s: json.dumps(s.to_json()), lambda d: LegacyStory.from_json(json.loads(d))),
+        ("to_json + json", build_current(0, texts[0], pages),
+         lambda s: json.dumps(s.to_json()), lambda d: Story.from_json(json.loads(d))),
+        (f"StoryCodec ({'orjson' if orjson else 'json'})", build_current(0, texts[0], pages),
+         codec.encode, codec.decode),
+        ("StoryCodec without text", build_current(0, texts[0], pages),
+         lambda s: codec.encode(s, include_text=False), codec.decode),
+    ]
+    for (name, story, encode, decode) in serializers:
+        rate, size = round_trips(encode, decode, story, args.repeat)
+        print(f"{name:<26}{rate:>14.0f}{size:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Benchmark of StoryStore at scale.
+
+Bulk-inserts --stories stories into a temporary store with save_many, in batches
+of --batch, then times point lookups by name and a paginated text_id query at
+--offset. Stories are spread evenly over --texts source texts and every age,
+style and color, and differ in max_pages, each with one short page. With one text
+the text_id query pages through every story in the store.
+
+Usage:
+
+    python benchmarks/story_store_benchmark.py
+    python benchmarks/story_store_benchmark.py --stories 10000 --offset 5000
+"""
+import argparse
+import itertools
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from page import Page
+from page_content import PageContent
+from story import Story
+from story_config import StoryConfig, AgeRange, ImageGenStyle, Color
+from story_store import StoryStore
+
+
+def make_stories(count, texts):
+    """
+    Yield count distinct stories over the given number of source texts.
+    """
+    variants = list(itertools.product(AgeRange, ImageGenStyle, Color))
+    sources = [f"Episode {n}. " + "Karna was born to Kunti. " * 40 for n in range(texts)]
+    for i in range(count):
+        (age, style, color) = variants[i % len(variants)]
+        text = sources[i // len(variants) % texts]
+        # max_pages tells apart the stories with the same text and options.
+        max_pages = i // len(variants) // texts + 1
+        story = Story(StoryConfig(age.value, "english", text, style.value, color.value, max_pages=max_pages))
+        story.text = f"Story {i}."
+        story.pages = [Page(PageContent(f"Page of story {i}.", None), pageNo=1)]
+        yield story
+
+
+def timed(function, repeat):
+    """
+    Return the median seconds of repeat calls of function.
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stories", type=int, default=100_000, help="Number of stories to insert.")
+    parser.add_argument("--texts", type=int, default=1, help="Number of source texts the stories share.")
+    parser.add_argument("--batch", type=int, default=10_000, help="Stories per save_many transaction.")
+    parser.add_argument("--offset", type=int, default=50_000, help="Offset of the paginated text_id query.")
+    parser.add_argument("--lookups", type=int, default=1000, help="Number of point lookups to time.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = StoryStore(os.path.join(directory, "stories.sqlite3"))
+        names = []
+        start = time.perf_counter()
+        stories = make_stories(args.stories, args.texts)
+        while batch := list(itertools.islice(stories, args.batch)):
+            store.save_many(batch)
+            names.extend(story.key() for story in batch)
+        insert_seconds = time.perf_counter() - start
+        print(f"bulk insert: {store.count()} stories in {insert_seconds:.2f}s")
+
+        sample = random.Random(0).sample(names, min(args.lookups, len(names)))
+        start = time.perf_counter()
+        for name in sample:
+            assert store.get(name) is not None
+        lookup_seconds = (time.perf_counter() - start) / len(sample)
+        print(f"point lookup: {lookup_seconds * 1e6:.0f}us mean of {len(sample)}")
+
+        text_id = store.get(names[0]).config.text_id
+        query_seconds = timed(lambda: store.find(limit=50, offset=args.offset, text_id=text_id), 5)
+        print(f"text_id query: 50 stories at offset {args.offset} in {query_seconds * 1e3:.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
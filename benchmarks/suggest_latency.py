@@ -0,0 +1,65 @@
+"""
+Build time and per-query latency of the /suggest typeahead index.
+
+Times loading the corpus into an EpisodeStore and building a SuggestIndex over it,
+each the median of --builds runs. It then times SuggestIndex.suggest for a set of
+typical queries: short and whole-word prefixes, multi-word queries, typos that
+only trigrams match, and single letters, which match the most entries. Each query
+time is the median of --repeat batches of --number calls.
+
+Usage:
+
+    python benchmarks/suggest_latency.py
+    python benchmarks/suggest_latency.py --number 1000 "arj" "bhima gada"
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from episode_store import EpisodeStore
+from suggest_index import SuggestIndex
+
+QUERIES = ["k", "kar", "karna", "partha", "vyasa scr", "bhishma vow", "draupdi", "yudhistira"]
+
+
+def median_seconds(function, runs):
+    """
+    Return the median seconds of runs calls of function, and its last result.
+    """
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return statistics.median(seconds), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("queries", nargs="*", default=QUERIES, help="Queries to time.")
+    parser.add_argument("--builds", type=int, default=5, help="Index builds to time.")
+    parser.add_argument("--repeat", type=int, default=10, help="Batches timed per query.")
+    parser.add_argument("--number", type=int, default=200, help="Calls per batch.")
+    args = parser.parse_args()
+
+    load_seconds, episodes = median_seconds(EpisodeStore, args.builds)
+    build_seconds, index = median_seconds(lambda: SuggestIndex(episodes), args.builds)
+    print(f"corpus load: {load_seconds * 1e3:.1f}ms ({len(episodes.episodes)} episodes)")
+    print(f"index build: {build_seconds * 1e3:.1f}ms ({len(index.entries)} entries)")
+
+    print(f"{'query':<16}{'median':>10}{'results':>9}  top suggestion")
+    for query in args.queries:
+        batches = timeit.repeat(lambda: index.suggest(query), repeat=args.repeat, number=args.number)
+        seconds = statistics.median(batches) / args.number
+        suggestions = index.suggest(query)
+        top = f"{suggestions[0]['label']} -> {suggestions[0]['episode']}" if suggestions else "-"
+        print(f"{query:<16}{seconds * 1e6:>8.0f}us{len(suggestions):>9}  {top}")
+
+
+if __name__ == "__main__":
+    main()
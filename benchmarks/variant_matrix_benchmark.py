@@ -0,0 +1,143 @@
+"""
+Tokens and latency of building the full variant matrix of one episode.
+
+Builds the text of every combination of age, language, page size, image style and
+color for a source text of --episodes consecutive corpus episodes, with a stub
+model that streams --max-pages segments whose length follows the requested page
+size, at --token-ms per completion token. It compares:
+
+- independent: every variant generated from the source, as before StoryVariants,
+  with the LLM cache bypassed,
+- llm cache: the same with the LLM cache, which already merges the variants that
+  differ only in image style or color, since their prompts are identical, and
+- variants: StoryVariants, with the base story requested first as the prefetcher
+  does, so every other text is a rewrite of it.
+
+Latency is the sum over variants built one after another. Only completion tokens
+take time in the stub, so the prompt tokens a rewrite saves do not show in it.
+
+Usage:
+
+    python benchmarks/variant_matrix_benchmark.py
+    python benchmarks/variant_matrix_benchmark.py --episodes 1 --max-pages 10
+"""
+import argparse
+from collections import Counter
+import itertools
+import os
+import re
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema.messages import AIMessage, AIMessageChunk
+from langchain.schema.output import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from context_budget import ContextBudget
+from episode_store import EpisodeStore
+from llm_cache import LLMCache
+from model_router import ModelRouter
+from shared_state import SharedState, SQLiteState
+from story import Story
+from story_config import StoryConfig, AgeRange, Language, PageSz, ImageGenStyle, Color
+from story_store import StoryStore
+from story_variants import StoryVariants, BASE_AGE, BASE_LANGUAGE, BASE_SIZE
+
+# Completion tokens per segment for each page size.
+SEGMENT_TOKENS = {"small": 60, "medium": 100, "large": 150}
+
+# Tokens in each streamed chunk.
+CHUNK_TOKENS = 10
+
+
+class StubVariantModel(BaseChatModel):
+    """
+    Streams segments sized as the prompt asks and counts tokens per kind of call.
+    """
+
+    segments: int = 5
+    token_seconds: float = 0.0002
+    tokens: Counter = Counter()
+    calls: Counter = Counter()
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self):
+        return "stub-variants"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = "".join(chunk.message.content for chunk in self._stream(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        prompt = messages[-1].content
+        kind = "rewrite" if "Rewrite the following story" in prompt else "generate"
+        self.calls[kind] += 1
+        self.tokens["prompt"] += ContextBudget(0).count(prompt)
+        size = re.search(r"Make each segment (\w+) in size", prompt).group(1)
+        for segment in range(self.segments):
+            for chunk in range(0, SEGMENT_TOKENS[size], CHUNK_TOKENS):
+                time.sleep(CHUNK_TOKENS * self.token_seconds)
+                self.tokens["completion"] += CHUNK_TOKENS
+                end = "\n\n" if chunk + CHUNK_TOKENS >= SEGMENT_TOKENS[size] else ""
+                yield ChatGenerationChunk(message=AIMessageChunk(content=f"Segment {segment} words " + end))
+
+
+def matrix(text, max_pages):
+    """
+    Return a Story for every variant, the base first.
+    """
+    configs = sorted(
+        itertools.product(AgeRange, Language, PageSz, ImageGenStyle, Color),
+        key=lambda c: (c[0].value, c[1].value, c[2].value) != (BASE_AGE, BASE_LANGUAGE, BASE_SIZE)
+    )
+    return [
+        Story(StoryConfig(age.value, language.value, text, style.value, color.value, size.value, max_pages=max_pages))
+        for (age, language, size, style, color) in configs
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--episodes", type=int, default=5, help="Consecutive corpus episodes in the source text.")
+    parser.add_argument("--max-pages", type=int, default=5, help="Pages per story.")
+    parser.add_argument("--token-ms", type=float, default=0.2, help="Streaming latency per completion token.")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    state = SQLiteState(os.path.join(directory, "shared_state.sqlite3"))
+    SharedState._shared = state
+    model = StubVariantModel(segments=args.max_pages, token_seconds=args.token_ms / 1000)
+    ModelRouter._shared = ModelRouter(factory=lambda name: model)
+    episodes = EpisodeStore.shared()
+    text = "\n\n".join(episodes.episodes[name] for name in episodes.order[:args.episodes])
+
+    print(f"variant matrix of {len(matrix(text, args.max_pages))} configs over {args.episodes} episodes, "
+          f"{args.max_pages} pages each")
+    print(f"{'approach':<14}{'generations':>12}{'rewrites':>10}{'prompt':>9}{'completion':>12}{'seconds':>9}")
+    for approach in ("independent", "llm cache", "variants"):
+        LLMCache._shared = LLMCache(path=None, state=state)
+        if approach == "independent":
+            LLMCache._shared.bypass = {"build_story"}
+        Story._llm = None
+        model.tokens.clear()
+        model.calls.clear()
+        variants = StoryVariants(StoryStore(os.path.join(directory, f"{approach}.sqlite3")), state=state)
+        start = time.perf_counter()
+        for story in matrix(text, args.max_pages):
+            if approach == "variants":
+                variants.build(story)
+            else:
+                story.build_story()
+        seconds = time.perf_counter() - start
+        print(f"{approach:<14}{model.calls['generate']:>12}{model.calls['rewrite']:>10}"
+              f"{model.tokens['prompt']:>9}{model.tokens['completion']:>12}{seconds:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+import threading
+
+
+class Cancelled(Exception):
+    """
+    Raised inside the pipeline when the request it is working for has been cancelled.
+    """
+
+
+class CancelToken:
+    """
+    Cooperative cancellation flag shared by every stage of a story request.
+
+    The web layer cancels the token when the client disconnects; LLM streams and
+    image polling loops check it between steps and stop early by raising Cancelled.
+
+    Example usage:
+
+    >>> token = CancelToken()
+    >>> story.build_story(cancel_token=token)
+    >>> token.cancel()  # from another thread, e.g. when the client disconnects
+    """
+
+    def __init__(self):
+        """
+        Initialize a CancelToken instance.
+        """
+        self.event = threading.Event()
+
+    def cancel(self):
+        """
+        Cancel the request this token belongs to.
+        """
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        """
+        Whether the request has been cancelled.
+        """
+        return self.event.is_set()
+
+    def check(self):
+        """
+        Raise Cancelled if the request has been cancelled.
+        """
+        if self.event.is_set():
+            raise Cancelled()
+
+    def sleep(self, seconds):
+        """
+        Sleep for seconds, waking up and raising Cancelled as soon as the request is cancelled.
+        """
+        if self.event.wait(seconds):
+            raise Cancelled()
@@ -0,0 +1,196 @@
+import json
+import logging
+import re
+
+REQUIRED_KEYS = ['description', 'name', 'attire', 'gender', 'age']
+
+CHARACTER_FUNCTION = {
+    "name": "record_characters",
+    "description": "Record a physical description for every character in the story.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "characters": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "description": {
+                            "type": "string",
+                            "description": "Comma-separated adjectives for physical and facial features."
+                        },
+                        "attire": {"type": "string"},
+                        "gender": {"type": "string"},
+                        "age": {"type": "string"}
+                    },
+                    "required": REQUIRED_KEYS
+                }
+            }
+        },
+        "required": ["characters"]
+    }
+}
+
+
+class CharacterParser:
+    """
+    Tolerant parser for character descriptions returned by a language model.
+
+    Model output is not guaranteed to be clean JSON: it may be wrapped in prose or
+    code fences, cut off mid-object, or drift from the requested schema. This class
+    salvages whatever complete entries it can and separates them into valid entries
+    and entries that need a targeted repair call.
+
+    Example usage:
+
+    >>> parser = CharacterParser()
+    >>> valid, invalid = parser.parse('Sure! {"karna": {"name": "Karna", "age": "30"')
+    >>> print(invalid)
+    {'karna': {'name': 'Karna', 'age': '30'}}
+    """
+
+    _fence = re.compile(r"```(?:json)?")
+    _starts = re.compile(r"[{\[]")
+
+    def parse(self, text):
+        """
+        Parse model output into valid and invalid character entries.
+
+        Args:
+            text (str): Raw text or function-call arguments returned by the model.
+
+        Returns:
+            tuple: (valid, invalid) dicts mapping character name to its entry.
+        """
+        data = self.loads(text)
+        if data is None:
+            logging.warning("Could not salvage any JSON from character output.")
+            return {}, {}
+        return self.validate(self.normalize(data))
+
+    def loads(self, text):
+        """
+        Decode the first JSON object or array in text that holds anything, closing
+        it off if it was truncated. Braces in prose before the JSON, such as
+        "{hero}", are skipped.
+
+        Args:
+            text (str): Raw model output.
+
+        Returns:
+            The decoded value, or None if nothing could be salvaged.
+        """
+        text = self._fence.sub("", text or "")
+        decoder = json.JSONDecoder()
+        for start in self._starts.finditer(text):
+            candidate = text[start.start():]
+            try:
+                value = decoder.raw_decode(candidate)[0]
+                if _has_entries(value):
+                    return value
+                continue
+            except json.JSONDecodeError:
+                pass
+            for repaired in self._truncations(candidate):
+                try:
+                    value = json.loads(repaired)
+                except json.JSONDecodeError:
+                    continue
+                if _has_entries(value):
+                    return value
+                break
+        return None
+
+    def _truncations(self, text):
+        """
+        Yield repaired prefixes of a truncated JSON document, longest first.
+
+        A prefix may end after any complete string, number, literal, object or
+        array, or right after a container was opened, so a truncated entry keeps
+        the keys it had before the cut. Prefixes that end after a dangling key
+        do not parse and are skipped by the caller. The still-open containers are
+        closed off.
+        """
+        stack = []
+        cuts = []
+        in_string = False
+        escaped = False
+        for i, ch in enumerate(text):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+                    cuts.append((i + 1, "".join(reversed(stack))))
+                continue
+            if ch == '"':
+                in_string = True
+            elif ch in "{[":
+                stack.append("}" if ch == "{" else "]")
+                cuts.append((i + 1, "".join(reversed(stack))))
+            elif ch in "}]":
+                if not stack:
+                    break
+                stack.pop()
+                if not stack:
+                    break
+                cuts.append((i + 1, "".join(reversed(stack))))
+            elif ch == "," and stack:
+                # Ends a number or literal such as true or null.
+                cuts.append((i, "".join(reversed(stack))))
+        for end, closers in reversed(cuts):
+            yield text[:end].rstrip().rstrip(",") + closers
+
+    def normalize(self, data):
+        """
+        Coerce the shapes models commonly return into a name -> entry mapping.
+
+        Accepts {"characters": [...]}, a bare list of entries, or a mapping from
+        names to entries.
+        """
+        if isinstance(data, dict) and isinstance(data.get("characters"), list):
+            data = data["characters"]
+        if isinstance(data, list):
+            entries = {}
+            for i, entry in enumerate(data):
+                if isinstance(entry, dict):
+                    entries[str(entry.get("name") or f"character {i}")] = entry
+            return entries
+        if isinstance(data, dict):
+            return {str(name): entry for (name, entry) in data.items() if isinstance(entry, dict)}
+        return {}
+
+    def validate(self, entries):
+        """
+        Split entries into those carrying every required key and those that do not.
+
+        Args:
+            entries (dict): Mapping from character name to entry.
+
+        Returns:
+            tuple: (valid, invalid) dicts mapping character name to its entry.
+        """
+        valid = {}
+        invalid = {}
+        for name, entry in entries.items():
+            entry.setdefault("name", name)
+            if all(entry.get(key) not in (None, "") for key in REQUIRED_KEYS):
+                valid[name] = {key: str(entry[key]) for key in REQUIRED_KEYS}
+            else:
+                invalid[name] = entry
+        return valid, invalid
+
+
+def _has_entries(value):
+    """
+    Whether a decoded value could hold character entries: a non-empty object, or an
+    array containing an object.
+    """
+    if isinstance(value, dict):
+        return bool(value)
+    if isinstance(value, list):
+        return any(isinstance(item, dict) for item in value)
+    return False
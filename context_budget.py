@@ -0,0 +1,194 @@
+import functools
+import json
+import logging
+import re
+from langchain import PromptTemplate
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Token budgets for the inputs embedded into each downstream prompt.
+CHARACTER_STORY_BUDGET = 2500
+PAGE_CHARACTER_BUDGET = 400
+DESCRIPTION_BUDGET = 40
+
+
+@functools.lru_cache(maxsize=None)
+def _load_encoding(model):
+    """
+    Load the tokenizer for model once per process, or None if it is unavailable.
+    """
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logging.warning(f"Could not load tokenizer for {model}; estimating token counts.")
+        return None
+
+
+class CharacterMatcher:
+    """
+    Finds which characters are mentioned in a piece of text.
+
+    All names are compiled into a single case-insensitive regular expression, so a
+    page is scanned once regardless of how many characters the story has.
+
+    Example usage:
+
+    >>> matcher = CharacterMatcher({"karna": {"name": "Karna"}, "kunti": {"name": "Kunti"}})
+    >>> print(matcher.mentioned("Kunti came to Karna by the river."))
+    """
+
+    def __init__(self, characters):
+        """
+        Initialize a CharacterMatcher instance.
+
+        Args:
+            characters (dict): Mapping from character key to its description entry.
+        """
+        self.aliases = {}
+        for key, entry in characters.items():
+            for alias in {key, str(entry.get("name", key))}:
+                if alias.strip():
+                    self.aliases[alias.lower()] = key
+        names = sorted(self.aliases, key=len, reverse=True)
+        self.pattern = re.compile(
+            r"\b(" + "|".join(re.escape(name) for name in names) + r")\b",
+            re.IGNORECASE
+        ) if names else None
+
+    def mentioned(self, text):
+        """
+        Return the keys of the characters mentioned in text, in order of first mention.
+        """
+        if self.pattern is None:
+            return []
+        found = {}
+        for match in self.pattern.finditer(text):
+            found.setdefault(self.aliases[match.group(0).lower()], None)
+        return list(found)
+
+
+class ContextBudget:
+    """
+    Builds prompt inputs that fit within a token budget.
+
+    Every call site that embeds the story text or the character JSON into a prompt
+    gets a fixed budget, so prompt size no longer grows with story length and page
+    count.
+
+    Attributes:
+        max_tokens (int): The token budget for the input being built.
+
+    Example usage:
+
+    >>> budget = ContextBudget(PAGE_CHARACTER_BUDGET)
+    >>> characters = budget.compact_characters(story_characters.json, page.content.text)
+    >>> text = ContextBudget(CHARACTER_STORY_BUDGET).fit_story(story.text, ModelRouter.shared())
+    """
+
+    def __init__(self, max_tokens, model="gpt-3.5-turbo"):
+        """
+        Initialize a ContextBudget instance.
+
+        Args:
+            max_tokens (int): The token budget for the input being built.
+            model (str, optional): The model whose tokenizer is used for counting.
+        """
+        self.max_tokens = max_tokens
+        self.encoding = _load_encoding(model)
+
+    def count(self, text):
+        """
+        Count the tokens in text, estimating four characters per token without tiktoken.
+        """
+        if self.encoding is None:
+            return len(text) // 4 + 1
+        return len(self.encoding.encode(text))
+
+    def truncate(self, text, max_tokens):
+        """
+        Truncate text to at most max_tokens tokens.
+        """
+        if self.encoding is None:
+            return text[:max_tokens * 4]
+        tokens = self.encoding.encode(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max_tokens]).rstrip() + "..."
+
+    def compact_characters(self, characters, text):
+        """
+        Keep only the characters mentioned in text, with truncated descriptions.
+
+        Characters are dropped in reverse order of first mention until the JSON fits
+        within the budget.
+
+        Args:
+            characters (dict): Mapping from character key to its description entry.
+            text (str): The text the characters must be mentioned in.
+
+        Returns:
+            str: A JSON string of the compacted characters.
+        """
+        compact = {}
+        for key in CharacterMatcher(characters).mentioned(text):
+            compact[key] = {
+                field: self.truncate(str(value), DESCRIPTION_BUDGET)
+                for (field, value) in characters[key].items()
+            }
+        encoded = json.dumps(compact)
+        while compact and self.count(encoded) > self.max_tokens:
+            compact.pop(list(compact)[-1])
+            encoded = json.dumps(compact)
+        return encoded
+
+    def fit_story(self, text, router):
+        """
+        Return text unchanged if it fits the budget, otherwise a rolling summary of it.
+
+        The text is split into segments that each fit within the budget; each segment
+        is folded into the summary of everything before it.
+
+        Args:
+            text (str): The story text.
+            router (ModelRouter): Writes the summaries on its "story_summary" route.
+
+        Returns:
+            str: Text that fits within the budget.
+        """
+        if self.count(text) <= self.max_tokens:
+            return text
+        prompt = PromptTemplate.from_template("""
+        Here is a summary of a story so far {summary} and here is the next part of the story {segment}.
+        Rewrite the summary to include the next part. Keep every character's name and
+        any details about their appearance, clothing, age and gender.
+        """)
+        summary = ""
+        for segment in self._segments(text, self.max_tokens // 2):
+            summary = self.truncate(
+                router.predict("story_summary", prompt.format(summary=summary, segment=segment)),
+                self.max_tokens // 2
+            )
+        logging.info(f"Summarized story from {self.count(text)} to {self.count(summary)} tokens.")
+        return summary
+
+    def _segments(self, text, max_tokens):
+        """
+        Split text on paragraph boundaries into segments of at most max_tokens tokens.
+        """
+        segment = ""
+        for paragraph in filter(lambda x: x.strip(), text.split("\n\n")):
+            paragraph = self.truncate(paragraph, max_tokens)
+            if segment and self.count(segment + "\n\n" + paragraph) > max_tokens:
+                yield segment
+                segment = paragraph
+            else:
+                segment = f"{segment}\n\n{paragraph}" if segment else paragraph
+        if segment:
+            yield segment
@@ -1,51 +1,194 @@
-import requests
-from bs4 import BeautifulSoup
+import asyncio
+import hashlib
+import json
+import os
 import re
+import sys
+import time
+from pathlib import Path
+
+import aiohttp
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from atomic_file import write_atomic
 
 # Define the URL of the main page containing the links to stories
 main_url = "https://microfables.blogspot.com/2020/11/tiny-tales-from-mahabharata.html"
 
-# Send an HTTP GET request to the main page
-main_response = requests.get(main_url)
-
 # Define the regex pattern to match the desired links
 link_pattern = re.compile(r"https://microfables\.blogspot\.com/2020/11/.*")
 
-# Define a regex pattern to extract the title from the story content
-title_pattern = re.compile(r"^\d+\.\s+(.*)$")
-
-# Check if the request was successful
-if main_response.status_code == 200:
-    # Parse the HTML content of the main page using BeautifulSoup
-    main_soup = BeautifulSoup(main_response.content, "html.parser")
-
-    # Find and extract the links to individual story pages using the regex pattern
-    story_links = main_soup.find_all("a", href=link_pattern)
-
-    # Loop through each story link and scrape the content from the individual story page
-    for link in story_links:
-        story_url = link["href"]
-        story_response = requests.get(story_url)
-        
-        # Check if the request for the individual story page was successful
-        if story_response.status_code == 200:
-            # Parse the HTML content of the individual story page using BeautifulSoup
-            story_soup = BeautifulSoup(story_response.content, "html.parser")
-            
-            # Find and extract the story content
-            story_content = story_soup.find("div", class_="post-body")
-            
-            # Extract the title from the story content
-            story_text = story_content.get_text()
-            title = story_soup.find("h3").text
-            
-            # Create a new file with the title and write the story content to it
-            with open(f"{title}.txt", "w", encoding="utf-8") as story_file:
-                story_file.write(story_text)
-                
-            print(f"Saved story: {title}")
-        else:
-            print(f"Failed to retrieve the story page: {story_url}")
-
-else:
-    print("Failed to retrieve the main page.")
+CORPUS_DIR = Path(__file__).resolve().parent / "Mahabharata"
+
+# Validators and content hashes of every page fetched so far, used to skip unchanged pages.
+MANIFEST_PATH = Path(__file__).resolve().parent / "scrape_manifest.json"
+
+# JSON list of the episode files written or rewritten by the last run, for
+# VectorStore/create_db.py to re-index. Episode titles contain new lines, so the
+# list is not one path per line.
+CHANGED_FILES_PATH = Path(__file__).resolve().parent / "changed_files.json"
+
+# Maximum number of requests in flight at once.
+CONCURRENCY = 8
+
+RETRIES = 3
+TIMEOUT = aiohttp.ClientTimeout(total=30)
+
+
+class Scraper:
+    """
+    Incremental, concurrent scraper for the Tiny Tales from the Mahabharata blog.
+
+    Pages are fetched through a bounded connection pool with conditional requests.
+    The ETag and Last-Modified validators of every page are kept in a manifest, so a
+    page that has not changed since the last run costs a 304 and nothing is written.
+    Validators are only saved once a page has been processed, and are not sent when
+    the page's episode file is missing, so a page that failed to parse or whose file
+    was deleted is fetched in full again.
+    Episodes are written atomically into corpus/Mahabharata, and the files that were
+    added or changed are listed in changed_files.json for the indexer.
+
+    Attributes:
+        manifest (dict): Mapping from URL to its validators, file and content hash.
+        changed (list): Paths of the episode files written by this run.
+        stats (dict): Counts of fetched, unchanged, written and failed pages.
+
+    Example usage:
+
+    >>> scraper = Scraper()
+    >>> changed = asyncio.run(scraper.run())
+    >>> print(scraper.stats)
+    """
+
+    def __init__(self, index_url=main_url, corpus_dir=CORPUS_DIR, manifest_path=MANIFEST_PATH,
+                 concurrency=CONCURRENCY, story_pattern=link_pattern):
+        """
+        Initialize a Scraper instance.
+
+        Args:
+            index_url (str, optional): The page that links to every story.
+            corpus_dir (Path, optional): Directory episodes are written to.
+            manifest_path (Path, optional): Where the manifest is kept between runs.
+            concurrency (int, optional): Maximum number of requests in flight.
+            story_pattern (re.Pattern, optional): Matches the links to story pages.
+        """
+        self.index_url = index_url
+        self.corpus_dir = Path(corpus_dir)
+        self.manifest_path = Path(manifest_path)
+        self.concurrency = concurrency
+        self.story_pattern = story_pattern
+        self.manifest = json.loads(self.manifest_path.read_text()) if self.manifest_path.exists() else {}
+        self.changed = []
+        self.stats = {"fetched": 0, "unchanged": 0, "written": 0, "failed": 0}
+
+    async def run(self):
+        """
+        Scrape the index page and every story it links to.
+
+        Returns:
+            list: Paths of the episode files that were added or changed.
+        """
+        self.corpus_dir.mkdir(parents=True, exist_ok=True)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(connector=connector, timeout=TIMEOUT) as session:
+            entry = self.manifest.setdefault(self.index_url, {})
+            (body, validators) = await self.fetch(session, self.index_url, conditional="links" in entry)
+            if body is not None:
+                soup = BeautifulSoup(body, "html.parser")
+                # Keep the links in the manifest so an unchanged index page still
+                # yields the story URLs to revalidate.
+                links = list(dict.fromkeys(link["href"] for link in soup.find_all("a", href=self.story_pattern)))
+                entry["links"] = links
+                entry.update(validators)
+            links = entry.get("links", [])
+            await asyncio.gather(*(self.scrape_story(session, url) for url in links if url != self.index_url))
+        write_atomic(self.manifest_path, json.dumps(self.manifest, indent=2, sort_keys=True).encode("utf-8"))
+        return self.changed
+
+    async def fetch(self, session, url, conditional=True):
+        """
+        Fetch url, retrying connection errors and server errors.
+
+        Args:
+            session (aiohttp.ClientSession): The session to fetch with.
+            url (str): The page to fetch.
+            conditional (bool, optional): Whether to send the validators saved in the
+                manifest, so that an unchanged page is answered with a 304.
+
+        Returns:
+            tuple: (body, validators). body is None if the page is unchanged or could
+                not be fetched. validators holds the response's ETag and Last-Modified,
+                for the caller to save in the manifest once the body is processed.
+        """
+        entry = self.manifest.setdefault(url, {})
+        headers = {}
+        if conditional and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if conditional and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        for attempt in range(RETRIES):
+            try:
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304:
+                        self.stats["unchanged"] += 1
+                        return None, {}
+                    if response.status >= 500:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status
+                        )
+                    if response.status != 200:
+                        print(f"Failed to retrieve {url}: HTTP {response.status}")
+                        self.stats["failed"] += 1
+                        return None, {}
+                    body = await response.read()
+                    self.stats["fetched"] += 1
+                    return body, {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                    }
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt + 1 == RETRIES:
+                    print(f"Failed to retrieve {url}: {e!r}")
+                    self.stats["failed"] += 1
+                    return None, {}
+                await asyncio.sleep(2 ** attempt)
+
+    async def scrape_story(self, session, url):
+        """
+        Fetch a story page and write its episode file if its text changed.
+        """
+        entry = self.manifest.setdefault(url, {})
+        written = entry.get("path") and (self.corpus_dir / entry["path"]).exists()
+        (body, validators) = await self.fetch(session, url, conditional=bool(written))
+        if body is None:
+            return
+        story_soup = BeautifulSoup(body, "html.parser")
+        story_content = story_soup.find("div", class_="post-body")
+        title = story_soup.find("h3")
+        if story_content is None or title is None:
+            print(f"No story found at {url}")
+            self.stats["failed"] += 1
+            return
+        story_text = story_content.get_text()
+        digest = hashlib.sha256(story_text.encode("utf-8")).hexdigest()
+        path = self.corpus_dir / f"{title.text}.txt"
+        if entry.get("sha256") == digest and entry.get("path") == path.name and path.exists():
+            entry.update(validators)
+            self.stats["unchanged"] += 1
+            return
+        write_atomic(path, story_text.encode("utf-8"))
+        entry.update(validators, sha256=digest, path=path.name)
+        self.changed.append(str(path))
+        self.stats["written"] += 1
+        print(f"Saved story: {title.text.strip()}")
+
+
+if __name__ == "__main__":
+    scraper = Scraper(index_url=sys.argv[1] if len(sys.argv) > 1 else main_url)
+    start = time.monotonic()
+    changed = asyncio.run(scraper.run())
+    elapsed = time.monotonic() - start
+    write_atomic(CHANGED_FILES_PATH, json.dumps(changed, indent=2).encode("utf-8"))
+    pages = scraper.stats["fetched"] + scraper.stats["unchanged"]
+    print(f"{scraper.stats}; {pages / elapsed:.1f} pages/sec; {len(changed)} changed files in {CHANGED_FILES_PATH}")
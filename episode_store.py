@@ -0,0 +1,172 @@
+from pathlib import Path
+import hashlib
+import re
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+CORPUS_DIR = "corpus/Mahabharata"
+
+# How VectorStore/create_db.py cuts episodes into chunks. chunk_index metadata
+# refers to the chunks this splitter produces.
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+CHUNK_SEPARATORS = ["\n\n", "\n", ". ", " "]
+
+# Episode files are named like "\n~ 103. The Pandavas Look for Water ~\n.txt".
+EPISODE_NAME = re.compile(r"~\s*(\d+)\.\s*(.*?)\s*~")
+
+
+class EpisodeStore:
+    """
+    In-memory store of the full text of every episode in the corpus.
+
+    The vector store only holds fixed-size chunks of each episode. This class maps a
+    retrieved chunk back to the episode it was cut from so that a story can be built
+    from the complete episode, or from a window around the chunk, without re-reading
+    the corpus from disk on every request.
+
+    Attributes:
+        episodes (dict): Mapping from episode file name to episode text.
+
+    Example usage:
+
+    >>> store = EpisodeStore.shared()
+    >>> text = store.stitch(document.metadata["source"], document.page_content)
+    >>> print(text)
+    """
+
+    _shared = None
+
+    def __init__(self, corpus_dir=CORPUS_DIR):
+        """
+        Initialize an EpisodeStore instance by loading every episode in corpus_dir.
+
+        Args:
+            corpus_dir (str, optional): Directory holding one .txt file per episode.
+        """
+        self.corpus_dir = Path(corpus_dir)
+        self.episodes = {
+            path.name: path.read_text(encoding="utf-8")
+            for path in sorted(self.corpus_dir.glob("*.txt"))
+        }
+        self.text_ids = {
+            hashlib.sha3_512(bytes(text, "utf-8")).hexdigest(): name
+            for (name, text) in self.episodes.items()
+        }
+        self.numbers = {}
+        for name in self.episodes:
+            match = EPISODE_NAME.search(name)
+            if match:
+                self.numbers[name] = int(match.group(1))
+        self.order = sorted(self.numbers, key=self.numbers.get)
+        self.names = {number: name for (name, number) in self.numbers.items()}
+        self.spans = {}
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the process-wide EpisodeStore, loading the corpus on first use.
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def episode(self, source):
+        """
+        Return the full text of the episode a document was loaded from.
+
+        Args:
+            source (str): The 'source' metadata of a retrieved document.
+
+        Returns:
+            str: The episode text, or None if the episode is not in the corpus.
+        """
+        return self.episodes.get(Path(source).name)
+
+    def chunk_spans(self, name):
+        """
+        Return the (start, end) offsets of the chunks create_db.py cuts an episode
+        into, in chunk_index order.
+        """
+        if name not in self.spans:
+            documents = chunk_splitter().create_documents([self.episodes[name]])
+            self.spans[name] = [
+                (document.metadata["start_index"], document.metadata["start_index"] + len(document.page_content))
+                for document in documents
+            ]
+        return self.spans[name]
+
+    def stitch(self, source, chunk, window=None, chunk_index=None):
+        """
+        Return the episode a chunk was cut from, or a window of it around the chunk.
+
+        The chunk is located by its chunk_index metadata when it has one, and by
+        searching the episode for its content otherwise. The window is widened to the
+        nearest sentence boundaries so that the result never starts or ends
+        mid-sentence.
+
+        Args:
+            source (str): The 'source' metadata of the retrieved chunk.
+            chunk (str): The content of the retrieved chunk.
+            window (int, optional): Characters to keep on either side of the chunk.
+                The full episode is returned when None.
+            chunk_index (int, optional): The 'chunk_index' metadata of the chunk.
+
+        Returns:
+            str: The stitched text, or the chunk itself if its episode is unknown.
+        """
+        text = self.episode(source)
+        if text is None:
+            return chunk
+        if window is None:
+            return text
+        spans = self.chunk_spans(Path(source).name)
+        if chunk_index is not None and 0 <= chunk_index < len(spans):
+            (start, end) = spans[chunk_index]
+        else:
+            start = text.find(chunk)
+            if start == -1:
+                return text
+            end = start + len(chunk)
+        start = max(0, start - window)
+        end = min(len(text), end + window)
+        boundaries = [m.end() for m in re.finditer(r"[.!?\"]\s+|\n", text)]
+        start = max([b for b in boundaries if b <= start], default=0)
+        end = min([b for b in boundaries if b >= end], default=len(text))
+        return text[start:end].strip()
+
+    def by_text_id(self, text_id):
+        """
+        Return the name of the episode whose full text has the given StoryConfig text_id.
+
+        Returns:
+            str: The episode file name, or None if text_id is not a full episode.
+        """
+        return self.text_ids.get(text_id)
+
+    def by_number(self, number):
+        """
+        Return the name of the episode with the given number in the saga, or None.
+        """
+        return self.names.get(number)
+
+    def next_episode(self, name):
+        """
+        Return the name of the episode that follows name in the saga, or None.
+        """
+        if name not in self.numbers:
+            return None
+        index = self.order.index(name)
+        return self.order[index + 1] if index + 1 < len(self.order) else None
+
+
+def chunk_splitter():
+    """
+    Returns the splitter that cuts episodes into the chunks stored in the vector store.
+    """
+    return RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        separators=CHUNK_SEPARATORS,
+        add_start_index=True
+    )
@@ -0,0 +1,281 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import numpy as np
+from dotenv import dotenv_values
+
+INDEX_PATH = "image_prompts.sqlite3"
+
+# Cosine similarity at or above which a previously rendered image is reused for a new
+# prompt, per embedder, from benchmarks/image_reuse_calibration.py at 1% false reuse.
+# Similarities are not comparable across embedders. HashingEmbeddings scores a
+# prompt with one character swapped as high as a rewording, so it only reuses
+# near-verbatim prompts. Images are never reused with an embedder that has no entry,
+# such as OpenAIEmbeddings until the calibration has been run against the API with
+# IMAGE_PROMPT_EMBEDDER=openai and recorded here; its prompts are still indexed.
+REUSE_THRESHOLDS = {
+    "HashingEmbeddings": 0.97,
+}
+
+# Overrides the embedder's threshold for every embedder when set.
+REUSE_THRESHOLD = os.environ.get("IMAGE_REUSE_THRESHOLD")
+
+# "local" embeds prompts with HashingEmbeddings, "openai" with OpenAIEmbeddings.
+EMBEDDER = os.environ.get("IMAGE_PROMPT_EMBEDDER", "local")
+
+# Audit trail of every reuse decision, separate from the application log.
+audit_log = logging.getLogger("image_reuse")
+
+
+class HashingEmbeddings:
+    """
+    Embeds text locally by hashing its words and word pairs into a fixed-size vector.
+
+    It needs no model or network access, which makes it suitable for offline catalog
+    runs and for environments without an OpenAI key. It only captures lexical
+    overlap, so thresholds tuned for it are not interchangeable with those for
+    OpenAIEmbeddings.
+
+    Example usage:
+
+    >>> embeddings = HashingEmbeddings()
+    >>> vector = embeddings.embed_query("Krishna addressing the Pandavas at court")
+    """
+
+    def __init__(self, dimensions=1024):
+        self.dimensions = dimensions
+
+    def embed_query(self, text):
+        words = re.findall(r"[a-z0-9]+", text.lower())
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for term in words + [f"{a} {b}" for (a, b) in zip(words, words[1:])]:
+            digest = hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest()
+            vector[int.from_bytes(digest, "little") % self.dimensions] += 1.0
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+class ImagePromptIndex:
+    """
+    Similarity index over image prompts that have already been rendered.
+
+    Many pages across the catalog produce nearly identical scene prompts, and each
+    one costs a multi-minute render. Every rendered prompt is embedded and stored
+    with the URL of its image, scoped by image style and color. Before a new prompt
+    is rendered, the most similar prompt in the same scope is looked up, and its
+    image is reused when the cosine similarity is at least the threshold, which
+    defaults to the embedder's entry in REUSE_THRESHOLDS. Every decision is written
+    to the "image_reuse" logger and to the decisions table.
+
+    Attributes:
+        threshold (float): Minimum cosine similarity for reuse, or None if images
+            are never reused.
+        stats (dict): Counts of reused and rendered prompts.
+
+    Example usage:
+
+    >>> index = ImagePromptIndex.shared()
+    >>> url = index.match(prompt, "COMIC", "Color")
+    >>> if url is None:
+    ...     url = render(prompt)
+    ...     index.add(prompt, "COMIC", "Color", url)
+    """
+
+    _shared = None
+
+    def __init__(self, path=INDEX_PATH, embeddings=None, threshold=None):
+        """
+        Initialize an ImagePromptIndex instance.
+
+        Args:
+            path (str, optional): Path of the SQLite file holding prompts and decisions.
+            embeddings (optional): A langchain Embeddings object; chosen by
+                IMAGE_PROMPT_EMBEDDER when None.
+            threshold (float, optional): Minimum cosine similarity for reuse;
+                IMAGE_REUSE_THRESHOLD or the embedder's REUSE_THRESHOLDS entry by default.
+                Images are never reused when there is neither.
+        """
+        self.embeddings = embeddings or _default_embeddings()
+        self.embedder = type(self.embeddings).__name__
+        if threshold is None:
+            threshold = float(REUSE_THRESHOLD) if REUSE_THRESHOLD else REUSE_THRESHOLDS.get(self.embedder)
+        self.threshold = threshold
+        self.stats = {"reused": 0, "rendered": 0}
+        self.lock = threading.Lock()
+        self.scopes = {}
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS prompts (
+                    embedder TEXT NOT NULL,
+                    style TEXT NOT NULL,
+                    color TEXT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    image_url TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (embedder, style, color, prompt)
+                )
+            """)
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS decisions (
+                    created_at REAL NOT NULL,
+                    style TEXT NOT NULL,
+                    color TEXT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    matched_prompt TEXT,
+                    similarity REAL,
+                    reused INTEGER NOT NULL,
+                    image_url TEXT
+                )
+            """)
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the process-wide ImagePromptIndex, creating it on first use.
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def match(self, prompt, style, color):
+        """
+        Return the image of the most similar rendered prompt in the same style and
+        color, or None if none is similar enough. The decision is audited either way.
+
+        Args:
+            prompt (str): The image prompt about to be rendered.
+            style (str): The config's image style.
+            color (str): The config's color setting.
+
+        Returns:
+            str: The URL of the image to reuse, or None to render a new one.
+        """
+        scope = (str(style), str(color))
+        vector = self._embed(prompt)
+        with self.lock:
+            entries = self._scope(scope)
+            (prompts, urls) = (entries.prompts, entries.urls)
+            best, similarity = None, None
+            if prompts:
+                scores = entries.matrix() @ vector
+                best = int(np.argmax(scores))
+                similarity = float(scores[best])
+            reused = similarity is not None and self.threshold is not None and similarity >= self.threshold
+            self.stats["reused" if reused else "rendered"] += 1
+            matched = prompts[best] if best is not None else None
+            url = urls[best] if reused else None
+            with self.connection:
+                self.connection.execute(
+                    "INSERT INTO decisions VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (time.time(), scope[0], scope[1], prompt, matched, similarity, int(reused), url)
+                )
+        audit_log.info(
+            f"{'Reused' if reused else 'Rendering'} image for {scope[0]}/{scope[1]} prompt {prompt!r}; "
+            f"closest {matched!r} at similarity {similarity if similarity is None else round(similarity, 4)} "
+            f"(threshold {self.threshold})"
+        )
+        return url
+
+    def add(self, prompt, style, color, image_url):
+        """
+        Record that prompt was rendered to image_url so later prompts can reuse it.
+
+        The prompt is appended to its scope in memory if the scope is loaded, rather
+        than reloading the scope.
+        """
+        scope = (str(style), str(color))
+        vector = self._embed(prompt)
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO prompts VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.embedder, scope[0], scope[1], prompt, image_url, vector.tobytes(), time.time())
+            )
+            if scope in self.scopes:
+                self.scopes[scope].add(prompt, image_url, vector)
+
+    def _embed(self, prompt):
+        """
+        Return the unit-length embedding of a prompt, ignoring Midjourney parameters.
+        """
+        vector = np.asarray(self.embeddings.embed_query(_scene(prompt)), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _scope(self, scope):
+        """
+        Return the _ScopeEntries of a style and color, loading them from disk on
+        first use. Must be called with the lock held.
+        """
+        if scope not in self.scopes:
+            rows = self.connection.execute(
+                "SELECT prompt, image_url, vector FROM prompts WHERE embedder = ? AND style = ? AND color = ?",
+                (self.embedder,) + scope
+            ).fetchall()
+            entries = _ScopeEntries()
+            for (prompt, image_url, vector) in rows:
+                entries.add(prompt, image_url, np.frombuffer(vector, dtype=np.float32))
+            self.scopes[scope] = entries
+        return self.scopes[scope]
+
+
+class _ScopeEntries:
+    """
+    The rendered prompts of one style and color, with their embeddings as the rows
+    of a matrix that grows by doubling, so adding a prompt does not copy the rest.
+    """
+
+    def __init__(self):
+        self.prompts = []
+        self.urls = []
+        self.rows = {}
+        self.vectors = None
+
+    def add(self, prompt, image_url, vector):
+        """
+        Add a prompt, or replace the image and embedding of one already present.
+        """
+        row = self.rows.get(prompt)
+        if row is None:
+            row = len(self.prompts)
+            if self.vectors is None:
+                self.vectors = np.zeros((16, len(vector)), dtype=np.float32)
+            elif row == len(self.vectors):
+                self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.rows[prompt] = row
+            self.prompts.append(prompt)
+            self.urls.append(image_url)
+        self.urls[row] = image_url
+        self.vectors[row] = vector
+
+    def matrix(self):
+        """
+        Return the embeddings of the prompts, one row per prompt.
+        """
+        return self.vectors[:len(self.prompts)]
+
+
+def _scene(prompt):
+    """
+    Returns the scene description of a prompt without its "::3 --seed 100" suffix.
+    """
+    return prompt.split("::")[0].strip()
+
+
+def _default_embeddings():
+    """
+    Returns the embedder selected by IMAGE_PROMPT_EMBEDDER.
+    """
+    if EMBEDDER == "local":
+        return HashingEmbeddings()
+    from langchain.embeddings.openai import OpenAIEmbeddings
+    return OpenAIEmbeddings(openai_api_key=dotenv_values(".env").get("OPENAI_API_KEY"))
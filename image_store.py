@@ -0,0 +1,211 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import threading
+
+import requests
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+from atomic_file import write_atomic
+
+ASSET_DIR = "image_assets"
+
+# URL prefix under which main.py serves stored assets.
+ASSET_PREFIX = "/assets"
+
+# Resized variants generated for every image: name -> maximum width in pixels.
+VARIANT_WIDTHS = {
+    "thumb": 256,
+    "page": 1024,
+}
+
+VARIANT_FORMATS = {
+    "webp": "WEBP",
+    "jpeg": "JPEG",
+}
+
+
+class ImageStore:
+    """
+    Content-addressed local store for generated illustrations and character faces.
+
+    Image URLs returned by the image generator expire after a few minutes and point
+    at a slow third-party CDN. Each image is downloaded once, stored under the
+    SHA-256 of its bytes and referred to by a local URL from then on. Resized WebP
+    and JPEG variants are generated in a worker pool.
+
+    Attributes:
+        root (Path): Directory holding one subdirectory per image digest.
+
+    Example usage:
+
+    >>> store = ImageStore.shared()
+    >>> local_url = store.localize("https://cdn.midjourney.com/.../0_0.png")
+    >>> print(store.path(local_url))
+    """
+
+    _shared = None
+
+    def __init__(self, root=ASSET_DIR, workers=2):
+        """
+        Initialize an ImageStore instance.
+
+        Args:
+            root (str, optional): Directory to store assets in.
+            workers (int, optional): Threads used to generate resized variants.
+        """
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.session = requests.Session()
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.index = sqlite3.connect(str(self.root / "index.sqlite3"), timeout=30, check_same_thread=False)
+        with self.index:
+            self.index.execute("PRAGMA journal_mode=WAL")
+            self.index.execute("CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, digest TEXT NOT NULL)")
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the process-wide ImageStore, creating it on first use.
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def localize(self, url):
+        """
+        Download url once and return the local URL of its original image.
+
+        URLs that are already local, or that cannot be downloaded, are returned
+        unchanged.
+
+        Args:
+            url (str): The remote image URL.
+
+        Returns:
+            str: The local URL of the stored image.
+        """
+        if not url or url.startswith(ASSET_PREFIX):
+            return url
+        with self.lock:
+            row = self.index.execute("SELECT digest FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is not None and (self.root / row[0] / "original").exists():
+            return self.local_url(row[0])
+        try:
+            response = self.session.get(url, timeout=30)
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logging.warning(f"Could not download {url}: {e}")
+            return url
+        digest = self.put(response.content)
+        with self.lock, self.index:
+            self.index.execute("INSERT OR REPLACE INTO urls VALUES (?, ?)", (url, digest))
+        return self.local_url(digest)
+
+    def put(self, data):
+        """
+        Store image bytes and schedule their variants.
+
+        Returns:
+            str: The digest the image is stored under.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        directory = self.root / digest
+        original = directory / "original"
+        if not original.exists():
+            directory.mkdir(parents=True, exist_ok=True)
+            write_atomic(original, data)
+            self.pool.submit(self._make_variants, digest)
+        return digest
+
+    def _make_variants(self, digest):
+        """
+        Write every resized variant of the image stored under digest.
+        """
+        if Image is None:
+            return
+        directory = self.root / digest
+        try:
+            with Image.open(directory / "original") as image:
+                image = image.convert("RGB")
+                for name, width in VARIANT_WIDTHS.items():
+                    resized = image.copy()
+                    resized.thumbnail((width, width * 4))
+                    for extension, image_format in VARIANT_FORMATS.items():
+                        target = directory / f"{name}.{extension}"
+                        temporary = target.with_suffix(f".{extension}.tmp")
+                        resized.save(temporary, format=image_format, quality=85)
+                        os.replace(temporary, target)
+        except Exception as e:
+            logging.warning(f"Could not generate variants for {digest}: {e}")
+
+    def local_url(self, digest, variant="original"):
+        """
+        Return the local URL of a stored image or one of its variants, e.g. "thumb.webp".
+        """
+        return f"{ASSET_PREFIX}/{digest}/{variant}"
+
+    def path(self, local_url):
+        """
+        Return the file backing a local URL, falling back to the original image if
+        the requested variant has not been generated yet.
+
+        Returns:
+            Path: The file, or None if the URL is not a stored asset.
+        """
+        parts = local_url[len(ASSET_PREFIX):].strip("/").split("/")
+        if not local_url.startswith(ASSET_PREFIX) or len(parts) != 2:
+            return None
+        digest, variant = parts
+        if not _is_digest(digest) or variant not in self.variants():
+            return None
+        path = self.root / digest / variant
+        if not path.exists():
+            path = self.root / digest / "original"
+        return path if path.exists() else None
+
+    def media_type(self, path):
+        """
+        Return the media type of a stored file, sniffed from its first bytes.
+        """
+        with open(path, "rb") as f:
+            head = f.read(12)
+        if head.startswith(b"\x89PNG"):
+            return "image/png"
+        if head.startswith(b"\xff\xd8"):
+            return "image/jpeg"
+        if head.startswith(b"RIFF") and head[8:12] == b"WEBP":
+            return "image/webp"
+        if head.startswith(b"GIF8"):
+            return "image/gif"
+        return "application/octet-stream"
+
+    def variants(self):
+        """
+        Return the names of every file that may be stored for an image.
+        """
+        return ["original"] + [
+            f"{name}.{extension}" for name in VARIANT_WIDTHS for extension in VARIANT_FORMATS
+        ]
+
+    def localize_story(self, story):
+        """
+        Download every page image of a story and point the pages at the local copies.
+        """
+        for page in story.pages:
+            page.content.imageURL = self.localize(page.content.imageURL)
+
+
+def _is_digest(value):
+    """
+    Whether value looks like a SHA-256 hex digest, so it is safe to use as a path.
+    """
+    return len(value) == 64 and all(ch in "0123456789abcdef" for ch in value)
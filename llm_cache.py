@@ -0,0 +1,232 @@
+from collections import OrderedDict, defaultdict
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from shared_state import SharedState
+
+CACHE_PATH = "llm_cache.sqlite3"
+
+# Comma-separated call sites whose responses should never be served from the cache.
+BYPASS_SITES = os.environ.get("LLM_CACHE_BYPASS", "")
+
+
+class LLMCache:
+    """
+    Memoizes responses from temperature-0 language model calls.
+
+    Every call site in the pipeline runs at temperature 0, so a response is
+    effectively determined by the model, its parameters and the formatted prompt.
+    Responses are kept in an in-memory LRU in front of an on-disk SQLite tier, keyed
+    by a hash of those three. Entries older than max_age are never served, and the
+    disk tier is pruned to max_rows. A miss is claimed in SharedState, so workers
+    that miss on the same prompt at once make a single model call; the others read
+    the tiers until the response appears, and when the shared state is remote it is
+    also a tier shared by every node. Workers only see each other's responses
+    through the disk tier or a remote state, so with path=None and a local state
+    each worker waits for the claim to be released and then makes its own call.
+
+    Attributes:
+        bypass (set): Call sites that always go to the model.
+        stats (dict): Hit and miss counts per call site.
+
+    Example usage:
+
+    >>> cache = LLMCache.shared()
+    >>> text = cache.predict(llm, prompt, "build_story")
+    >>> print(cache.stats["build_story"])
+    """
+
+    _shared = None
+
+    def __init__(self, path=CACHE_PATH, max_entries=1024, max_rows=100000, max_age=30 * 24 * 3600, state=None):
+        """
+        Initialize an LLMCache instance.
+
+        Args:
+            path (str, optional): Path of the SQLite tier, or None to keep responses in
+                memory only.
+            max_entries (int, optional): Size of the in-memory LRU.
+            max_rows (int, optional): Maximum number of responses kept on disk.
+            max_age (float, optional): Seconds after which a response is stale.
+            state (SharedState, optional): Where misses are locked; the shared state
+                configured by SHARED_STATE by default.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.memory = OrderedDict()
+        self.bypass = {site.strip() for site in BYPASS_SITES.split(",") if site.strip()}
+        self.stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.state = state or SharedState.shared()
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            with self.connection:
+                self.connection.execute("PRAGMA journal_mode=WAL")
+                self.connection.execute("""
+                    CREATE TABLE IF NOT EXISTS responses (
+                        key TEXT PRIMARY KEY,
+                        site TEXT,
+                        created_at REAL NOT NULL,
+                        response TEXT NOT NULL
+                    )
+                """)
+                self.connection.execute(
+                    "CREATE INDEX IF NOT EXISTS responses_created_at ON responses(created_at)"
+                )
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the process-wide LLMCache, creating it on first use.
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def key(self, llm, prompt):
+        """
+        Return the cache key for sending prompt to llm.
+
+        Args:
+            llm: A langchain LLM or chat model.
+            prompt (str): The fully formatted prompt, including anything else sent with
+                it such as function definitions.
+        """
+        params = getattr(llm, "_identifying_params", {})
+        payload = json.dumps(
+            {"type": type(llm).__name__, "params": params, "prompt": prompt},
+            sort_keys=True,
+            default=str
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def predict(self, llm, prompt, site):
+        """
+        Return llm.predict(prompt), served from the cache when possible.
+
+        Args:
+            llm: A langchain LLM or chat model.
+            prompt (str): The formatted prompt.
+            site (str): The name of the call site, for stats and bypassing.
+        """
+        return self.get_or_compute(site, self.key(llm, prompt), lambda: llm.predict(prompt))
+
+    def get_or_compute(self, site, key, compute, cancel_token=None):
+        """
+        Return the cached response for key, calling compute to produce it on a miss.
+
+        The worker that claims a miss calls compute. Other workers that miss on the
+        same key meanwhile wait for its response without calling compute, and take
+        over the claim if it is released without a response, e.g. because the call
+        failed or was cancelled.
+
+        Args:
+            site (str): The name of the call site, for stats and bypassing.
+            key (str): The cache key, usually from LLMCache.key.
+            compute (callable): Produces the response as a string.
+            cancel_token (CancelToken, optional): Token that stops the wait for
+                another worker's response.
+
+        Raises:
+            Cancelled: If cancel_token was cancelled while waiting.
+        """
+        if site in self.bypass:
+            return compute()
+        response = self.get(key)
+        with self.lock:
+            self.stats[site]["hits" if response is not None else "misses"] += 1
+        if response is not None:
+            return response
+        while True:
+            with self.state.claim(f"llm:{key}") as claimed:
+                if claimed:
+                    response = self.get(key)
+                    if response is None:
+                        response = compute()
+                        self.set(key, site, response)
+                    return response
+            response = self.state.wait(f"llm:{key}", lambda: self.get(key), cancel_token)
+            if response is not None:
+                return response
+
+    def get(self, key):
+        """
+        Return the cached response for key, or None on a miss.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                created_at, response = entry
+                if now - created_at <= self.max_age:
+                    self.memory.move_to_end(key)
+                    return response
+                del self.memory[key]
+            row = None
+            if self.connection is not None:
+                row = self.connection.execute(
+                    "SELECT created_at, response FROM responses WHERE key = ? AND created_at >= ?",
+                    (key, now - self.max_age)
+                ).fetchone()
+            if row is not None:
+                self._remember(key, row[0], row[1])
+                return row[1]
+        if not self.state.remote:
+            return None
+        # Another node may have cached it; the remote tier expires entries itself.
+        response = self.state.get(f"llm:{key}")
+        if response is not None:
+            with self.lock:
+                self._remember(key, now, response)
+        return response
+
+    def set(self, key, site, response):
+        """
+        Store response under key in every tier.
+        """
+        now = time.time()
+        if self.state.remote:
+            self.state.set(f"llm:{key}", response, ttl=self.max_age)
+        with self.lock:
+            self._remember(key, now, response)
+            if self.connection is None:
+                return
+            with self.connection:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+                    (key, site, now, response)
+                )
+            self.writes += 1
+            if self.writes % 100 == 0:
+                self._prune(now)
+
+    def _remember(self, key, created_at, response):
+        """
+        Insert into the in-memory LRU, evicting the least recently used entries.
+        """
+        self.memory[key] = (created_at, response)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def _prune(self, now):
+        """
+        Delete stale responses and keep only the newest max_rows on disk.
+        """
+        with self.connection:
+            self.connection.execute("DELETE FROM responses WHERE created_at < ?", (now - self.max_age,))
+            self.connection.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY created_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_rows,))
+        logging.info(f"LLM cache stats: {dict(self.stats)}")
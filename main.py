@@ -1,11 +1,62 @@
-from fastapi import FastAPI, HTTPException
+import asyncio
+import logging
+import secrets
+from typing import Optional
+import uuid
+
+from dotenv import dotenv_values
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pydantic import BaseModel
 
 from story_retriever import StoryRetriever
+from episode_store import EpisodeStore
+from suggest_index import SuggestIndex
 from story_config import StoryConfig
-from story import Story
+from story import Story, Illustration
 from story_config import ImageGenStyle
+from story_characters import StoryCharacters
+from story_illustrator import StoryIllustrator
+from story_store import StoryStore
+from story_variants import StoryVariants
+from image_store import ImageStore, ASSET_PREFIX
+from image_prompt_index import ImagePromptIndex
+from cancellation import CancelToken, Cancelled
+from admission import AdmissionController, Overloaded, Service
+from prefetcher import Prefetcher, PREFETCH_ENABLED
+from profiling import RequestProfiler
+from shared_state import SharedState
+
+# Seconds between checks for a disconnected client while a story is being built.
+DISCONNECT_POLL = 0.5
+
+# Status nginx uses for a request closed by the client; the client never sees it.
+CLIENT_CLOSED_REQUEST = 499
+
+# Most pages a single /continuestory/ request may add.
+MAX_CONTINUE_PAGES = 10
+
+# Token required by the /admin/ endpoints, which are disabled when it is not set.
+ADMIN_TOKEN = dotenv_values(".env").get("ADMIN_TOKEN")
+
+# Maps the request's image style to the ImageGenStyle member the illustrators expect.
+IMAGE_STYLES = {
+	"Hyperrealistic": ImageGenStyle.HYPER.name,
+	"Comic": ImageGenStyle.COMIC.name,
+	"Watercolor": ImageGenStyle.WATER.name,
+}
 
+admission = AdmissionController()
+story_store = StoryStore()
+# Built at startup so that the first /suggest request is as fast as the rest.
+suggest_index = SuggestIndex.shared()
+
+# Prefetching only runs while the story stage is at most half busy.
+prefetcher = Prefetcher(
+	story_store,
+	busy=lambda: admission.stages["story"].pending * 2 >= admission.stages["story"].concurrency
+).start() if PREFETCH_ENABLED else None
 
 
 class RequestBody(BaseModel):
@@ -14,10 +65,172 @@ class RequestBody(BaseModel):
    language:str
    imageGenStyle:str
    color:str
+   illustrate:bool = False
+   # Number of an episode picked from /suggest; skips query transform and retrieval.
+   episode:Optional[int] = None
+
+
+class ContinueBody(BaseModel):
+   # The "name" of a story returned by /getstory/ or /continuestory/.
+   name:str
+   pages:int = 3
+   # Defaults to illustrating the new pages when the stored story is illustrated.
+   illustrate:Optional[bool] = None
+
+
+class ProfilingBody(BaseModel):
+   rate:float
+
+
+def story_response(story: Story):
+	"""
+	Return the JSON for a story, with the name /continuestory/ extends it by.
+	"""
+	return dict(story.to_json(), name=story.key())
+
+
+def accepted_illustrations(illustrated, service: Service):
+	"""
+	Return the illustration states a stored story may be served in for a request,
+	most preferred first.
+
+	A request without illustrations is only served a text-only story. An illustrated
+	request is served a story at least as illustrated as the service level would
+	build, so degraded copies are only served while the service is degraded too.
+	"""
+	if not illustrated:
+		return [Illustration.NONE]
+	if service == Service.FULL:
+		return [Illustration.FULL]
+	if service == Service.CACHED_FACES:
+		return [Illustration.FULL, Illustration.CACHED_FACES]
+	return [Illustration.FULL, Illustration.CACHED_FACES, Illustration.NONE]
+
+
+def build_story(body: RequestBody, cancel_token: CancelToken, slot, service: Service, profile):
+	"""
+	Run the story pipeline for a request, stopping between stages once cancelled.
+
+	LLM responses that completed before cancellation stay in the LLMCache, so a
+	retried request picks up where this one stopped. A stored story is served if
+	there is one in an illustration state accepted at the current service level,
+	and below Service.FULL less of the pipeline is run otherwise. The story is saved
+	under its illustration state, so a degraded run never replaces a fully
+	illustrated copy.
+	Stages are timed on the request's profile, which does nothing unless the
+	request was sampled for profiling.
+	"""
+	with slot, profile:
+		with profile.stage("retrieve"):
+			if body.episode is not None:
+				most_relevant_content = EpisodeStore.shared().episodes[EpisodeStore.shared().by_number(body.episode)]
+			else:
+				most_relevant_content = StoryRetriever(body.query).retrieve()
+		cancel_token.check()
+		config = StoryConfig(
+			body.age,
+			body.language, 
+			most_relevant_content, 
+			IMAGE_STYLES.get(body.imageGenStyle, body.imageGenStyle),
+			body.color
+		)
+		story = Story(config=config)
+		illustrated = body.illustrate and isinstance(config.img_style, ImageGenStyle)
+		cached = story_store.lookup(story, accepted_illustrations(illustrated, service))
+		if cached is not None:
+			if prefetcher is not None:
+				prefetcher.record(cached)
+			return story_response(cached)
+		if service == Service.CACHED_ONLY:
+			raise Overloaded(503, admission.stages["story"].retry_after(), "Only cached stories are being served.")
+		with admission.stages["story"].admit(), profile.stage("story"):
+			StoryVariants(story_store).build(story, cancel_token=cancel_token)
+		with profile.stage("build_pages"):
+			story.build_pages()
+		if illustrated and service != Service.TEXT_ONLY:
+			try:
+				with profile.stage("illustrate"):
+					story.illustration = illustrate(story, config, cancel_token, render_faces=service == Service.FULL)
+			except Overloaded:
+				logging.info("Image stages are at capacity; serving the story without images.")
+		with profile.stage("save"):
+			story_store.save(story)
+		if prefetcher is not None:
+			prefetcher.record(story)
+		return story_response(story)
+
+
+def extend_story(body: ContinueBody, cancel_token: CancelToken, slot, service: Service, profile):
+	"""
+	Add pages to a stored story that was built with max_pages.
+
+	The story is extended under a lock held across workers and reloaded once the
+	lock is held, so concurrent requests for the same story add pages one after the
+	other rather than overwriting each other. If the new pages are less illustrated
+	than the stored story, the result is saved under its own, lower illustration
+	state and the stored copy is left as it was.
+	"""
+	with slot, profile:
+		with SharedState.shared().lock(f"continue_story:{body.name}", cancel_token=cancel_token):
+			story = story_store.get(body.name)
+			if story is None:
+				raise HTTPException(404)
+			if story.config.max_pages is None:
+				raise HTTPException(409, detail="The story was written in full and has no more pages.")
+			if body.illustrate is None:
+				illustrated = story.illustration != Illustration.NONE
+			else:
+				illustrated = body.illustrate and isinstance(story.config.img_style, ImageGenStyle)
+			with admission.stages["story"].admit(), profile.stage("story"):
+				new_pages = story.continue_story(body.pages, cancel_token=cancel_token)
+			previous, story.illustration = story.illustration, Illustration.NONE
+			if illustrated and service != Service.TEXT_ONLY:
+				try:
+					with profile.stage("illustrate"):
+						story.illustration = illustrate(story, story.config, cancel_token,
+							render_faces=service == Service.FULL, pages=[page.pageNo - 1 for page in new_pages])
+				except Overloaded:
+					logging.info("Image stages are at capacity; serving the new pages without images.")
+			story.illustration = min(previous, story.illustration)
+			with profile.stage("save"):
+				story_store.save(story)
+		return story_response(story)
+
+
+def illustrate(story: Story, config: StoryConfig, cancel_token: CancelToken, render_faces=True, pages=None):
+	"""
+	Generate character faces and illustrations for a story's pages, or only the
+	pages with the given indexes.
+
+	Returns:
+		Illustration: The illustration state of the pages that were illustrated.
+	"""
+	characters = StoryCharacters(story, config=config, cancel_token=cancel_token, image_store=ImageStore.shared())
+	characters.fetchCharacters()
+	with admission.stages["faces"].admit():
+		characters.generateCharacterFaces(render_new=render_faces)
+	illustrator = StoryIllustrator(story, config, characters, cancel_token=cancel_token, image_store=ImageStore.shared(),
+		prompt_index=ImagePromptIndex.shared())
+	with admission.stages["images"].admit():
+		illustrator.populateStore(pages)
+	story.populate_images(illustrator)
+	return Illustration.FULL if render_faces else Illustration.CACHED_FACES
+
 
 app = FastAPI()
+
+
+@app.exception_handler(Overloaded)
+async def overloaded(request: Request, exc: Overloaded):
+	return JSONResponse(
+		{"detail": exc.detail},
+		status_code=exc.status_code,
+		headers={"Retry-After": str(exc.retry_after)}
+	)
+
+
 @app.post("/getstory/")
-async def get_story(body: RequestBody):
+async def get_story(body: RequestBody, request: Request, response: Response):
 	if body.age not in ["preteen", "teen", "adult"]:
 		raise HTTPException(404)
 	if body.imageGenStyle not in ["Hyperrealistic", "Comic", "Black and White", "Watercolor"]:
@@ -26,18 +239,89 @@ async def get_story(body: RequestBody):
 		raise HTTPException(404)
 	if body.color not in ["Color", "Black and White"]:
 		raise HTTPException(404)
+	if body.episode is not None and EpisodeStore.shared().by_number(body.episode) is None:
+		raise HTTPException(404)
+
+	return await run_pipeline(build_story, body, request, response)
+
+
+@app.post("/continuestory/")
+async def continue_story(body: ContinueBody, request: Request, response: Response):
+	if not 1 <= body.pages <= MAX_CONTINUE_PAGES:
+		raise HTTPException(422, detail=f"pages must be between 1 and {MAX_CONTINUE_PAGES}.")
+	return await run_pipeline(extend_story, body, request, response)
 
-	most_relevant_content = StoryRetriever(body.query).retrieve()
-	config = StoryConfig(
-		body.age,
-		body.language, 
-		most_relevant_content, 
-		body.imageGenStyle,
-		body.color
-	)
-	story = Story(config=config)
-	story.build_story()
-	story.build_pages()
-	return story
 
+async def run_pipeline(pipeline, body, request: Request, response: Response):
+	"""
+	Admit a request and run pipeline(body, cancel_token, slot, service, profile) for it.
+	"""
+	# Reject before doing any work if the client is over quota or the pipeline is full.
+	admission.quota.take(request.client.host if request.client else "")
+	service = admission.service()
+	slot = admission.stages["request"].admit()
+	try:
+		# The pipeline blocks, so it runs in a worker thread while the event loop watches
+		# for the client going away and cancels the work when it does.
+		cancel_token = CancelToken()
+		request_id = uuid.uuid4().hex
+		response.headers["X-Request-ID"] = request_id
+		profile = RequestProfiler.shared().start(request_id)
+		work = asyncio.ensure_future(run_in_threadpool(pipeline, body, cancel_token, slot, service, profile))
+		while not work.done():
+			if await request.is_disconnected():
+				cancel_token.cancel()
+				break
+			await asyncio.wait({work}, timeout=DISCONNECT_POLL)
+		try:
+			return await work
+		except Cancelled:
+			raise HTTPException(CLIENT_CLOSED_REQUEST, detail="Client Closed Request")
+	finally:
+		# The pipeline enters the slot in its worker thread. If the request was
+		# cancelled before the thread started, the reservation is given back here.
+		slot.cancel()
 
+
+def check_admin(token):
+	if not ADMIN_TOKEN or not token or not secrets.compare_digest(token, ADMIN_TOKEN):
+		raise HTTPException(404)
+
+
+@app.get("/admin/profiling")
+async def get_profiling(x_admin_token: Optional[str] = Header(None)):
+	check_admin(x_admin_token)
+	profiler = RequestProfiler.shared()
+	return {"rate": profiler.rate, "profiles": profiler.profiles()}
+
+
+@app.post("/admin/profiling")
+async def set_profiling(body: ProfilingBody, x_admin_token: Optional[str] = Header(None)):
+	# Sample this fraction of /getstory/ requests in every worker from now on; 0 turns profiling off.
+	check_admin(x_admin_token)
+	RequestProfiler.shared().rate = min(max(body.rate, 0.0), 1.0)
+	return {"rate": RequestProfiler.shared().rate}
+
+
+@app.get("/suggest")
+async def suggest(q: str = "", limit: int = 8):
+	# Pass the chosen suggestion's episode to /getstory/ to build it directly.
+	return {"suggestions": suggest_index.suggest(q, limit=min(max(limit, 1), 20))}
+
+
+@app.get(ASSET_PREFIX + "/{digest}/{variant}")
+async def get_asset(digest: str, variant: str, request: Request):
+	image_store = ImageStore.shared()
+	path = image_store.path(image_store.local_url(digest, variant))
+	if path is None:
+		raise HTTPException(404)
+	# Assets are content-addressed and never change, except while a variant is still
+	# being generated and the original is served in its place.
+	etag = f'"{digest}-{path.name}"'
+	headers = {
+		"ETag": etag,
+		"Cache-Control": "public, max-age=31536000, immutable" if path.name == variant else "public, max-age=60"
+	}
+	if request.headers.get("if-none-match") == etag:
+		return Response(status_code=304, headers=headers)
+	return FileResponse(path, headers=headers, media_type=image_store.media_type(path))
@@ -0,0 +1,81 @@
+import argparse
+import json
+from pathlib import Path
+
+from page import Page
+from story import Story, SCHEMA_VERSION, SPLITTER
+from story_config import StoryConfig
+from story_store import StoryStore, STORE_PATH
+from image_store import ImageStore
+
+
+"""
+One time script to copy every story saved in [./story_jsons] into the StoryStore.
+
+Handles both the versioned layout written by Story.to_json and the legacy layout,
+which kept the source text inside the config. With --localize-images, remote page
+images such as Midjourney CDN links, which expire, are downloaded into the ImageStore
+and the stories point at the local copies.
+"""
+
+
+def load_story(path):
+    """
+    Load a Story from a file in story_jsons/, in either the current or legacy layout.
+    """
+    data = json.loads(path.read_text(encoding="utf-8"))
+    if data.get("version") == SCHEMA_VERSION:
+        return Story.from_json(data)
+    config = data["config"]
+    story = Story(StoryConfig(
+        config["age"],
+        config["language"],
+        config["text"],
+        config["img_style"],
+        config["color"],
+        config["sz"]
+    ))
+    story.pages = [Page.from_json(page) for page in data["pages"]]
+    story.text = SPLITTER.join(page.content.text for page in story.pages)
+    story.illustration = story.inferred_illustration()
+    return story
+
+
+def migrate(json_directory, store, batch_size=500, image_store=None):
+    """
+    Copy every story in json_directory into store, in batches of batch_size.
+
+    If image_store is given, page images are localized into it first.
+
+    Returns:
+        tuple: (migrated, failed) counts.
+    """
+    migrated, failed, batch = 0, 0, []
+    for path in sorted(Path(json_directory).glob("*.json")):
+        try:
+            story = load_story(path)
+        except (KeyError, ValueError) as e:
+            print(f"Skipping {path.name}: {e}")
+            failed += 1
+            continue
+        if image_store is not None:
+            image_store.localize_story(story)
+        batch.append(story)
+        if len(batch) >= batch_size:
+            store.save_many(batch)
+            migrated += len(batch)
+            batch = []
+    store.save_many(batch)
+    return migrated + len(batch), failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Migrate story_jsons/ into a StoryStore.")
+    parser.add_argument("--source", default="story_jsons")
+    parser.add_argument("--store", default=STORE_PATH)
+    parser.add_argument("--localize-images", action="store_true",
+                        help="Download remote page images into the ImageStore.")
+    args = parser.parse_args()
+    image_store = ImageStore.shared() if args.localize_images else None
+    migrated, failed = migrate(args.source, StoryStore(args.store), image_store=image_store)
+    print(f"Migrated {migrated} stories, skipped {failed}.")
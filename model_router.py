@@ -0,0 +1,197 @@
+from collections import defaultdict
+import json
+import logging
+import os
+import threading
+import time
+
+from dotenv import dotenv_values
+from langchain.chat_models import ChatOpenAI
+
+import context_budget
+from llm_cache import LLMCache
+
+API_KEY = dotenv_values(".env").get("OPENAI_API_KEY")
+
+SMALL_MODEL = "gpt-3.5-turbo"
+LARGE_MODEL = "gpt-4"
+
+# Models tried in order for each call site. A call escalates to the next model when
+# its output fails the site's validation.
+ROUTES = {
+    "story_query": [SMALL_MODEL],
+    "multi_query": [SMALL_MODEL],
+    "illustration_prompt": [SMALL_MODEL],
+    "story_summary": [SMALL_MODEL],
+    "characters": [SMALL_MODEL, LARGE_MODEL],
+    "characters_repair": [SMALL_MODEL, LARGE_MODEL],
+    "story_variant": [SMALL_MODEL],
+    "build_story": [SMALL_MODEL],
+}
+
+# JSON object overriding ROUTES, e.g. MODEL_ROUTES='{"build_story": ["gpt-4"]}'.
+ROUTE_OVERRIDES = os.environ.get("MODEL_ROUTES", "")
+
+# US dollars per 1,000 prompt and completion tokens.
+PRICES = {
+    "gpt-3.5-turbo": (0.0015, 0.002),
+    "gpt-3.5-turbo-16k": (0.003, 0.004),
+    "gpt-4": (0.03, 0.06),
+}
+
+
+class ModelRouter:
+    """
+    Routes each pipeline call site to a cascade of models.
+
+    Lightweight steps such as query rewriting, query expansion and scene prompt
+    writing run on a small, fast model. Steps whose output is validated, such as
+    character extraction, escalate to a larger model when the small model's output
+    fails validation. Every model call is timed and costed per call site and model.
+    Responses still go through the LLMCache, keyed by the model that produced them.
+
+    Attributes:
+        routes (dict): Mapping from call site to the model names tried in order.
+        stats (dict): Per (site, model) counts of calls, escalations, cache hits,
+            tokens, seconds and dollars.
+
+    Example usage:
+
+    >>> router = ModelRouter.shared()
+    >>> text = router.predict("story_query", prompt)
+    >>> characters = router.call("characters", prompt, compute, validate=lambda text: bool(parser.loads(text)))
+    >>> print(router.report())
+    """
+
+    _shared = None
+
+    def __init__(self, routes=None, factory=None):
+        """
+        Initialize a ModelRouter instance.
+
+        Args:
+            routes (dict, optional): Overrides of ROUTES per call site.
+            factory (callable, optional): Creates a model from its name; a
+                temperature-0 ChatOpenAI by default.
+        """
+        self.routes = dict(ROUTES)
+        if ROUTE_OVERRIDES:
+            self.routes.update(json.loads(ROUTE_OVERRIDES))
+        self.routes.update(routes or {})
+        self.factory = factory or (lambda name: _chat_model(name))
+        self.models = {}
+        self.budget = context_budget.ContextBudget(0)
+        self.stats = defaultdict(lambda: defaultdict(float))
+        self.lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the process-wide ModelRouter, creating it on first use.
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def route(self, site):
+        """
+        Return the model names tried for site, falling back to the small model.
+        """
+        return self.routes.get(site) or [SMALL_MODEL]
+
+    def model(self, site, tier=0):
+        """
+        Return the model at the given tier of site's route, shared across calls.
+        """
+        route = self.route(site)
+        name = route[min(tier, len(route) - 1)]
+        with self.lock:
+            if name not in self.models:
+                self.models[name] = self.factory(name)
+            return self.models[name]
+
+    def predict(self, site, prompt, validate=None):
+        """
+        Return model.predict(prompt) from the first model on site's route whose
+        output passes validate.
+        """
+        return self.call(site, prompt, lambda llm: llm.predict(prompt), validate)
+
+    def call(self, site, prompt, compute, validate=None, key_extra="", cancel_token=None):
+        """
+        Run compute against each model on site's route until its output passes
+        validate, serving each model's output from the LLMCache when possible.
+
+        Args:
+            site (str): The call site name, used for the route, cache and stats.
+            prompt (str): The formatted prompt, used for the cache key and token counts.
+            compute (callable): Takes a model and returns its output as a string.
+            validate (callable, optional): Takes the output and returns whether it is
+                acceptable. Every output is accepted when None.
+            key_extra (str, optional): Anything else sent with the prompt, such as
+                function definitions, that must be part of the cache key.
+            cancel_token (CancelToken, optional): Token that stops the wait for a
+                response another worker is computing.
+
+        Returns:
+            str: The first valid output, or the last model's output if none is valid.
+        """
+        cache = LLMCache.shared()
+        route = self.route(site)
+        for tier, name in enumerate(route):
+            llm = self.model(site, tier)
+            computed = []
+
+            def timed():
+                start = time.monotonic()
+                output = compute(llm)
+                computed.append(time.monotonic() - start)
+                return output
+
+            output = cache.get_or_compute(site, cache.key(llm, prompt + key_extra), timed, cancel_token)
+            self._account(site, name, prompt, output, computed[0] if computed else None)
+            if validate is None or validate(output):
+                return output
+            if tier + 1 < len(route):
+                logging.info(f"{site}: output of {name} failed validation, escalating to {route[tier + 1]}.")
+                with self.lock:
+                    self.stats[(site, name)]["escalations"] += 1
+        return output
+
+    def _account(self, site, name, prompt, output, seconds):
+        """
+        Record one call. Cache hits are counted but cost nothing.
+        """
+        with self.lock:
+            stats = self.stats[(site, name)]
+            stats["calls"] += 1
+            if seconds is None:
+                stats["cache_hits"] += 1
+                return
+            prompt_tokens = self.budget.count(prompt)
+            completion_tokens = self.budget.count(output or "")
+            (prompt_price, completion_price) = PRICES.get(name, (0.0, 0.0))
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["seconds"] += seconds
+            stats["dollars"] += (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+    def report(self):
+        """
+        Return the stats as {"site/model": {...}}, with the mean latency of model calls.
+        """
+        with self.lock:
+            report = {}
+            for (site, name), stats in self.stats.items():
+                entry = dict(stats)
+                computed = entry.get("calls", 0) - entry.get("cache_hits", 0)
+                entry["mean_seconds"] = entry.get("seconds", 0.0) / computed if computed else 0.0
+                report[f"{site}/{name}"] = entry
+            return report
+
+
+def _chat_model(name):
+    """
+    Returns a temperature-0 ChatOpenAI client for the named model.
+    """
+    return ChatOpenAI(model_name=name, temperature=0.0, openai_api_key=API_KEY)
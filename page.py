@@ -1,4 +1,3 @@
-from json import JSONEncoder
 from page_content import PageContent
 
 class Page:
@@ -20,6 +19,8 @@ class Page:
     >>> print(page_instance.content.text)
     >>> print(page_instance.pageNo)
     """
+    __slots__ = ("content", "pageNo")
+
     def __init__(self, content: PageContent, pageNo):
         """
         Initialize a Page instance.
@@ -40,4 +41,12 @@ class Page:
         return {
             "content":self.content.to_json(),
             "pageNo":self.pageNo
-        }
\ No newline at end of file
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Returns a Page from its json representation
+        """
+
+        return cls(PageContent.from_json(data["content"]), data["pageNo"])
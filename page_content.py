@@ -14,6 +14,8 @@ class PageContent:
     >>> print(content.text)
     >>> print(content.imageURL)
     """
+    __slots__ = ("text", "imageURL")
+
     def __init__(self, text, imageURL=None):
         """
         Initialize a PageContent instance.
@@ -34,3 +36,11 @@ class PageContent:
             "text":self.text,
             "imageURL":self.imageURL
         }
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Deserializes from the output of to_json
+        """
+
+        return cls(data["text"], data.get("imageURL"))
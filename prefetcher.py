@@ -0,0 +1,170 @@
+from collections import Counter, defaultdict
+import logging
+import os
+import threading
+import time
+
+from episode_store import EpisodeStore
+from story import Story
+from story_config import StoryConfig
+from story_variants import StoryVariants
+from shared_state import SharedState
+
+# Prefetching is opt-in; set PREFETCH=1 to enable it in main.py.
+PREFETCH_ENABLED = os.environ.get("PREFETCH", "0") == "1"
+
+# Maximum number of stories prefetched per hour, across all episodes.
+PREFETCH_BUDGET = int(os.environ.get("PREFETCH_BUDGET", 60))
+
+# Number of popular sibling configs of the same episode to prefetch.
+PREFETCH_SIBLINGS = 2
+
+# Seconds a prefetched story stays marked as prefetched, for hit accounting.
+PREFETCH_MARK_TTL = 24 * 3600
+
+# Name of the SharedState queue prefetch jobs are kept in.
+PREFETCH_QUEUE = "prefetch"
+
+# Lower numbers run first.
+PRIORITY_NEXT_EPISODE = 0
+PRIORITY_SIBLING = 1
+
+
+class Prefetcher:
+    """
+    Generates stories that are likely to be requested next, in the background.
+
+    Readers of the saga usually ask for the next episode after the one they just
+    read, or for the same episode at another age group or page size. After a story
+    is served, the next episode in the same config and the most popular other
+    configs of the same episode are queued at low priority. Jobs go into a queue in
+    SharedState, so with several workers each job is queued and run once. Every
+    worker's thread writes jobs into the story store, waiting while busy() reports
+    interactive traffic. The stories spent are counted in SharedState, so all the
+    workers together prefetch at most PREFETCH_BUDGET stories in each clock hour.
+
+    Only story text is prefetched; illustrations are left to the request that
+    actually reads the story. Prefetched stories are stored as text-only, so they
+    are only served to requests without illustrations, and an illustrated request
+    reuses just their text through StoryVariants.
+
+    Attributes:
+        stats (Counter): Counts of queued, generated, skipped, hits and misses.
+
+    Example usage:
+
+    >>> prefetcher = Prefetcher(story_store, busy=lambda: admission.stages["story"].pending > 0)
+    >>> prefetcher.start()
+    >>> prefetcher.record(story)
+    """
+
+    def __init__(self, story_store, busy=None, budget=PREFETCH_BUDGET, episodes=None, state=None):
+        """
+        Initialize a Prefetcher instance.
+
+        Args:
+            story_store (StoryStore): Store that served stories are looked up in and
+                prefetched stories are saved to.
+            busy (callable, optional): Returns True while interactive traffic should
+                have the models to itself.
+            budget (int, optional): Maximum stories prefetched per hour by all workers.
+            episodes (EpisodeStore, optional): The corpus; the shared store by default.
+            state (SharedState, optional): Holds the job queue; the shared state
+                configured by SHARED_STATE by default.
+        """
+        self.story_store = story_store
+        self.busy = busy or (lambda: False)
+        self.budget = budget
+        self.episodes = episodes or EpisodeStore.shared()
+        self.state = state or SharedState.shared()
+        self.config_counts = defaultdict(Counter)
+        self.stats = Counter()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        """
+        Start the worker thread.
+        """
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+        return self
+
+    def record(self, story: Story):
+        """
+        Record that story was served and queue the stories likely to follow it.
+
+        Args:
+            story (Story): The story that was just served.
+        """
+        config = story.config
+        options = (config.age, config.language, config.img_style, config.color, config.sz)
+        # Taking the mark is atomic, so of several workers serving the story only one counts the hit.
+        prefetched = self.state.take(f"prefetched:{story.key()}") is not None
+        with self.lock:
+            self.stats["hits" if prefetched else "misses"] += 1
+            self.config_counts[config.text_id][options] += 1
+            siblings = [
+                sibling for (sibling, _) in self.config_counts[config.text_id].most_common()
+                if sibling != options
+            ][:PREFETCH_SIBLINGS]
+        episode = self.episodes.by_text_id(config.text_id)
+        following = self.episodes.next_episode(episode) if episode else None
+        if following is not None:
+            self._enqueue(PRIORITY_NEXT_EPISODE, self.episodes.episodes[following], options, config.max_pages)
+        for sibling in siblings:
+            self._enqueue(PRIORITY_SIBLING, config.text, sibling, config.max_pages)
+
+    def _enqueue(self, priority, text, options, max_pages):
+        (age, language, img_style, color, sz) = options
+        config = StoryConfig(age, language, text, img_style, color, sz, max_pages=max_pages)
+        story = Story(config)
+        # Queue each story once across workers until its job has run.
+        if not self.state.add(f"prefetch_queued:{story.key()}", "1", ttl=PREFETCH_MARK_TTL):
+            return
+        self.stats["queued"] += 1
+        self.state.push(PREFETCH_QUEUE, {"config": config.to_json(), "text": text}, priority)
+
+    def _spend(self):
+        """
+        Spend one story from the hourly budget shared by every worker, waiting until
+        one is available.
+        """
+        while True:
+            hour = int(time.time() // 3600)
+            # Counts past the budget are harmless; the key expires after its hour.
+            if self.state.incr(f"prefetch_spent:{hour}", ttl=2 * 3600) <= self.budget:
+                return
+            time.sleep(min(60, (hour + 1) * 3600 - time.time()))
+
+    def _work(self):
+        while True:
+            job = self.state.pop(PREFETCH_QUEUE, timeout=5)
+            if job is not None:
+                self._run(job)
+
+    def _run(self, job):
+        """
+        Prefetch the story of one job, unless it has been stored since it was queued.
+        """
+        story = Story(StoryConfig.from_json(job["config"], job["text"]))
+        try:
+            if self.story_store.get(story.key()) is not None:
+                self.stats["skipped"] += 1
+                return
+            while self.busy():
+                time.sleep(1)
+            self._spend()
+            try:
+                StoryVariants(self.story_store).build(story)
+                story.build_pages()
+                self.story_store.save(story)
+            except Exception as e:
+                logging.warning(f"Prefetch of {story.name} failed: {e}")
+                return
+            self.state.set(f"prefetched:{story.key()}", "1", ttl=PREFETCH_MARK_TTL)
+            self.stats["generated"] += 1
+            logging.info(f"Prefetched {story.name}; stats {dict(self.stats)}")
+        finally:
+            # The story can be queued again once its job has run, whatever the outcome.
+            self.state.delete(f"prefetch_queued:{story.key()}")
@@ -0,0 +1,245 @@
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+import json
+import logging
+import os
+from pathlib import Path
+import random
+import sys
+import threading
+import time
+
+from atomic_file import write_atomic
+from shared_state import SharedState
+
+PROFILE_DIR = "profiles"
+
+# Fraction of /getstory/ requests that are profiled; 0 disables profiling.
+PROFILE_RATE = float(os.environ.get("PROFILE_RATE", 0))
+
+# Seconds between stack samples of a profiled request.
+PROFILE_INTERVAL = float(os.environ.get("PROFILE_INTERVAL", 0.005))
+
+# Number of profiles kept on disk; older ones are deleted.
+PROFILE_KEEP = int(os.environ.get("PROFILE_KEEP", 50))
+
+# SharedState key of the rate set at runtime, which overrides PROFILE_RATE in every worker.
+RATE_KEY = "profiling:rate"
+
+# Seconds a worker keeps using the rate it last read from SharedState.
+RATE_REFRESH = 1.0
+
+
+class RequestProfiler:
+    """
+    Samples the call stack of a fraction of requests and writes flame graph profiles.
+
+    A sampled request gets a Profile, which records the stack of the thread running
+    the request every PROFILE_INTERVAL seconds from a background thread. The samples
+    are written in the folded stack format read by flamegraph.pl, speedscope and
+    inferno, next to a JSON file with the request id and stage timings. Since the
+    stack of a sleeping thread is sampled too, the profile shows wall time, including
+    time spent polling the image API. Requests that are not sampled get NULL_PROFILE,
+    whose methods do nothing.
+
+    The rate can be changed at runtime. It is kept in SharedState, so setting it
+    on one worker changes it for every worker within RATE_REFRESH seconds.
+
+    Attributes:
+        rate (float): Fraction of requests profiled.
+
+    Example usage:
+
+    >>> profiler = RequestProfiler.shared()
+    >>> profile = profiler.start(request_id)
+    >>> with profile:
+    ...     with profile.stage("build_pages"):
+    ...         story.build_pages()
+    """
+
+    _shared = None
+
+    def __init__(self, directory=PROFILE_DIR, rate=PROFILE_RATE, interval=PROFILE_INTERVAL, keep=PROFILE_KEEP,
+                 state=None):
+        """
+        Initialize a RequestProfiler instance.
+
+        Args:
+            directory (str, optional): Directory profiles are written to.
+            rate (float, optional): Fraction of requests profiled until a rate is
+                set at runtime.
+            interval (float, optional): Seconds between stack samples.
+            keep (int, optional): Number of profiles kept on disk.
+            state (SharedState, optional): Where the runtime rate is kept; the shared
+                state configured by SHARED_STATE by default.
+        """
+        self.directory = Path(directory)
+        self.default_rate = rate
+        self.interval = interval
+        self.keep = keep
+        self.lock = threading.Lock()
+        self.state = state
+        self._rate = rate
+        self._rate_read_at = None
+
+    @property
+    def rate(self):
+        """
+        The fraction of requests profiled, as last set in any worker.
+        """
+        now = time.monotonic()
+        if self._rate_read_at is None or now - self._rate_read_at >= RATE_REFRESH:
+            value = self._state().get(RATE_KEY)
+            self._rate = float(value) if value is not None else self.default_rate
+            self._rate_read_at = now
+        return self._rate
+
+    @rate.setter
+    def rate(self, rate):
+        self._state().set(RATE_KEY, str(rate))
+        self._rate = rate
+        self._rate_read_at = time.monotonic()
+
+    def _state(self):
+        if self.state is None:
+            self.state = SharedState.shared()
+        return self.state
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the process-wide RequestProfiler, creating it on first use.
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def start(self, request_id):
+        """
+        Return a Profile for the request if it is sampled, NULL_PROFILE otherwise.
+        """
+        if self.rate <= 0 or random.random() >= self.rate:
+            return NULL_PROFILE
+        return Profile(self, request_id)
+
+    def profiles(self):
+        """
+        Return the base names of the profiles on disk, newest first.
+        """
+        paths = sorted(self.directory.glob("*.folded"), key=lambda path: path.name, reverse=True)
+        return [path.stem for path in paths]
+
+    def write(self, profile):
+        """
+        Write a finished profile and delete the oldest ones beyond self.keep.
+        """
+        milliseconds = int(profile.started_at * 1000) % 1000
+        stem = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(profile.started_at))}{milliseconds:03d}_{profile.request_id}"
+        folded = "".join(f"{stack} {count}\n" for (stack, count) in profile.samples.items())
+        with self.lock:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            write_atomic(self.directory / f"{stem}.folded", folded)
+            write_atomic(self.directory / f"{stem}.json", json.dumps(profile.summary(), indent=2))
+            for old in self.profiles()[self.keep:]:
+                for suffix in (".folded", ".json"):
+                    (self.directory / f"{old}{suffix}").unlink(missing_ok=True)
+        logging.info(f"Wrote profile {stem} ({sum(profile.samples.values())} samples).")
+
+
+class Profile:
+    """
+    Stack samples and stage timings of one request. Enter it on the thread that
+    runs the request.
+    """
+
+    def __init__(self, profiler, request_id):
+        self.profiler = profiler
+        self.request_id = request_id
+        self.samples = Counter()
+        self.stages = []
+        self.status = "ok"
+        self.started_at = time.time()
+        self.started = None
+        self.seconds = None
+        self.thread_id = None
+        self.stopped = threading.Event()
+        self.sampler = None
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.started = time.monotonic()
+        self.sampler = threading.Thread(target=self._sample, daemon=True)
+        self.sampler.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stopped.set()
+        self.sampler.join()
+        self.seconds = time.monotonic() - self.started
+        if exc_type is not None:
+            self.status = exc_type.__name__
+        try:
+            self.profiler.write(self)
+        except OSError as e:
+            logging.warning(f"Could not write profile {self.request_id}: {e}")
+        return False
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the request.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages.append({
+                "stage": name,
+                "start": round(start - self.started, 6),
+                "seconds": round(time.monotonic() - start, 6),
+            })
+
+    def summary(self):
+        """
+        Return the request id, status, duration and stage timings of the profile.
+        """
+        return {
+            "request_id": self.request_id,
+            "status": self.status,
+            "seconds": round(self.seconds, 6),
+            "interval": self.profiler.interval,
+            "samples": sum(self.samples.values()),
+            "stages": self.stages,
+        }
+
+    def _sample(self):
+        while not self.stopped.wait(self.profiler.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+
+class _NullProfile:
+    """
+    Stands in for a Profile on requests that are not sampled.
+    """
+
+    request_id = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def stage(self, name):
+        return _NULL_STAGE
+
+
+_NULL_STAGE = nullcontext()
+NULL_PROFILE = _NullProfile()
@@ -0,0 +1,494 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from cancellation import CancelToken
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# Where state shared by every worker is kept: "sqlite:///<path>" for workers on one
+# host, or "redis://host:port/db" for workers on several nodes.
+SHARED_STATE_URL = os.environ.get("SHARED_STATE", "sqlite:///shared_state.sqlite3")
+
+# Seconds between attempts to take a lock that is held by another worker.
+LOCK_POLL = 0.05
+
+# Seconds a claim on a piece of work lasts unless its holder renews it. The holder
+# renews it every third of this, so a claim outlives a dead worker by at most this.
+CLAIM_LEASE = 30
+
+
+class SharedState(ABC):
+    """
+    Key-value cache, single-flight locks and job queues shared by every worker.
+
+    Each uvicorn worker and node used to keep its caches to itself, so identical
+    work such as rendering a character's face or writing a story was repeated in
+    every worker that got the request. Work that should happen once goes through
+    once(), which computes a value under a lock held across workers and caches it
+    for the others. Locks are leases that expire, so a worker that dies while
+    holding one does not block the others for ever. Long work can instead be
+    claimed with claim(), whose lease is renewed while the work runs, so that the
+    other workers only read while they wait.
+
+    Use SharedState.shared() to get the backend configured by SHARED_STATE.
+
+    Attributes:
+        remote (bool): Whether the state lives on another host, in which case local
+            caches should also be written through to it.
+
+    Example usage:
+
+    >>> state = SharedState.shared()
+    >>> url = state.once("face:karna", lambda: render_face("karna"))
+    >>> state.push("prefetch", {"name": story.name}, priority=1)
+    >>> job = state.pop("prefetch", timeout=5)
+    """
+
+    remote = False
+
+    _shared = None
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the process-wide SharedState for SHARED_STATE, creating it on first use.
+        """
+        if SharedState._shared is None:
+            SharedState._shared = SharedState.from_url(SHARED_STATE_URL)
+        return SharedState._shared
+
+    @staticmethod
+    def from_url(url):
+        """
+        Return the backend for a "sqlite:///path" or "redis://..." URL.
+        """
+        if url.startswith("sqlite:///"):
+            return SQLiteState(url[len("sqlite:///"):])
+        if url.startswith(("redis://", "rediss://", "unix://")):
+            return RedisState(url)
+        raise ValueError(f"Unsupported shared state URL: {url}")
+
+    @abstractmethod
+    def get(self, key):
+        """
+        Return the value stored under key, or None.
+        """
+
+    @abstractmethod
+    def set(self, key, value, ttl=None):
+        """
+        Store value under key, for ttl seconds if given.
+        """
+
+    @abstractmethod
+    def add(self, key, value, ttl=None):
+        """
+        Store value under key only if no value is stored there.
+
+        Returns:
+            bool: Whether the value was stored.
+        """
+
+    @abstractmethod
+    def incr(self, key, ttl=None):
+        """
+        Add one to the integer stored under key, starting from 0, and return the new
+        count. A new key expires after ttl seconds if given.
+        """
+
+    @abstractmethod
+    def renew(self, key, value, ttl):
+        """
+        Make key expire ttl seconds from now if it still holds value.
+
+        Returns:
+            bool: Whether key still held value.
+        """
+
+    @abstractmethod
+    def delete(self, key, value=None):
+        """
+        Delete key, or only if it still holds value when value is given.
+        """
+
+    @abstractmethod
+    def take(self, key):
+        """
+        Delete key and return the value it held, or None. Of several workers taking
+        the same key at once, only one gets its value.
+        """
+
+    @abstractmethod
+    def push(self, queue, payload, priority=0):
+        """
+        Add a JSON-serializable payload to a queue. Lower priorities are popped first.
+        """
+
+    @abstractmethod
+    def pop(self, queue, timeout=None):
+        """
+        Remove and return the first payload in a queue, waiting up to timeout seconds.
+
+        Returns:
+            The payload, or None if the queue stayed empty.
+        """
+
+    @contextmanager
+    def lock(self, name, lease=600, cancel_token=None):
+        """
+        Hold a lock across every worker, waiting for it if another worker holds it.
+
+        Args:
+            name (str): The name of the lock.
+            lease (float, optional): Seconds after which the lock is released even if
+                its holder never released it.
+            cancel_token (CancelToken, optional): Token that stops the wait.
+
+        Raises:
+            Cancelled: If cancel_token was cancelled while waiting.
+        """
+        cancel_token = cancel_token or CancelToken()
+        key = f"lock:{name}"
+        owner = uuid.uuid4().hex
+        while not self.add(key, owner, ttl=lease):
+            cancel_token.sleep(LOCK_POLL)
+        try:
+            yield
+        finally:
+            self.delete(key, owner)
+
+    @contextmanager
+    def claim(self, name, lease=CLAIM_LEASE):
+        """
+        Claim a piece of work across every worker, without waiting for it.
+
+        Yields whether this worker got the claim. While it holds the claim, a
+        background thread renews the lease every third of it, so work that takes
+        longer than the lease is not picked up by another worker, while the claim
+        of a worker that died expires after at most one lease.
+
+        Args:
+            name (str): The name of the work.
+            lease (float, optional): Seconds the claim lasts without being renewed.
+
+        Example usage:
+
+        >>> with state.claim(f"llm:{key}") as claimed:
+        ...     if claimed:
+        ...         compute()
+        """
+        key = f"claim:{name}"
+        owner = uuid.uuid4().hex
+        if not self.add(key, owner, ttl=lease):
+            yield False
+            return
+        released = threading.Event()
+
+        def renew():
+            while not released.wait(lease / 3):
+                if not self.renew(key, owner, lease):
+                    return
+
+        renewer = threading.Thread(target=renew, daemon=True)
+        renewer.start()
+        try:
+            yield True
+        finally:
+            released.set()
+            renewer.join()
+            self.delete(key, owner)
+
+    def claimed(self, name):
+        """
+        Whether a worker holds the claim on a piece of work.
+        """
+        return self.get(f"claim:{name}") is not None
+
+    def wait(self, name, read, cancel_token=None):
+        """
+        Wait while another worker holds the claim on a piece of work, polling for its
+        result. Only reads are made while waiting.
+
+        Args:
+            name (str): The name of the work.
+            read (callable): Returns the work's result, or None while there is none.
+            cancel_token (CancelToken, optional): Token that stops the wait.
+
+        Returns:
+            The result, or None if the claim was released without one, e.g. because
+            the work failed or was cancelled.
+
+        Raises:
+            Cancelled: If cancel_token was cancelled while waiting.
+        """
+        cancel_token = cancel_token or CancelToken()
+        while True:
+            result = read()
+            if result is not None:
+                return result
+            if not self.claimed(name):
+                return read()
+            cancel_token.sleep(LOCK_POLL)
+
+    def once(self, key, compute, ttl=None, cancel_token=None):
+        """
+        Return the value cached under key, computing it in exactly one worker.
+
+        The worker that claims key computes the value. Workers that ask for the same
+        key meanwhile wait for its result, and take over the claim if it is released
+        without one.
+
+        Args:
+            key (str): The cache key.
+            compute (callable): Produces the value as a string.
+            ttl (float, optional): Seconds to cache the value for.
+            cancel_token (CancelToken, optional): Token that stops the wait for
+                another worker's value.
+
+        Raises:
+            Cancelled: If cancel_token was cancelled while waiting.
+        """
+        while True:
+            value = self.get(key)
+            if value is not None:
+                return value
+            with self.claim(key) as claimed:
+                if claimed:
+                    value = self.get(key)
+                    if value is None:
+                        value = compute()
+                        self.set(key, value, ttl)
+                    return value
+            value = self.wait(key, lambda: self.get(key), cancel_token)
+            if value is not None:
+                return value
+
+
+class SQLiteState(SharedState):
+    """
+    SharedState in a SQLite file, for several workers on one host.
+
+    Every write runs in an immediate transaction, so SQLite's file lock serializes
+    workers and check-and-set operations such as add() are atomic across processes.
+    """
+
+    def __init__(self, path="shared_state.sqlite3"):
+        """
+        Initialize a SQLiteState instance.
+
+        Args:
+            path (str, optional): Path of the SQLite file shared by the workers.
+        """
+        self.path = path
+        self.local = threading.local()
+        with self._transaction() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_expires_at ON entries(expires_at)")
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    queue TEXT NOT NULL,
+                    priority REAL NOT NULL,
+                    payload TEXT NOT NULL
+                )
+            """)
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_order ON jobs(queue, priority, id)")
+
+    def _connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def get(self, key):
+        row = self._connection().execute(
+            "SELECT value FROM entries WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        now = time.time()
+        with self._transaction() as connection:
+            # Expired entries are only ever skipped by reads, so writes delete them.
+            connection.execute("DELETE FROM entries WHERE expires_at <= ?", (now,))
+            connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl else None)
+            )
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM entries WHERE key = ? AND expires_at <= ?", (key, now))
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO entries VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl else None)
+            )
+            return cursor.rowcount == 1
+
+    def incr(self, key, ttl=None):
+        now = time.time()
+        with self._transaction() as connection:
+            connection.execute("DELETE FROM entries WHERE key = ? AND expires_at <= ?", (key, now))
+            connection.execute(
+                "INSERT OR IGNORE INTO entries VALUES (?, '0', ?)",
+                (key, now + ttl if ttl else None)
+            )
+            connection.execute("UPDATE entries SET value = CAST(value AS INTEGER) + 1 WHERE key = ?", (key,))
+            return int(connection.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()[0])
+
+    def renew(self, key, value, ttl):
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE entries SET expires_at = ? WHERE key = ? AND value = ? AND expires_at > ?",
+                (now + ttl, key, value, now)
+            )
+            return cursor.rowcount == 1
+
+    def delete(self, key, value=None):
+        with self._transaction() as connection:
+            if value is None:
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            else:
+                connection.execute("DELETE FROM entries WHERE key = ? AND value = ?", (key, value))
+
+    def take(self, key):
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT value, expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+        (value, expires_at) = row
+        return value if expires_at is None or expires_at > time.time() else None
+
+    def push(self, queue, payload, priority=0):
+        with self._transaction() as connection:
+            connection.execute(
+                "INSERT INTO jobs (queue, priority, payload) VALUES (?, ?, ?)",
+                (queue, priority, json.dumps(payload))
+            )
+
+    def pop(self, queue, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._transaction() as connection:
+                row = connection.execute(
+                    "SELECT id, payload FROM jobs WHERE queue = ? ORDER BY priority, id LIMIT 1",
+                    (queue,)
+                ).fetchone()
+                if row is not None:
+                    connection.execute("DELETE FROM jobs WHERE id = ?", (row[0],))
+                    return json.loads(row[1])
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(LOCK_POLL * 4)
+
+
+class RedisState(SharedState):
+    """
+    SharedState in Redis, or any server speaking the Redis protocol, for workers on
+    several nodes. Requires the redis package.
+    """
+
+    remote = True
+
+    # Deletes a key only if it still holds the caller's value, so a worker never
+    # releases a lock that expired and was taken by another worker.
+    RELEASE = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+
+    # Extends a key's expiry only if it still holds the caller's value.
+    RENEW = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('pexpire', KEYS[1], ARGV[2]) end return 0"
+
+    # Counts up from 0, setting the expiry only when the count starts, in one step.
+    INCR = (
+        "local count = redis.call('incr', KEYS[1]) "
+        "if count == 1 and tonumber(ARGV[1]) > 0 then redis.call('pexpire', KEYS[1], ARGV[1]) end return count"
+    )
+
+    def __init__(self, url="redis://localhost:6379/0"):
+        """
+        Initialize a RedisState instance.
+
+        Args:
+            url (str, optional): The Redis URL.
+        """
+        if redis is None:
+            raise ImportError("RedisState requires the redis package: pip install redis")
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.release = self.client.register_script(RedisState.RELEASE)
+        self.extend = self.client.register_script(RedisState.RENEW)
+        self.count = self.client.register_script(RedisState.INCR)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, value, nx=True, px=int(ttl * 1000) if ttl else None))
+
+    def incr(self, key, ttl=None):
+        return self.count(keys=[key], args=[int(ttl * 1000) if ttl else 0])
+
+    def renew(self, key, value, ttl):
+        return bool(self.extend(keys=[key], args=[value, int(ttl * 1000)]))
+
+    def delete(self, key, value=None):
+        if value is None:
+            self.client.delete(key)
+        else:
+            self.release(keys=[key], args=[value])
+
+    def take(self, key):
+        return self.client.getdel(key)
+
+    def push(self, queue, payload, priority=0):
+        # Members must be unique, and ties in priority pop in insertion order.
+        score = priority * 1e13 + time.time() * 1000
+        member = json.dumps({"id": uuid.uuid4().hex, "payload": payload})
+        self.client.zadd(f"queue:{queue}", {member: score})
+
+    def pop(self, queue, timeout=None):
+        if timeout is None:
+            popped = self.client.bzpopmin(f"queue:{queue}", timeout=0)
+        elif timeout <= 0:
+            popped = self.client.zpopmin(f"queue:{queue}")
+            popped = (f"queue:{queue}",) + popped[0] if popped else None
+        else:
+            popped = self.client.bzpopmin(f"queue:{queue}", timeout=timeout)
+        if not popped:
+            return None
+        return json.loads(popped[1])["payload"]
@@ -1,18 +1,43 @@
 import logging
 import openai
-from langchain.chat_models import ChatOpenAI
 from langchain import PromptTemplate
 from dotenv import dotenv_values
 from pathlib import Path
 import json
+from enum import Enum
 
 from page import Page
 from page_content import PageContent
-from story_config import StoryConfig
+from story_config import StoryConfig, option_value
+from llm_cache import LLMCache
+from cancellation import CancelToken
+from model_router import ModelRouter
 
 API_KEY = dotenv_values(".env").get("OPENAI_API_KEY")
 openai.api_key = API_KEY
 
+# Version of the dictionary layout produced by Story.to_json.
+SCHEMA_VERSION = 1
+
+SPLITTER = '\n\n'
+
+
+class Illustration(Enum):
+    """
+    How completely a story's pages have been illustrated, from least to most.
+
+    Stories are stored under one key per illustration state, so a text-only or
+    degraded run never replaces a fully illustrated copy of the same story.
+    """
+    NONE = "text"
+    CACHED_FACES = "cached_faces"
+    FULL = "full"
+
+    def __lt__(self, other):
+        order = list(Illustration)
+        return order.index(self) < order.index(other)
+
+
 class Story:
     """
     Represents a story.
@@ -23,7 +48,9 @@ class Story:
     Attributes:
         config (StoryConfig): Configuration settings for generating the story.
         pages (list): A list of Page objects representing the story's pages.
-        llm (ChatOpenAI): The language model used for generating the story.
+        illustration (Illustration): How completely the pages have been illustrated.
+        llm (ChatOpenAI): The language model used for generating the story, routed by
+            ModelRouter and shared by every Story in the process.
 
     Example usage:
 
@@ -35,6 +62,10 @@ class Story:
     >>> print(story_instance.pages)
     """
 
+    __slots__ = ("config", "pages", "text", "name", "text_name", "illustration")
+
+    _llm = None
+
     def __init__(self, config: StoryConfig):
         """
         Initialize a Story instance.
@@ -44,19 +75,110 @@ class Story:
         """
         self.config = config
         self.pages = []
-        self.llm = ChatOpenAI(
-            openai_api_key=API_KEY,
-            temperature=0.0
-        )
         self.text = ""
-        self.name =  f'{self.config.text_id}_{self.config.age}_{self.config.color}_{self.config.img_style}_{self.config.sz}'
+        self.illustration = Illustration.NONE
+        (age, language, img_style, color, sz) = (
+            option_value(option) for option in (config.age, config.language, config.img_style, config.color, config.sz)
+        )
+        self.name = f'{config.text_id}_{age}_{language}_{color}_{img_style}_{sz}_{config.max_pages}'
+        # Image style and color do not change the text, so stories that differ only in
+        # those share their text under this key.
+        self.text_name = f'{config.text_id}_{age}_{language}_{sz}_{config.max_pages}'
 
+    def key(self, illustration=None):
+        """
+        Return the key the story is stored under for an illustration state.
 
-    def build_story(self):
+        Args:
+            illustration (Illustration, optional): Defaults to the story's own state.
+        """
+        return f'{self.name}_{(illustration or self.illustration).value}'
+
+    def inferred_illustration(self):
+        """
+        Return the illustration state implied by the pages, for stories saved before
+        it was recorded.
+        """
+        if any(page.content.imageURL for page in self.pages):
+            return Illustration.FULL
+        return Illustration.NONE
+
+    @property
+    def llm(self):
+        """
+        The model on the "build_story" route, created on first use and shared by every Story.
+        """
+        if Story._llm is None:
+            Story._llm = ModelRouter.shared().model("build_story")
+        return Story._llm
+
+    def build_story(self, cancel_token=None, on_segment=None):
         """
         Build the story based on the provided configuration.
+
+        If the config sets max_pages, the build can be cancelled, or on_segment is
+        given, the story is streamed. Generation stops as soon as max_pages complete
+        segments have arrived, or when cancel_token is cancelled.
+
+        Args:
+            cancel_token (CancelToken, optional): Token checked between streamed chunks
+                and while another worker writes the same story.
+            on_segment (callable, optional): Called with the text of each page as soon
+                as it has been streamed in full. Not called for a cached story.
+
+        Raises:
+            Cancelled: If cancel_token was cancelled before the story was complete.
         """
-        self.text = self.llm.predict(self.config.get_prompt())
+        prompt = self.config.get_prompt()
+        cache = LLMCache.shared()
+        if self.config.max_pages is None and cancel_token is None and on_segment is None:
+            self.text = cache.predict(self.llm, prompt, "build_story")
+        else:
+            self.text = cache.get_or_compute(
+                "build_story",
+                cache.key(self.llm, prompt),
+                lambda: self._stream_segments(prompt, self.config.max_pages, cancel_token, on_segment),
+                cancel_token
+            )
+
+    def continue_story(self, pages, cancel_token=None, on_segment=None):
+        """
+        Generate the next pages of a story that was built with max_pages.
+
+        The new pages are appended to self.pages, so a saved story can be extended
+        lazily as the reader gets to the end of it.
+
+        Args:
+            pages (int): The number of pages to add.
+            cancel_token (CancelToken, optional): Token checked between streamed chunks
+                and while another worker writes the same pages.
+            on_segment (callable, optional): Called with the text of each new page as
+                soon as it has been streamed in full.
+
+        Returns:
+            list: The new Page objects.
+        """
+        prompt = self.config.get_continuation_prompt(self.text, pages)
+        cache = LLMCache.shared()
+        text = cache.get_or_compute(
+            "continue_story",
+            cache.key(self.llm, prompt),
+            lambda: self._stream_segments(prompt, pages, cancel_token, on_segment),
+            cancel_token
+        )
+        new_pages = [
+            Page(content=PageContent(segment, None), pageNo=len(self.pages) + i + 1)
+            for (i, segment) in enumerate(_segments(text))
+        ]
+        self.pages.extend(new_pages)
+        self.text = SPLITTER.join(filter(None, [self.text, text]))
+        return new_pages
+
+    def _stream_segments(self, prompt, max_pages, cancel_token=None, on_segment=None):
+        """
+        Stream a completion from the story's model with stream_segments.
+        """
+        return stream_segments(self.llm, prompt, max_pages, cancel_token, on_segment)
 
     def build_pages(self):
         """
@@ -64,8 +186,7 @@ class Story:
 
         Each page is created based on the text generated for the story.
         """
-        splitter = '\n\n'
-        for (i, text) in enumerate(list(filter(lambda x: x and x != " ", self.text.split(splitter)))):
+        for (i, text) in enumerate(_segments(self.text)):
             self.pages.append(Page(
                 content=PageContent((text), None),
                 pageNo=(i + 1)
@@ -78,19 +199,49 @@ class Story:
         Args:
             illustrator: An instance of StoryIllustrator used to fetch images.
         """
-        for (i, page) in enumerate(illustrator.store):
-            self.pages[i].content.imageURL = illustrator.store[page]
+        for (n, imageURL) in illustrator.store.items():
+            self.pages[n].content.imageURL = imageURL
 
     def to_json(self):
         """
         Serialize the object to JSON.
+
+        The source text is stored once under "texts", keyed by the config's text_id.
         """
         return {
+            "version":SCHEMA_VERSION,
             "config":self.config.to_json(),
+            "texts":{self.config.text_id: self.config.text},
             "pages":[page.to_json() for page in self.pages],
-            
+            "illustration":self.illustration.value,
         }
 
+    @classmethod
+    def from_json(cls, data):
+        """
+        Deserialize a Story from the output of to_json.
+
+        Args:
+            data (dict): The output of to_json.
+
+        Returns:
+            Story: The deserialized story.
+
+        Raises:
+            ValueError: If data was written with an unsupported schema version.
+        """
+        if data.get("version") != SCHEMA_VERSION:
+            raise ValueError(f"Unsupported story schema version: {data.get('version')}")
+        text_id = data["config"]["text_id"]
+        story = cls(StoryConfig.from_json(data["config"], data["texts"][text_id]))
+        story.pages = [Page.from_json(page) for page in data["pages"]]
+        story.text = SPLITTER.join(page.content.text for page in story.pages)
+        if "illustration" in data:
+            story.illustration = Illustration(data["illustration"])
+        else:
+            story.illustration = story.inferred_illustration()
+        return story
+
     def save_json(self):
         """
         Serialize the object to a JSON file and save it in the 'story_jsons' directory.
@@ -114,6 +265,57 @@ class Story:
         story_path = Path.joinpath(json_directory, f"{self.name}.json")
         # if story_path.exists():
         #     raise ValueError("Story configuration has already been generated and saved.")
-        story_path.touch()
         story_json = json.dumps(self.to_json())
-        story_path.write_text(story_json, encoding="utf-8")
\ No newline at end of file
+        story_path.write_text(story_json, encoding="utf-8")
+
+
+
+def stream_segments(llm, prompt, max_pages, cancel_token=None, on_segment=None):
+    """
+    Stream a completion and stop once max_pages complete segments have arrived.
+
+    Closing the stream early also stops generation on the API side. Partial
+    output is never returned for a cancelled stream, so it is never cached.
+
+    Args:
+        llm: The chat model to stream from.
+        prompt (str): The formatted prompt.
+        max_pages (int): The number of segments to keep, or None for no limit.
+        cancel_token (CancelToken, optional): Token checked between streamed chunks.
+        on_segment (callable, optional): Called with each kept segment as soon as
+            it is complete.
+
+    Returns:
+        str: At most max_pages segments separated by SPLITTER.
+
+    Raises:
+        Cancelled: If cancel_token was cancelled before the stream finished.
+    """
+    cancel_token = cancel_token or CancelToken()
+    notify = on_segment or (lambda segment: None)
+    text = ""
+    sent = 0
+    for chunk in llm.stream(prompt):
+        cancel_token.check()
+        text += chunk.content
+        if (max_pages is None and on_segment is None) or "\n" not in chunk.content:
+            continue
+        complete = _segments(text)[:-1][:max_pages]
+        for segment in complete[sent:]:
+            notify(segment)
+        sent = len(complete)
+        if max_pages is not None and len(complete) >= max_pages:
+            logging.info(f"Stopped generation after {max_pages} segments.")
+            return SPLITTER.join(complete)
+    cancel_token.check()
+    segments = _segments(text)[:max_pages]
+    for segment in segments[sent:]:
+        notify(segment)
+    return SPLITTER.join(segments)
+
+
+def _segments(text):
+    """
+    Split generated story text into its non-empty segments.
+    """
+    return list(filter(lambda x: x and x != " ", text.split(SPLITTER)))
@@ -1,18 +1,27 @@
 from story import Story
 import json
 from langchain import PromptTemplate
-from langchain.chat_models import ChatOpenAI
 from story_config import StoryConfig
-from story_config import ImageGenStyle
+from story_config import option_value
 from dotenv import dotenv_values
 import requests
-import time
+from cancellation import CancelToken
+import logging
 from collections import defaultdict
+from langchain.schema import HumanMessage
+from character_parser import CharacterParser, CHARACTER_FUNCTION
+from context_budget import ContextBudget, CHARACTER_STORY_BUDGET
+from model_router import ModelRouter
+from shared_state import SharedState
+from atomic_file import write_atomic
 
 # Load the OpenAI API key from the .env file
 API_KEY = dotenv_values(".env").get("OPENAI_API_KEY")
 MJ_API_KEY = dotenv_values(".env").get("MJ_API_KEY")
 
+# Faces of the characters seen so far, by lower-cased character name.
+CHARACTER_MAP_PATH = "character_map.json"
+
 class StoryCharacters:
     """
     A class for analyzing characters in a story and generating character descriptions using the OpenAI API.
@@ -22,7 +31,7 @@ class StoryCharacters:
 
     Attributes:
         story (Story): The story for which character descriptions are generated.
-        llm (ChatOpenAI): The language model used for generating descriptions.
+        llm (ChatOpenAI): The first model on the "characters" route.
 
     Example usage:
 
@@ -33,21 +42,27 @@ class StoryCharacters:
     >>> print(character_descriptions)
     """
 
-    def __init__(self, story: Story, config:StoryConfig):
+    def __init__(self, story: Story, config:StoryConfig, cancel_token=None, image_store=None):
         """
         Initialize a StoryCharacters instance.
 
         Args:
             story (Story): The story for which character descriptions are generated.
+            cancel_token (CancelToken, optional): Token that stops face generation early.
+            image_store (ImageStore, optional): Store that rendered faces are downloaded into,
+                so that the character map points at local copies.
         """
         self.story = story
-        self.llm = ChatOpenAI(temperature=0.0, openai_api_key=API_KEY)
+        self.llm = ModelRouter.shared().model("characters")
         self.imagine_url = 'https://api.thenextleg.io/v2/imagine'
         self.characterImages = defaultdict()
-        self.character_file = open("character_map.json", 'r+')
-        self.character_map = json.loads(self.character_file.read())
+        with open(CHARACTER_MAP_PATH, encoding="utf-8") as character_file:
+            self.character_map = json.load(character_file)
+        self.state = SharedState.shared()
         self.config = config
-
+        self.parser = CharacterParser()
+        self.cancel_token = cancel_token or CancelToken()
+        self.image_store = image_store
 
 
     def fetchCharacters(self):
@@ -70,13 +85,72 @@ class StoryCharacters:
         Infer gender and age of each character.
         The keys should be 'description', 'name', 'attire', 'gender', 'age'.
         """)
-        formatted = prompt.format(story=self.story.text)
-        self.json = json.loads(
-            self.llm.predict(
-                formatted
+        self.cancel_token.check()
+        budget = ContextBudget(CHARACTER_STORY_BUDGET)
+        formatted = prompt.format(story=budget.fit_story(self.story.text, ModelRouter.shared()))
+        logging.info(f"fetchCharacters prompt: {budget.count(formatted)} tokens.")
+        valid, invalid = self.parser.parse(self._predictCharacters(formatted, "characters"))
+        if invalid:
+            valid.update(self._repairCharacters(invalid))
+        self.json = valid
+        return self.json
+
+    def _predictCharacters(self, formatted, site):
+        """
+        Ask the model for characters through a function call so that the output
+        follows CHARACTER_FUNCTION's schema, escalating along the site's route when
+        no valid character can be parsed from the output.
+
+        Args:
+            formatted (str): The formatted prompt.
+            site (str): The LLMCache call site name.
+
+        Returns:
+            str: The JSON arguments of the function call, or the plain message
+                content if the model answered without calling the function.
+        """
+        def predict(llm):
+            message = llm.predict_messages(
+                [HumanMessage(content=formatted)],
+                functions=[CHARACTER_FUNCTION],
+                function_call={"name": CHARACTER_FUNCTION["name"]}
             )
+            function_call = message.additional_kwargs.get("function_call") or {}
+            return function_call.get("arguments") or message.content
+
+        return ModelRouter.shared().call(
+            site,
+            formatted,
+            predict,
+            validate=lambda output: bool(self.parser.parse(output)[0]),
+            key_extra=json.dumps(CHARACTER_FUNCTION)
         )
-        return self.json
+
+    def _repairCharacters(self, invalid):
+        """
+        Complete the entries that are missing required keys with a single repair call.
+
+        Only the invalid entries are sent back to the model; entries that are still
+        invalid after the repair are dropped.
+
+        Args:
+            invalid (dict): Mapping from character name to its incomplete entry.
+
+        Returns:
+            dict: Mapping from character name to its repaired entry.
+        """
+        logging.info(f"Repairing {len(invalid)} incomplete character entries: {list(invalid)}")
+        prompt = PromptTemplate.from_template("""
+        The following character descriptions from a story are incomplete {characters}.
+        Fill in every missing key. The keys should be 'description', 'name', 'attire', 'gender', 'age'.
+        The description should not be sentences, just comma-separated adjectives.
+        """)
+        repaired, still_invalid = self.parser.parse(
+            self._predictCharacters(prompt.format(characters=json.dumps(invalid)), "characters_repair")
+        )
+        if still_invalid:
+            logging.warning(f"Dropping characters that could not be repaired: {list(still_invalid)}")
+        return repaired
 
     def getMessageId(self, prompt):
         """
@@ -148,8 +222,9 @@ class StoryCharacters:
         response=json.loads(requests.request("GET", messageUrl, headers=headers).text)
 
         while response['progress']!=100:
+            # Stop polling as soon as the request is cancelled.
+            self.cancel_token.sleep(5)
             response = json.loads(requests.request("GET", messageUrl, headers=headers).text)
-            time.sleep(5)
         print(response['response']['imageUrls'][0])
         return response['response']["imageUrls"][0]
 
@@ -167,7 +242,7 @@ class StoryCharacters:
             age=character['age'],
             description=character['description'], 
             attire=character['attire'],
-            style=ImageGenStyle[self.config.img_style].value
+            style=option_value(self.config.img_style)
             )
         )
 
@@ -178,20 +253,55 @@ class StoryCharacters:
             transformed[key.lower()] = self.json[key]
         self.json = transformed
         
-    def generateCharacterFaces(self):
+    def generateCharacterFaces(self, render_new=True):
+        """
+        Fetch a face for every character, rendering the ones not seen before.
+
+        Faces are shared by every worker through SharedState, and each new face is
+        rendered by a single worker while the others wait for it. That worker also
+        adds the face to character_map.json, so it survives the shared state.
+
+        Args:
+            render_new (bool, optional): Whether to render faces for characters that are
+                not in the character map. Under load only cached faces are reused.
+
+        Returns:
+            dict: Mapping from character name to face image URL.
+        """
         self.transformKeysToLowerCase()
         for character in self.json:
-            if character in self.character_map:
+            face = self.character_map.get(character) or self.state.get(f"face:{character}")
+            if face is not None:
                 print(f"{character} cached...fetching resemblance from memory.")
-                self.characterImages[character] = self.character_map[character]
+                self.characterImages[character] = face
+            elif not render_new:
+                print(f"{character} not seen before...skipping resemblance under load.")
             else:
+                self.cancel_token.check()
                 print(f"{character} not seen before...generating resemblance.")
-                self.characterImages[character] = self._generateCharacterFace(character)
+                self.characterImages[character] = self.state.once(
+                    f"face:{character}", lambda: self._renderCharacterFace(character),
+                    cancel_token=self.cancel_token
+                )
+            if character in self.characterImages:
                 self.character_map[character] = self.characterImages[character]
-        print(f'New character map:{self.character_map}')
-        self.character_file.write("") #flush existing contents
-        #overwrite with new contents
-        self.character_file.write(json.dumps(self.character_map))
         return self.characterImages
 
+    def _renderCharacterFace(self, character):
+        url = self._generateCharacterFace(character)
+        if self.image_store is not None:
+            url = self.image_store.localize(url)
+        self._saveCharacterFace(character, url)
+        return url
+
+    def _saveCharacterFace(self, character, url):
+        """
+        Add a rendered face to character_map.json, keeping the faces other workers added.
+        """
+        with self.state.lock("character_map"):
+            with open(CHARACTER_MAP_PATH, encoding="utf-8") as character_file:
+                character_map = json.load(character_file)
+            character_map[character] = url
+            write_atomic(CHARACTER_MAP_PATH, json.dumps(character_map, indent=4))
+
 
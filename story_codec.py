@@ -0,0 +1,93 @@
+import json
+
+from page import Page
+from page_content import PageContent
+from story import Story, Illustration, SPLITTER
+from story_config import StoryConfig
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Version of the compact layout produced by StoryCodec.encode.
+CODEC_VERSION = 1
+
+CONFIG_FIELDS = ["age", "language", "img_style", "color", "sz", "text_id", "max_pages"]
+
+
+class StoryCodec:
+    """
+    Compact binary serialization for stories kept in caches and stores.
+
+    Stories are encoded as positional arrays rather than nested dicts, with the page
+    number implied by position. orjson is used when it is installed, otherwise the
+    standard library json module with compact separators.
+
+    Example usage:
+
+    >>> codec = StoryCodec()
+    >>> data = codec.encode(story)
+    >>> story = codec.decode(data)
+    """
+
+    def encode(self, story: Story, include_text=True):
+        """
+        Encode a story to bytes.
+
+        Args:
+            story (Story): The story to encode.
+            include_text (bool, optional): Whether to embed the source text. Stores that
+                keep source texts separately by text_id can leave it out.
+
+        Returns:
+            bytes: The encoded story.
+        """
+        config = story.config.to_json()
+        payload = {
+            "v": CODEC_VERSION,
+            "c": [config[field] for field in CONFIG_FIELDS],
+            "p": [[page.content.text, page.content.imageURL] for page in story.pages],
+            "i": story.illustration.value
+        }
+        if include_text:
+            payload["t"] = story.config.text
+        if orjson is not None:
+            return orjson.dumps(payload)
+        return json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+    def decode(self, data, text=None):
+        """
+        Decode a story from bytes produced by encode.
+
+        Args:
+            data (bytes): The encoded story.
+            text (str, optional): The source text, required if it was not embedded.
+
+        Returns:
+            Story: The decoded story.
+
+        Raises:
+            ValueError: If data was written with an unsupported codec version, or if no
+                source text is available.
+        """
+        payload = orjson.loads(data) if orjson is not None else json.loads(data)
+        if payload.get("v") != CODEC_VERSION:
+            raise ValueError(f"Unsupported story codec version: {payload.get('v')}")
+        config = dict(zip(CONFIG_FIELDS, payload["c"]))
+        text = payload.get("t", text)
+        if text is None:
+            text = StoryConfig.cached_text(config["text_id"])
+        if text is None:
+            raise ValueError(f"No source text available for {config['text_id']}")
+        story = Story(StoryConfig.from_json(config, text))
+        story.pages = [
+            Page(PageContent(page_text, imageURL), pageNo=i + 1)
+            for (i, (page_text, imageURL)) in enumerate(payload["p"])
+        ]
+        story.text = SPLITTER.join(page_text for (page_text, _) in payload["p"])
+        if "i" in payload:
+            story.illustration = Illustration(payload["i"])
+        else:
+            story.illustration = story.inferred_illustration()
+        return story
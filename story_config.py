@@ -1,6 +1,12 @@
+from collections import OrderedDict
 from enum import Enum
 from langchain import PromptTemplate
 import hashlib
+import threading
+
+# Number of distinct source texts kept for sharing between configs. The corpus has
+# about 400 episodes; retrieval windows add a few more.
+MAX_TEXTS = 1024
 
 class AgeRange(Enum):
     """
@@ -40,6 +46,34 @@ class PageSz(Enum):
     MD = "medium"
     LG = "large"
 
+def option_value(option):
+    """
+    Returns the JSON-serializable value of a config option, which may be an Enum or
+    a free-form string that matches no member.
+    """
+    return option.value if isinstance(option, Enum) else option
+
+
+def _loose(text):
+    return str(text).strip().lower().rstrip("s")
+
+
+def _option(enum, option):
+    """
+    Returns the member of enum that option names, matching values and member names
+    loosely so that the UI's "Preteens", "Teens", "COMIC" and "Adult" and the
+    serialized "preteens", "teenagers" and "adults" all resolve. Options that match
+    no member, such as a free-form style, are returned unchanged.
+    """
+    if isinstance(option, enum) or option is None:
+        return option
+    key = _loose(option_value(option))
+    for member in enum:
+        if key in (_loose(member.value), _loose(member.name)):
+            return member
+    return option
+
+
 class StoryConfig:
     """
     Represents the configuration of a story.
@@ -55,6 +89,10 @@ class StoryConfig:
         img_style (ImageGenStyle): The style of image generation for the story.
         color (Color, optional): The color configuration for the story (default is Color.COLOR).
         sz (PageSz, optional): The page size (text length) for each segment (default is PageSz.LG).
+        max_pages (int, optional): The number of segments to generate, or None for no limit.
+
+    Options given as strings are converted to their enum members when they name one,
+    so a config built from UI strings and one restored by from_json are equal.
 
     Example usage:
 
@@ -68,7 +106,15 @@ class StoryConfig:
     >>> print(prompt)
     """
 
-    def __init__(self, age: AgeRange, language: Language, text: str, img_style: ImageGenStyle, color: Color = Color.COLOR, sz: PageSz = PageSz.LG):
+    __slots__ = ("age", "language", "img_style", "color", "sz", "max_pages", "text_id", "_text")
+
+    # The most recently used source texts keyed by text_id, so that every config built
+    # from the same text shares one copy of it. Each config also holds its text, so
+    # evicting a text never breaks a live config.
+    texts = OrderedDict()
+    texts_lock = threading.Lock()
+
+    def __init__(self, age: AgeRange, language: Language, text: str, img_style: ImageGenStyle, color: Color = Color.COLOR, sz: PageSz = PageSz.LG, max_pages=None):
         """
         Initialize a StoryConfig instance.
 
@@ -79,34 +125,86 @@ class StoryConfig:
             img_style (ImageGenStyle): The style of image generation for the story.
             color (Color, optional): The color configuration for the story (default is Color.COLOR).
             sz (PageSz, optional): The page size (text length) for each segment (default is PageSz.LG).
+            max_pages (int, optional): The number of segments to generate, or None for no limit.
+        """
+        self.age = _option(AgeRange, age)
+        self.language = _option(Language, language)
+        self.img_style = _option(ImageGenStyle, img_style)
+        self.color = _option(Color, color)
+        self.sz = _option(PageSz, sz)
+        self.max_pages = max_pages
+        self.text_id = hashlib.sha3_512(bytes(text, "utf-8")).hexdigest()
+        self._text = StoryConfig._share(self.text_id, text)
+
+    @property
+    def text(self):
+        """
+        The source text for the story, shared by every config with the same text_id.
+        """
+        return self._text
+
+    @classmethod
+    def cached_text(cls, text_id):
+        """
+        Return the source text with the given text_id if it is still cached, or None.
         """
-        self.age = age
-        self.language = language
-        self.text = text
-        self.img_style = img_style
-        self.color = color
-        self.sz = sz
-        self.hasher = hashlib.sha3_512()
-        self.hasher.update(bytes(self.text, "utf-8"))
-        self.text_id = self.hasher.hexdigest()
+        with cls.texts_lock:
+            return cls.texts.get(text_id)
+
+    @classmethod
+    def _share(cls, text_id, text):
+        """
+        Return the cached copy of text, caching it and evicting the least recently
+        used text beyond MAX_TEXTS if it is new.
+        """
+        with cls.texts_lock:
+            if text_id in cls.texts:
+                cls.texts.move_to_end(text_id)
+                return cls.texts[text_id]
+            cls.texts[text_id] = text
+            while len(cls.texts) > MAX_TEXTS:
+                cls.texts.popitem(last=False)
+            return text
 
     def to_json(self):
         """
         Serialize the StoryConfig object to a JSON-serializable dictionary.
 
+        The source text is not included; it is referenced by text_id.
+
         Returns:
             dict: A JSON-serializable dictionary representing the StoryConfig object.
         """
         return {
-            "age": self.age,
-            "language": self.language,
-            "text": self.text,
-            "img_style": self.img_style,
-            "color": self.color,
-            "sz": self.sz,
+            "age": option_value(self.age),
+            "language": option_value(self.language),
+            "img_style": option_value(self.img_style),
+            "color": option_value(self.color),
+            "sz": option_value(self.sz),
+            "max_pages": self.max_pages,
             "text_id": self.text_id
         }
 
+    @classmethod
+    def from_json(cls, data, text):
+        """
+        Deserialize a StoryConfig from the output of to_json and its source text.
+
+        Option values are converted back to their enum members, so the config's
+        Story.name is the same as before it was serialized.
+
+        Args:
+            data (dict): The output of to_json.
+            text (str): The source text referenced by data["text_id"].
+
+        Returns:
+            StoryConfig: The deserialized configuration.
+        """
+        config = cls(data["age"], data["language"], text, data["img_style"], data["color"], data["sz"], data.get("max_pages"))
+        if config.text_id != data["text_id"]:
+            raise ValueError("Source text does not match the config's text_id.")
+        return config
+
     def get_prompt(self):
         """
         Generates a prompt to build a story with this configuration.
@@ -119,7 +217,39 @@ class StoryConfig:
             Separate each segment with two new lines. Do not include segment headers.
             Make a scene for each segment, with dialogues for characters in the segment.
             Make each segment {size} in size. Make it elaborate and descriptive.
-            The target age for this story is {age}.
+            The target age for this story is {age}.{length}
             {text}
         """)
-        return prompt.format(language=self.language, age=self.age, text=self.text, size=self.sz)
+        return prompt.format(language=option_value(self.language), age=option_value(self.age), text=self.text,
+                             size=option_value(self.sz), length=self._length())
+
+    def get_continuation_prompt(self, story_so_far, pages):
+        """
+        Generates a prompt to continue a story with this configuration.
+
+        Args:
+            story_so_far (str): The segments generated so far.
+            pages (int): The number of segments to add.
+
+        Returns:
+            str: The generated prompt.
+        """
+        prompt = PromptTemplate.from_template("""
+            Here is a text {text}
+            and here is the beginning of a story in {language} based on it {story_so_far}
+            Continue the story from where it stops with the next {pages} segments, following the text.
+            Separate each segment with two new lines. Do not include segment headers.
+            Make a scene for each segment, with dialogues for characters in the segment.
+            Make each segment {size} in size. Make it elaborate and descriptive.
+            The target age for this story is {age}.
+        """)
+        return prompt.format(language=option_value(self.language), age=option_value(self.age), text=self.text,
+                             size=option_value(self.sz), story_so_far=story_so_far, pages=pages)
+
+    def _length(self):
+        """
+        Returns the prompt sentence limiting the number of segments, if any.
+        """
+        if self.max_pages is None:
+            return ""
+        return f"\n            Write exactly {self.max_pages} segments and then stop."
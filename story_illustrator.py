@@ -1,10 +1,11 @@
-from story_config import StoryConfig
+from story_config import StoryConfig, option_value
 from dotenv import dotenv_values
 from collections import defaultdict
 from story_illustrator_query import StoryIllustratorQuery
 import requests
 import json
-import time
+from cancellation import CancelToken
+from image_store import ASSET_PREFIX
 
 # Load the OpenAI API key from the .env file
 API_KEY = dotenv_values(".env").get("MJ_API_KEY")
@@ -32,13 +33,18 @@ class StoryIllustrator:
     >>> print(illustrator.store)
     """
 
-    def __init__(self, story, config, story_characters):
+    def __init__(self, story, config, story_characters, cancel_token=None, image_store=None, prompt_index=None):
         """
         Initialize a StoryIllustrator instance.
 
         Args:
             story (Story): The story for which illustrations are generated.
             config (StoryConfig): Configuration settings for generating illustrations.
+            cancel_token (CancelToken, optional): Token that stops image generation early.
+            image_store (ImageStore, optional): Store that generated images are downloaded
+                into, so that pages point at local copies rather than expiring CDN URLs.
+            prompt_index (ImagePromptIndex, optional): Index of rendered prompts whose
+                images are reused for near-duplicate prompts instead of rendering them.
         """
         self.story = story
         self.config = config
@@ -46,6 +52,9 @@ class StoryIllustrator:
         self.story_characters = story_characters
         self.store = defaultdict()
         self.imagine_url = 'https://api.thenextleg.io/v2/imagine'
+        self.cancel_token = cancel_token or CancelToken()
+        self.image_store = image_store
+        self.prompt_index = prompt_index
 
 
     def getMessageId(self, prompt):
@@ -118,8 +127,9 @@ class StoryIllustrator:
         response=json.loads(requests.request("GET", messageUrl, headers=headers).text)
 
         while response['progress']!=100:
+            # Stop polling as soon as the request is cancelled.
+            self.cancel_token.sleep(5)
             response = json.loads(requests.request("GET", messageUrl, headers=headers).text)
-            time.sleep(5)
         return response['response']["imageUrls"][0]
 
 
@@ -157,18 +167,33 @@ class StoryIllustrator:
         illustratorQuery = StoryIllustratorQuery(page, self.story_characters, self.config)
 
         prompt = illustratorQuery.generatePrompt()
+        if self.prompt_index is not None:
+            imgUrl = self.prompt_index.match(prompt, option_value(self.config.img_style), option_value(self.config.color))
+            if imgUrl is not None:
+                self.store[pageNo] = imgUrl
+                return
         imgUrl = self.getImage(prompt)
+        if self.image_store is not None:
+            imgUrl = self.image_store.localize(imgUrl)
+        # Remote URLs expire within minutes, so only stored images are worth reusing.
+        if self.prompt_index is not None and imgUrl.startswith(ASSET_PREFIX):
+            self.prompt_index.add(prompt, option_value(self.config.img_style), option_value(self.config.color), imgUrl)
         self.store[pageNo] = imgUrl
 
-    def populateStore(self):
+    def populateStore(self, pages=None):
         """
-        Generate illustrations for all pages of the story and store their URLs in the 'store' dictionary.
+        Generate illustrations for the pages of the story and store their URLs in the 'store' dictionary.
+
+        Args:
+            pages (list, optional): Indexes of the pages to illustrate, such as the pages
+                added by Story.continue_story. Every page is illustrated when None.
 
         Example usage:
 
         >>> illustrator.populateStore()
         >>> print(illustrator.store)
         """
-        for n in range(len(self.pages)):
+        for n in (range(len(self.pages)) if pages is None else pages):
+            self.cancel_token.check()
             print(f"On page {n}/{len(self.pages)-1}")
             self.generateImage(n)
@@ -2,12 +2,10 @@ from story_characters import StoryCharacters
 from story_config import StoryConfig
 from page import Page
 from langchain import PromptTemplate
-from story_config import ImageGenStyle
-from langchain.chat_models import ChatOpenAI
-from dotenv import dotenv_values
-
-# Load the OpenAI API key from the .env file
-API_KEY = dotenv_values(".env").get("OPENAI_API_KEY")
+from story_config import option_value
+from context_budget import ContextBudget, PAGE_CHARACTER_BUDGET
+from model_router import ModelRouter
+import logging
 
 class StoryIllustratorQuery:
     """
@@ -20,7 +18,7 @@ class StoryIllustratorQuery:
     Attributes:
         page (Page): The page from the story that will be used in the prompt.
         story_characters (StoryCharacters): An instance of StoryCharacters containing character descriptions.
-        llm (ChatOpenAI): The language model used for generating prompts.
+        llm (ChatOpenAI): The language model used for generating prompts, routed by ModelRouter.
 
     Example usage:
 
@@ -45,7 +43,7 @@ class StoryIllustratorQuery:
         self.page = page
         self.story_characters = story_characters
         self.config = config
-        self.llm = ChatOpenAI(temperature=0.0, openai_api_key=API_KEY)
+        self.llm = ModelRouter.shared().model("illustration_prompt")
 
     def generatePrompt(self):
         """
@@ -71,13 +69,15 @@ class StoryIllustratorQuery:
         not give directives, it should just describe the scene. It should also be two sentences
         at most and should not include any narrative. Include the color and style at the end with commas.
         """)        
+        budget = ContextBudget(PAGE_CHARACTER_BUDGET)
         formatted = prompt.format(
             page=self.page.content.text, 
-            json=self.story_characters.json,
-            color=self.config.color,
-            style=ImageGenStyle[self.config.img_style].value
+            json=budget.compact_characters(self.story_characters.json, self.page.content.text),
+            color=option_value(self.config.color),
+            style=option_value(self.config.img_style)
         )
-        gen_prompt = self.llm.predict(formatted)
+        logging.info(f"generatePrompt prompt for page {self.page.pageNo}: {budget.count(formatted)} tokens.")
+        gen_prompt = ModelRouter.shared().predict("illustration_prompt", formatted)
         return gen_prompt+"::3 --seed 100"
 
          
@@ -0,0 +1,205 @@
+import logging
+import threading
+
+from story_retriever import StoryRetriever
+from story_config import StoryConfig
+from story import Story, Illustration
+from page import Page
+from page_content import PageContent
+from story_characters import StoryCharacters
+from story_illustrator import StoryIllustrator
+from story_variants import StoryVariants
+from cancellation import CancelToken, Cancelled
+
+
+class StoryJob:
+    """
+    Builds an illustrated story in a background thread, exposing progress as it goes.
+
+    Each page becomes available in pages as soon as its segment has been streamed,
+    before the rest of the story is written, and each page's image is filled in as
+    soon as it has been rendered, so a UI can render progressively by polling the
+    job. A finished story is saved to the story store, and a story that is already
+    in the store is served from it without running the pipeline.
+
+    Attributes:
+        status (str): One of the STATUS_* values.
+        source (str): The retrieved source text, once retrieval has finished.
+        story (Story): The story being built, once its text has been written.
+        draft (list): Pages streamed so far that are not in story yet.
+        error (Exception): The error that stopped the job, if it failed.
+
+    Example usage:
+
+    >>> job = StoryJob("Karna and the two curses", "Preteens", "English", "COMIC", "Color", "large",
+    ...                story_store=StoryStore(), image_store=ImageStore.shared())
+    >>> job.start()
+    >>> print(job.status, len(job.pages))
+    >>> more = StoryJob.continuation(job.story, pages=3, story_store=StoryStore()).start()
+    """
+
+    STATUS_RETRIEVING = "Finding the episode"
+    STATUS_WRITING = "Writing the story"
+    STATUS_CHARACTERS = "Imagining the characters"
+    STATUS_ILLUSTRATING = "Illustrating"
+    STATUS_DONE = "Done"
+    STATUS_FAILED = "Failed"
+    STATUS_CANCELLED = "Cancelled"
+
+    def __init__(self, query, age, language, img_style, color, size, max_pages=5,
+                 story_store=None, image_store=None, vectordb=None, illustrate=True, prompt_index=None):
+        """
+        Initialize a StoryJob instance.
+
+        Args:
+            query (str): The user's query.
+            age, language, img_style, color, size: Passed to StoryConfig.
+            max_pages (int, optional): The number of pages to generate.
+            story_store (StoryStore, optional): Store to serve from and save to.
+            image_store (ImageStore, optional): Store to download images into.
+            vectordb (Chroma, optional): Vector store reused across jobs.
+            illustrate (bool, optional): Whether to generate images.
+            prompt_index (ImagePromptIndex, optional): Index used to reuse images of
+                near-duplicate prompts.
+        """
+        self.query = query
+        self.config_args = (age, language, img_style, color, size)
+        self.max_pages = max_pages
+        self.story_store = story_store
+        self.image_store = image_store
+        self.vectordb = vectordb
+        self.illustrate = illustrate
+        self.prompt_index = prompt_index
+        self.cancel_token = CancelToken()
+        self.status = StoryJob.STATUS_RETRIEVING
+        self.source = None
+        self.story = None
+        self.draft = []
+        self.error = None
+        self.thread = None
+        self.continued = None
+
+    @classmethod
+    def continuation(cls, story, pages=3, **kwargs):
+        """
+        Return a job that adds pages to a story built with max_pages.
+
+        Args:
+            story (Story): The story to continue; its new pages are appended in place.
+            pages (int, optional): The number of pages to add.
+            **kwargs: Stores and options accepted by StoryJob.
+        """
+        config = story.config
+        job = cls(None, config.age, config.language, config.img_style, config.color, config.sz,
+                  max_pages=pages, **kwargs)
+        job.continued = story
+        job.source = config.text
+        return job
+
+    @property
+    def pages(self):
+        """
+        The pages written so far: the story's pages, then the streamed pages that
+        have not been added to the story yet.
+        """
+        pages = list(self.story.pages) if self.story is not None else []
+        written = pages[-1].pageNo if pages else 0
+        return pages + [page for page in list(self.draft) if page.pageNo > written]
+
+    def _add_draft(self, segment):
+        """
+        Record a page whose segment has just been streamed.
+        """
+        first = len(self.continued.pages) + 1 if self.continued is not None else 1
+        self.draft.append(Page(PageContent(segment, None), pageNo=first + len(self.draft)))
+
+    @property
+    def done(self):
+        """
+        Whether the job has stopped, successfully or not.
+        """
+        return self.status in (StoryJob.STATUS_DONE, StoryJob.STATUS_FAILED, StoryJob.STATUS_CANCELLED)
+
+    def start(self):
+        """
+        Run the job in a daemon thread.
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        """
+        Stop the job at its next cancellation point.
+        """
+        self.cancel_token.cancel()
+
+    def run(self):
+        """
+        Run the pipeline, recording progress on the job.
+        """
+        try:
+            self._run()
+            self.status = StoryJob.STATUS_DONE
+        except Cancelled:
+            self.status = StoryJob.STATUS_CANCELLED
+        except Exception as e:
+            logging.exception("Story job failed")
+            self.error = e
+            self.status = StoryJob.STATUS_FAILED
+
+    def _run(self):
+        if self.continued is not None:
+            return self._continue()
+        self.source = StoryRetriever(self.query, vectordb=self.vectordb).retrieve()
+        self.cancel_token.check()
+        (age, language, img_style, color, size) = self.config_args
+        config = StoryConfig(age, language, self.source, img_style, color, size, max_pages=self.max_pages)
+        story = Story(config=config)
+        if self.story_store is not None:
+            cached = self.story_store.lookup(story, [Illustration.FULL if self.illustrate else Illustration.NONE])
+            if cached is not None:
+                self.story = cached
+                return
+        self.status = StoryJob.STATUS_WRITING
+        if self.story_store is not None:
+            StoryVariants(self.story_store).build(story, cancel_token=self.cancel_token, on_segment=self._add_draft)
+        else:
+            story.build_story(cancel_token=self.cancel_token, on_segment=self._add_draft)
+        story.build_pages()
+        self.story = story
+        if self.illustrate:
+            self._illustrate(story, range(len(story.pages)))
+            story.illustration = Illustration.FULL
+        if self.story_store is not None:
+            self.story_store.save(story)
+
+    def _continue(self):
+        story = self.continued
+        self.story = story
+        self.status = StoryJob.STATUS_WRITING
+        new_pages = story.continue_story(self.max_pages, cancel_token=self.cancel_token, on_segment=self._add_draft)
+        if self.illustrate:
+            self._illustrate(story, [page.pageNo - 1 for page in new_pages])
+        else:
+            # Saved apart from the illustrated copy, which keeps its pages.
+            story.illustration = Illustration.NONE
+        if self.story_store is not None:
+            self.story_store.save(story)
+
+    def _illustrate(self, story, pages):
+        """
+        Illustrate the pages of story with the given indexes, one at a time.
+        """
+        self.status = StoryJob.STATUS_CHARACTERS
+        characters = StoryCharacters(story, config=story.config, cancel_token=self.cancel_token,
+                                     image_store=self.image_store)
+        characters.fetchCharacters()
+        characters.generateCharacterFaces()
+        self.status = StoryJob.STATUS_ILLUSTRATING
+        illustrator = StoryIllustrator(story, story.config, characters, cancel_token=self.cancel_token,
+                                       image_store=self.image_store, prompt_index=self.prompt_index)
+        for n in pages:
+            self.cancel_token.check()
+            illustrator.generateImage(n)
+            story.pages[n].content.imageURL = illustrator.store[n]
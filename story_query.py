@@ -1,8 +1,5 @@
 from langchain.prompts import PromptTemplate
-from langchain.llms import OpenAI
-from dotenv import dotenv_values
-
-API_KEY = dotenv_values(".env").get("OPENAI_API_KEY")
+from model_router import ModelRouter
 
 class StoryQuery:
     """
@@ -13,7 +10,7 @@ class StoryQuery:
 
     Attributes:
         query (str): The original query.
-        llm (OpenAI): The language model used for transformation.
+        llm (ChatOpenAI): The language model used for transformation, routed by ModelRouter.
         prompt_template (PromptTemplate): A template for generating transformation prompts.
 
     Example usage:
@@ -31,7 +28,7 @@ class StoryQuery:
         Args:
             query (str): The original query.
         """
-        self.llm = OpenAI(temperature=0.0, openai_api_key=API_KEY)
+        self.llm = ModelRouter.shared().model("story_query")
         self.prompt_template = PromptTemplate.from_template("""
             You are an AI model.
             Your goal is to take the query given to you and 
@@ -51,4 +48,4 @@ class StoryQuery:
         >>> transformed_query = story_query.transform_prompt()
         >>> print(transformed_query)
         """
-        return self.llm(self.prompt_template.format(query=self.query))
+        return ModelRouter.shared().predict("story_query", self.prompt_template.format(query=self.query))
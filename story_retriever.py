@@ -1,11 +1,38 @@
 from langchain.vectorstores import Chroma
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.retrievers.multi_query import MultiQueryRetriever
-from langchain.chains import RetrievalQA
+from langchain.chains import LLMChain, RetrievalQA
 from langchain.prompts import PromptTemplate
-from langchain.chat_models import ChatOpenAI
 from dotenv import dotenv_values
 from story_query import StoryQuery
+from episode_store import EpisodeStore
+from model_router import ModelRouter
+import json
+
+
+class CachedMultiQueryRetriever(MultiQueryRetriever):
+    """
+    MultiQueryRetriever whose query expansion is routed by the ModelRouter and
+    memoized in the LLMCache.
+    """
+
+    def generate_queries(self, question, run_manager):
+        """
+        Generate queries based upon user input, reusing a cached expansion if present
+        and escalating along the "multi_query" route if no queries were generated.
+        """
+        def expand(llm):
+            chain = LLMChain(llm=llm, prompt=self.llm_chain.prompt, output_parser=self.llm_chain.output_parser)
+            response = chain({"question": question}, callbacks=run_manager.get_child())
+            return json.dumps(getattr(response["text"], self.parser_key, []))
+
+        return json.loads(ModelRouter.shared().call(
+            "multi_query",
+            self.llm_chain.prompt.format(question=question),
+            expand,
+            validate=lambda output: bool(json.loads(output))
+        ))
+
 
 class StoryRetriever:
     """
@@ -32,29 +59,56 @@ class StoryRetriever:
 
     API_KEY = dotenv_values(".env").get("OPENAI_API_KEY")
 
-    def __init__(self, query):
+    def __init__(self, query, vectordb=None):
         """
         Initialize a StoryRetriever instance.
 
         Args:
             query (str): The original query.
+            vectordb (Chroma, optional): A vector store to reuse across queries. One is
+                opened from ./db when None.
         """
         self.query = query
+        self.vectordb = vectordb
         self.storied_query = StoryQuery(query).transform_prompt()
-        self.llm = ChatOpenAI(temperature=0.0, openai_api_key=StoryRetriever.API_KEY)
+        self.llm = ModelRouter.shared().model("multi_query")
 
-    def retrieve(self):
+    def retrieve(self, window=None):
         """
-        Retrieve the most relevant document in response to the transformed query.
+        Retrieve the episode most relevant to the transformed query.
+
+        The top hit is mapped back to the episode it was cut from and the episode is
+        served from the in-memory EpisodeStore, so the story is never built from a
+        chunk cut mid-sentence.
+
+        Args:
+            window (int, optional): Characters of the episode to keep on either side of
+                the top hit. The full episode is returned when None.
 
         Returns:
-            str: The content of the most relevant document.
+            str: The stitched content of the most relevant episode.
 
         Example usage:
 
         >>> relevant_document = retriever.retrieve()
         >>> print(relevant_document)
         """
-        vectordb = Chroma(persist_directory="./db", embedding_function=OpenAIEmbeddings(openai_api_key=StoryRetriever.API_KEY))
-        retriever_from_llm = MultiQueryRetriever.from_llm(retriever=vectordb.as_retriever(search_kwargs={'k': 1}), llm=self.llm)
-        return retriever_from_llm.get_relevant_documents(query=self.storied_query)[0].page_content
+        vectordb = self.vectordb or StoryRetriever.open_vectordb()
+        retriever_from_llm = CachedMultiQueryRetriever.from_llm(retriever=vectordb.as_retriever(search_kwargs={'k': 1}), llm=self.llm)
+        document = retriever_from_llm.get_relevant_documents(query=self.storied_query)[0]
+        source = document.metadata.get("source")
+        if source is None:
+            return document.page_content
+        return EpisodeStore.shared().stitch(
+            source, document.page_content, window=window, chunk_index=document.metadata.get("chunk_index")
+        )
+
+    @staticmethod
+    def open_vectordb():
+        """
+        Open the vector store of corpus chunks persisted in ./db.
+
+        Returns:
+            Chroma: The vector store.
+        """
+        return Chroma(persist_directory="./db", embedding_function=OpenAIEmbeddings(openai_api_key=StoryRetriever.API_KEY))
@@ -0,0 +1,220 @@
+import sqlite3
+import threading
+import time
+
+from story import Story
+from story_codec import StoryCodec
+
+STORE_PATH = "story_store.sqlite3"
+
+QUERY_FIELDS = ["text_id", "age", "language", "img_style", "color", "sz"]
+
+
+class StoryStore:
+    """
+    SQLite-backed storage for generated stories.
+
+    Stories are stored as StoryCodec payloads in a single database in WAL mode, so
+    readers are never blocked by a writer. Source texts are stored once in their own
+    table and shared by every story generated from them. Each story is stored under
+    its key, which includes its illustration state, so a text-only copy never replaces
+    an illustrated one. Stories can be looked up by key or queried by text_id and
+    config fields.
+
+    Attributes:
+        path (str): Path of the SQLite database.
+
+    Example usage:
+
+    >>> store = StoryStore()
+    >>> store.save(story_instance)
+    >>> story = store.get(story_instance.key())
+    >>> story = store.lookup(story_instance, [Illustration.FULL, Illustration.CACHED_FACES])
+    >>> stories = store.find(text_id=story_instance.config.text_id, limit=10)
+    """
+
+    def __init__(self, path=STORE_PATH):
+        """
+        Initialize a StoryStore instance, creating the database if needed.
+
+        Args:
+            path (str, optional): Path of the SQLite database.
+        """
+        self.path = path
+        self.codec = StoryCodec()
+        self.local = threading.local()
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS texts (
+                    text_id TEXT PRIMARY KEY,
+                    text TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS stories (
+                    name TEXT PRIMARY KEY,
+                    text_id TEXT NOT NULL REFERENCES texts(text_id),
+                    age TEXT,
+                    language TEXT,
+                    img_style TEXT,
+                    color TEXT,
+                    sz TEXT,
+                    created_at REAL NOT NULL,
+                    payload BLOB NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS story_texts (
+                    text_name TEXT PRIMARY KEY,
+                    text_id TEXT NOT NULL,
+                    story_text TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS stories_text_id ON stories(text_id, created_at);
+                CREATE INDEX IF NOT EXISTS stories_created_at ON stories(created_at);
+            """)
+
+    def _connection(self):
+        """
+        Return this thread's connection to the database.
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def save(self, story: Story):
+        """
+        Atomically insert or replace a story and its source text.
+
+        Args:
+            story (Story): The story to save.
+        """
+        self.save_many([story])
+
+    def save_many(self, stories):
+        """
+        Atomically insert or replace several stories in one transaction.
+
+        Args:
+            stories (iterable): The stories to save.
+        """
+        with self._connection() as connection:
+            for story in stories:
+                config = story.config.to_json()
+                connection.execute(
+                    "INSERT OR IGNORE INTO texts (text_id, text) VALUES (?, ?)",
+                    (story.config.text_id, story.config.text)
+                )
+                connection.execute(
+                    "INSERT OR REPLACE INTO stories VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (story.key(), *[_column(config[field]) for field in QUERY_FIELDS],
+                     time.time(), self.codec.encode(story, include_text=False))
+                )
+
+    def get(self, key):
+        """
+        Return the story saved under key, or None if there is none.
+
+        Args:
+            key (str): The story's key.
+        """
+        row = self._connection().execute(
+            "SELECT s.payload, t.text FROM stories s JOIN texts t USING (text_id) WHERE s.name = ?",
+            (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self.codec.decode(row[0], text=row[1])
+
+    def lookup(self, story: Story, illustrations):
+        """
+        Return the stored copy of story in the first of the given illustration states
+        that has one, or None.
+
+        Args:
+            story (Story): A story with the config to look up.
+            illustrations (list): Acceptable Illustration states, most preferred first.
+        """
+        for illustration in illustrations:
+            cached = self.get(story.key(illustration))
+            if cached is not None:
+                return cached
+        return None
+
+    def find(self, limit=50, offset=0, **fields):
+        """
+        Return stories matching the given config fields, newest first.
+
+        Args:
+            limit (int, optional): Maximum number of stories to return.
+            offset (int, optional): Number of matching stories to skip, for pagination.
+            **fields: Config fields to match, any of QUERY_FIELDS.
+
+        Returns:
+            list: The matching stories.
+
+        Raises:
+            ValueError: If a field is not one of QUERY_FIELDS.
+        """
+        unknown = set(fields) - set(QUERY_FIELDS)
+        if unknown:
+            raise ValueError(f"Cannot query stories by {sorted(unknown)}")
+        where = " AND ".join(f"s.{field} = ?" for field in fields) or "1"
+        rows = self._connection().execute(
+            f"SELECT s.payload, t.text FROM stories s JOIN texts t USING (text_id) "
+            f"WHERE {where} ORDER BY s.created_at DESC LIMIT ? OFFSET ?",
+            (*[_column(value) for value in fields.values()], limit, offset)
+        ).fetchall()
+        return [self.codec.decode(payload, text=text) for (payload, text) in rows]
+
+    def names(self, limit=50, offset=0):
+        """
+        Return the keys of stored stories, newest first.
+
+        Args:
+            limit (int, optional): Maximum number of keys to return.
+            offset (int, optional): Number of keys to skip, for pagination.
+        """
+        rows = self._connection().execute(
+            "SELECT name FROM stories ORDER BY created_at DESC LIMIT ? OFFSET ?",
+            (limit, offset)
+        ).fetchall()
+        return [name for (name,) in rows]
+
+    def get_text(self, text_name):
+        """
+        Return the generated story text saved under a Story's text_name, or None.
+
+        Args:
+            text_name (str): The story's text_name.
+        """
+        row = self._connection().execute(
+            "SELECT story_text FROM story_texts WHERE text_name = ?", (text_name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def save_text(self, story: Story):
+        """
+        Save a story's generated text under its text_name, so that stories differing
+        only in image parameters can reuse it.
+
+        Args:
+            story (Story): A story whose text has been built.
+        """
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO story_texts VALUES (?, ?, ?)",
+                (story.text_name, story.config.text_id, story.text)
+            )
+
+    def count(self):
+        """
+        Return the number of stored stories.
+        """
+        return self._connection().execute("SELECT COUNT(*) FROM stories").fetchone()[0]
+
+
+def _column(value):
+    """
+    Returns the value stored in a query column for a config option.
+    """
+    return getattr(value, "value", value)
@@ -0,0 +1,153 @@
+import logging
+
+from langchain import PromptTemplate
+
+from story import Story, stream_segments
+from story_config import StoryConfig, AgeRange, Language, PageSz, option_value
+from model_router import ModelRouter
+from cancellation import CancelToken
+from shared_state import SharedState
+
+# The canonical variant every other variant of an episode is derived from.
+BASE_AGE = AgeRange.ADULT.value
+BASE_LANGUAGE = Language.ENGLISH.value
+BASE_SIZE = PageSz.LG.value
+
+
+class StoryVariants:
+    """
+    Builds story text by deriving variants from a cached base story.
+
+    Once the canonical base story of an episode is stored, other age groups,
+    languages and page sizes are produced from it with a single rewrite call
+    instead of a full generation from the source. Until then every variant,
+    including the base, is generated from the source directly.
+    Texts are saved in the story store under Story.text_name, which leaves out image
+    style and color, so those never cause the text to be regenerated. Each text is
+    claimed in SharedState by the worker that writes it, so workers that ask for the
+    same text at once wait for the first one instead of generating it again.
+
+    Example usage:
+
+    >>> variants = StoryVariants(story_store)
+    >>> variants.build(story_instance)
+    >>> story_instance.build_pages()
+    """
+
+    def __init__(self, story_store, state=None):
+        """
+        Initialize a StoryVariants instance.
+
+        Args:
+            story_store (StoryStore): Store the base and variant texts are kept in.
+            state (SharedState, optional): Where the claims are held; the shared
+                state configured by SHARED_STATE by default.
+        """
+        self.story_store = story_store
+        self.state = state or SharedState.shared()
+
+    def base_story(self, config: StoryConfig):
+        """
+        Return a Story with the canonical base config for config's source text.
+        """
+        return Story(StoryConfig(
+            BASE_AGE, BASE_LANGUAGE, config.text, config.img_style, config.color, BASE_SIZE,
+            max_pages=config.max_pages
+        ))
+
+    def is_base(self, config: StoryConfig):
+        """
+        Whether config asks for the same text as the base story. Age groups are
+        compared loosely since callers spell them "Adult", "adult" or "adults".
+        """
+        return (_key(config.age), _key(config.language), _key(config.sz)) == \
+            (_key(BASE_AGE), _key(BASE_LANGUAGE), _key(BASE_SIZE))
+
+    def build(self, story: Story, cancel_token=None, on_segment=None):
+        """
+        Set story.text, reusing or deriving it instead of generating from scratch
+        whenever possible.
+
+        A variant is derived from the base story only when the base is already
+        stored. Otherwise it is generated from the source directly, so a cold
+        request waits for one generation rather than a base build and a rewrite.
+
+        Args:
+            story (Story): The story to build the text of.
+            cancel_token (CancelToken, optional): Token checked during generation and
+                while another worker writes the same text.
+            on_segment (callable, optional): Called with the text of each page as soon
+                as it has been streamed.
+        """
+        cancel_token = cancel_token or CancelToken()
+        name = f"story_text:{story.text_name}"
+        while True:
+            cached = self.story_store.get_text(story.text_name)
+            if cached is not None:
+                story.text = cached
+                return
+            with self.state.claim(name) as claimed:
+                if claimed:
+                    if self.story_store.get_text(story.text_name) is None:
+                        self._write(story, cancel_token, on_segment)
+                        return
+                    continue
+            self.state.wait(name, lambda: self.story_store.get_text(story.text_name), cancel_token)
+
+    def _write(self, story: Story, cancel_token, on_segment):
+        """
+        Derive or generate story.text and save it in the store.
+        """
+        base_text = None
+        if not self.is_base(story.config):
+            base_text = self.story_store.get_text(self.base_story(story.config).text_name)
+        if base_text is not None:
+            story.text = self.derive(base_text, story, cancel_token, on_segment)
+        else:
+            story.build_story(cancel_token=cancel_token, on_segment=on_segment)
+        self.story_store.save_text(story)
+
+    def derive(self, base_text, story: Story, cancel_token=None, on_segment=None):
+        """
+        Rewrite a base story for a variant's age group, language and page size.
+
+        The rewrite is streamed, so it stops after the variant's max_pages segments
+        or as soon as cancel_token is cancelled.
+
+        Args:
+            base_text (str): The text of the base story.
+            story (Story): The variant being built.
+            cancel_token (CancelToken, optional): Token checked between streamed chunks.
+            on_segment (callable, optional): Called with the text of each page as soon
+                as it has been streamed.
+
+        Returns:
+            str: The variant's text.
+
+        Raises:
+            Cancelled: If cancel_token was cancelled before the rewrite finished.
+        """
+        prompt = PromptTemplate.from_template("""
+            Rewrite the following story in {language} for {age}.
+            Keep the same segments in the same order, separated by two new lines, and do not include segment headers.
+            Make each segment {size} in size, simplifying or expanding the wording as needed,
+            and keep the dialogues of the characters.
+            {story}
+        """)
+        config = story.config
+        formatted = prompt.format(language=option_value(config.language), age=option_value(config.age),
+                                  size=option_value(config.sz), story=base_text)
+        logging.info(f"Deriving {option_value(config.age)}/{option_value(config.language)}/{option_value(config.sz)} variant from base story.")
+        return ModelRouter.shared().call(
+            "story_variant",
+            formatted,
+            lambda llm: stream_segments(llm, formatted, config.max_pages, cancel_token, on_segment),
+            cancel_token=cancel_token
+        )
+
+
+def _key(option):
+    """
+    Returns a config option normalized for comparison.
+    """
+    return str(option_value(option)).lower().rstrip("s")
@@ -0,0 +1,258 @@
+from collections import Counter, defaultdict
+import heapq
+import json
+import re
+
+from episode_store import EpisodeStore, EPISODE_NAME
+
+CHARACTER_MAP_PATH = "character_map.json"
+
+# Other names the saga uses for its characters, mapped to the name used in the corpus.
+ALIASES = {
+    "Partha": "Arjuna",
+    "Dhananjaya": "Arjuna",
+    "Vasudeva": "Krishna",
+    "Keshava": "Krishna",
+    "Radheya": "Karna",
+    "Vasusena": "Karna",
+    "Gangeya": "Bhishma",
+    "Devavrata": "Bhishma",
+    "Dharmaraja": "Yudhishthira",
+    "Suyodhana": "Duryodhana",
+    "Panchali": "Draupadi",
+    "Krishnaa": "Draupadi",
+    "Vrikodara": "Bhima",
+    "Dronacharya": "Drona",
+}
+
+# Capitalized words of the corpus that name places, peoples, weapons and ages
+# rather than characters.
+NOT_CHARACTERS = {
+    "Anga", "Brahmastra", "Dvapara", "Dwaraka", "Gandiva", "Hastinapura", "Indraprastha", "Kali",
+    "Kashi", "Kaurava", "Kauravas", "Khandava", "Kuru", "Kurukshetra", "Madra", "Mahabharata",
+    "Matsya", "Pandava", "Pandavas", "Pashupata", "Treta", "Varanavata", "Vasus", "Vedas",
+    "Yadava", "Yadavas", "Yuga",
+}
+
+# A capitalized word is taken as a name if it appears mid-sentence at least this
+# many times and is almost never written in lower case.
+MIN_NAME_MENTIONS = 3
+
+# Static weights; an episode title ranks above a character with the same match.
+KIND_WEIGHTS = {"episode": 2.0, "character": 1.0}
+
+# Characters are linked to at most this many of the episodes that mention them most.
+EPISODES_PER_CHARACTER = 5
+
+# Queries shorter than this are not matched on trigrams.
+MIN_FUZZY_LENGTH = 3
+
+
+class SuggestIndex:
+    """
+    In-memory typeahead index over episode titles and character names.
+
+    Every word of every title, name and alias is indexed by all of its prefixes, so
+    a suggestion is a few dictionary lookups rather than an LLM query transform and
+    a vector search. When too few suggestions match by prefix, trigrams of the whole
+    query fill in the rest to tolerate typos. Every suggestion carries the number
+    of the episode it leads to, and /getstory/ builds that episode directly.
+
+    Character names are the capitalized words that appear mid-sentence in the
+    stories and almost never in lower case, together with the names in
+    character_map.json, less the places, peoples and weapons in NOT_CHARACTERS.
+    A name in ALIASES is suggested once, labeled with the name it stands for.
+
+    Attributes:
+        entries (list): The suggestions, as dicts with label, kind, episode and episodes.
+
+    Example usage:
+
+    >>> index = SuggestIndex.shared()
+    >>> for suggestion in index.suggest("kar"):
+    ...     print(suggestion["label"], suggestion["episode"])
+    """
+
+    _shared = None
+
+    def __init__(self, episodes=None, character_map_path=CHARACTER_MAP_PATH):
+        """
+        Initialize a SuggestIndex instance by indexing the corpus.
+
+        Args:
+            episodes (EpisodeStore, optional): The corpus; the shared store by default.
+            character_map_path (str, optional): JSON file whose keys are character names.
+        """
+        self.episodes = episodes or EpisodeStore.shared()
+        self.entries = []
+        self.prefixes = defaultdict(list)
+        self.trigrams = defaultdict(list)
+        self._add_episodes()
+        self._add_characters(character_map_path)
+        for postings in self.prefixes.values():
+            postings.sort(key=lambda i: -self.entries[i]["weight"])
+
+    @classmethod
+    def shared(cls):
+        """
+        Return the process-wide SuggestIndex, building it on first use.
+        """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def suggest(self, query, limit=8):
+        """
+        Return the best suggestions for a partially typed query.
+
+        Every word of the query must be a prefix of a word of the suggestion. Labels
+        that start with the query rank first, then episode titles, then characters
+        mentioned in more episodes, then matches on trigrams.
+
+        Args:
+            query (str): What the user has typed so far.
+            limit (int, optional): The maximum number of suggestions.
+
+        Returns:
+            list: Dicts with the suggestion's label, kind, episode number and title,
+                and for characters the numbers of other episodes that mention them.
+        """
+        words = _words(query)
+        if not words:
+            return []
+        normalized = " ".join(words)
+        postings = sorted((self.prefixes.get(word, []) for word in words), key=len)
+        if postings[0]:
+            rest = [set(p) for p in postings[1:]]
+            candidates = [i for i in postings[0] if all(i in p for p in rest)]
+        else:
+            candidates = []
+        scored = [(self._score(i, normalized), i) for i in candidates]
+        if len(scored) < limit and len(normalized) >= MIN_FUZZY_LENGTH:
+            seen = set(candidates)
+            scored.extend((score, i) for (i, score) in self._fuzzy(normalized) if i not in seen)
+        return [self._public(self.entries[i]) for (_, i) in heapq.nlargest(limit, scored)]
+
+    def _score(self, i, normalized):
+        entry = self.entries[i]
+        score = entry["weight"]
+        if entry["key"].startswith(normalized):
+            score += 4.0
+            if entry["key"][len(normalized):][:1] in ("", " "):
+                # A whole word was typed, so "krishna" ranks Krishna above Krishnaa.
+                score += 1.0
+        return score
+
+    def _fuzzy(self, normalized):
+        """
+        Return (entry, score) pairs for entries sharing at least half of the query's
+        trigrams. Scores stay below those of any prefix match.
+        """
+        grams = _trigrams(normalized)
+        counts = Counter(i for gram in grams for i in self.trigrams.get(gram, ()))
+        return [
+            (i, count / len(grams) - 1.0)
+            for (i, count) in counts.items()
+            if count * 2 >= len(grams)
+        ]
+
+    def _add(self, label, kind, episode, episodes=(), weight=0.0, words=None):
+        """
+        Add a suggestion, indexing every prefix of words, or of the label's words.
+        """
+        i = len(self.entries)
+        key = " ".join(_words(label))
+        self.entries.append({
+            "label": label,
+            "kind": kind,
+            "episode": episode,
+            "title": self._title(episode),
+            "episodes": list(episodes),
+            "key": key,
+            "weight": KIND_WEIGHTS[kind] + weight,
+        })
+        prefixes = {word[:end] for word in words or _words(label) for end in range(1, len(word) + 1)}
+        for prefix in prefixes:
+            self.prefixes[prefix].append(i)
+        for gram in _trigrams(key):
+            self.trigrams[gram].append(i)
+
+    def _title(self, number):
+        name = self.episodes.by_number(number)
+        match = EPISODE_NAME.search(name) if name else None
+        return match.group(2) if match else None
+
+    def _add_episodes(self):
+        for name in self.episodes.order:
+            number = self.episodes.numbers[name]
+            title = self._title(number)
+            self._add(f"{number}. {title}", "episode", number, words=_words(f"{number} {title}"))
+
+    def _add_characters(self, character_map_path):
+        capitalized = Counter()
+        lower = Counter()
+        mentions = defaultdict(Counter)
+        for name in self.episodes.order:
+            body = _body(self.episodes.episodes[name])
+            number = self.episodes.numbers[name]
+            for word in re.findall(r"(?<=[a-z,;] )([A-Z][a-z]{2,})\b", body):
+                capitalized[word] += 1
+            for word in re.findall(r"\b[a-z]{3,}\b", body):
+                lower[word] += 1
+            for word in re.findall(r"\b[A-Z][a-z]{2,}\b", body):
+                mentions[word][number] += 1
+        names = {
+            word for (word, count) in capitalized.items()
+            if count >= MIN_NAME_MENTIONS and lower[word.lower()] * 10 < count
+        }
+        try:
+            with open(character_map_path, encoding="utf-8") as f:
+                names.update(key.title() for key in json.load(f) if key.title() in mentions)
+        except FileNotFoundError:
+            pass
+        names -= NOT_CHARACTERS
+        names -= {alias for (alias, name) in ALIASES.items() if name in names}
+        for name in sorted(names):
+            self._add_character(name, mentions[name])
+        for (alias, name) in ALIASES.items():
+            if name in names:
+                # An alias leads to the same episodes and ranks just below the name.
+                self._add_character(f"{alias} ({name})", mentions[name], penalty=0.001)
+
+    def _add_character(self, label, mentions, penalty=0.0):
+        ranked = [number for (number, _) in mentions.most_common(EPISODES_PER_CHARACTER)]
+        if not ranked:
+            return
+        # More widely mentioned characters rank higher, but never above an episode title.
+        weight = min(len(mentions), 100) / 101 - penalty
+        self._add(label, "character", ranked[0], ranked[1:], weight)
+
+    def _public(self, entry):
+        return {key: entry[key] for key in ("label", "kind", "episode", "title", "episodes")}
+
+
+def _words(text):
+    """
+    Returns the lower-cased words of text.
+    """
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def _trigrams(text):
+    """
+    Returns the set of character trigrams of text, padded at the ends.
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _body(text):
+    """
+    Returns an episode's story without its byline, credits and notes.
+
+    The credits start at "Inspired by:", which is often run on to the story's last
+    sentence without a line break.
+    """
+    text = text.strip()
+    text = text.split("\n", 1)[1] if "\n" in text else text
+    return text.split("Inspired by:", 1)[0]
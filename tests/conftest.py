@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root and read files such as character_map.json
+# relative to the working directory.
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(tmp_path, monkeypatch):
+    """
+    Give every test its own shared state and an in-memory LLM cache, so that no test
+    reads or writes the caches of a real deployment or of another test.
+    """
+    from llm_cache import LLMCache
+    from model_router import ModelRouter
+    from shared_state import SharedState, SQLiteState
+    from story import Story
+
+    state = SQLiteState(str(tmp_path / "shared_state.sqlite3"))
+    monkeypatch.setattr(SharedState, "_shared", state)
+    monkeypatch.setattr(LLMCache, "_shared", LLMCache(path=None, state=state))
+    monkeypatch.setattr(ModelRouter, "_shared", None)
+    monkeypatch.setattr(Story, "_llm", None)
+    return state
+
+
+@pytest.fixture
+def fake_models(monkeypatch):
+    """
+    Route every call site to FakeListChatModel instances answering with the given
+    responses in turn. Returns a function taking the responses.
+    """
+    from langchain.chat_models import FakeListChatModel
+    from model_router import ModelRouter
+
+    def install(responses):
+        router = ModelRouter(factory=lambda name: FakeListChatModel(responses=list(responses)))
+        monkeypatch.setattr(ModelRouter, "_shared", router)
+        return router
+
+    return install
@@ -0,0 +1,122 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import Response
+from fastapi.testclient import TestClient
+
+import main
+from admission import AdmissionController, ClientQuota, Overloaded, Service
+from episode_store import EpisodeStore
+from page import Page
+from page_content import PageContent
+from story import Story, Illustration
+from story_config import StoryConfig
+from story_store import StoryStore
+
+TEXT = "Bhishma took his vow on the banks of the Ganga."
+
+
+def story(illustration):
+    story = Story(StoryConfig("Adult", "English", TEXT, "COMIC", "Color", "small"))
+    url = None if illustration == Illustration.NONE else "/assets/page.png"
+    story.pages = [Page(PageContent("Bhishma vowed.", url), pageNo=1)]
+    story.text = "Bhishma vowed."
+    story.illustration = illustration
+    return story
+
+
+def test_text_only_story_never_replaces_an_illustrated_one(tmp_path):
+    store = StoryStore(str(tmp_path / "stories.sqlite3"))
+    store.save(story(Illustration.FULL))
+    store.save(story(Illustration.NONE))
+
+    full = store.lookup(story(Illustration.FULL), main.accepted_illustrations(True, Service.FULL))
+    assert full.illustration == Illustration.FULL
+    assert full.pages[0].content.imageURL == "/assets/page.png"
+    text = store.lookup(story(Illustration.NONE), main.accepted_illustrations(False, Service.FULL))
+    assert text.illustration == Illustration.NONE
+    assert text.pages[0].content.imageURL is None
+
+
+def test_illustrated_requests_get_degraded_copies_only_when_degraded(tmp_path):
+    store = StoryStore(str(tmp_path / "stories.sqlite3"))
+    store.save(story(Illustration.NONE))
+    store.save(story(Illustration.CACHED_FACES))
+    wanted = story(Illustration.NONE)
+
+    assert store.lookup(wanted, main.accepted_illustrations(True, Service.FULL)) is None
+    assert store.lookup(wanted, main.accepted_illustrations(True, Service.CACHED_FACES)).illustration == Illustration.CACHED_FACES
+    assert store.lookup(wanted, main.accepted_illustrations(True, Service.TEXT_ONLY)).illustration == Illustration.CACHED_FACES
+
+
+def test_illustration_state_survives_json_round_trip():
+    assert Story.from_json(story(Illustration.CACHED_FACES).to_json()).illustration == Illustration.CACHED_FACES
+    legacy = story(Illustration.FULL).to_json()
+    del legacy["illustration"]
+    assert Story.from_json(legacy).illustration == Illustration.FULL
+
+
+def test_client_quota_is_off_unless_configured(monkeypatch):
+    monkeypatch.delenv("ADMISSION_CLIENT_PER_MINUTE", raising=False)
+    quota = AdmissionController().quota
+    for _ in range(100):
+        quota.take("client")
+
+    quota = ClientQuota(per_minute=6, burst=3)
+    for _ in range(3):
+        quota.take("client")
+    with pytest.raises(Overloaded) as raised:
+        quota.take("client")
+    assert raised.value.status_code == 429
+
+
+def test_stored_illustrated_story_is_served_at_full_service(tmp_path, monkeypatch):
+    store = StoryStore(str(tmp_path / "stories.sqlite3"))
+    monkeypatch.setattr(main, "story_store", store)
+    monkeypatch.setattr(main, "prefetcher", None)
+    monkeypatch.setattr(main.admission, "service", lambda: Service.FULL)
+    monkeypatch.setattr(main, "illustrate", lambda *args, **kwargs: pytest.fail("illustrated again"))
+    monkeypatch.setattr(main.StoryVariants, "build", lambda *args, **kwargs: pytest.fail("written again"))
+    episodes = EpisodeStore.shared()
+    stored = Story(StoryConfig("adult", "english", episodes.episodes[episodes.by_number(1)], "COMIC", "Color"))
+    stored.pages = [Page(PageContent("Bhishma vowed.", "/assets/page.png"), pageNo=1)]
+    stored.text = "Bhishma vowed."
+    stored.illustration = Illustration.FULL
+    store.save(stored)
+
+    body = TestClient(main.app).post("/getstory/", json={
+        "query": "", "age": "adult", "language": "english", "imageGenStyle": "Comic", "color": "Color",
+        "episode": 1, "illustrate": True,
+    }).json()
+    assert body["name"] == stored.key()
+    assert body["pages"][0]["content"]["imageURL"] == "/assets/page.png"
+
+
+def test_request_slot_is_released_when_the_pipeline_never_starts(monkeypatch):
+    async def cancelled_before_start(*args):
+        raise asyncio.CancelledError()
+
+    monkeypatch.setattr(main, "run_in_threadpool", cancelled_before_start)
+    stage = main.admission.stages["request"]
+    pending = stage.pending
+    request = SimpleNamespace(client=None, is_disconnected=lambda: asyncio.sleep(0, False))
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(main.run_pipeline(main.build_story, None, request, Response()))
+    assert stage.pending == pending
+
+
+def test_cancelled_slot_cannot_be_entered_and_entered_slot_is_released_once():
+    stage = AdmissionController().stages["request"]
+    slot = stage.admit()
+    slot.cancel()
+    slot.cancel()
+    assert stage.pending == 0
+    with pytest.raises(main.Cancelled):
+        with slot:
+            pass
+
+    slot = stage.admit()
+    with slot:
+        slot.cancel()
+    assert stage.pending == 0
@@ -0,0 +1,34 @@
+import threading
+
+from atomic_file import write_atomic
+
+
+def test_concurrent_writers_of_one_file_do_not_collide(tmp_path):
+    directory = tmp_path / "digest"
+    directory.mkdir()
+    path = directory / "original"
+    payloads = [bytes([n]) * 100000 for n in range(8)]
+    barrier = threading.Barrier(len(payloads))
+    errors = []
+
+    def writer(data):
+        barrier.wait()
+        try:
+            for _ in range(20):
+                write_atomic(path, data)
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(data,)) for data in payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert path.read_bytes() in payloads
+    assert [p.name for p in directory.iterdir()] == ["original"]
+
+
+def test_text_is_written_as_utf8(tmp_path):
+    write_atomic(str(tmp_path / "story.txt"), "Kuntī")
+    assert (tmp_path / "story.txt").read_text(encoding="utf-8") == "Kuntī"
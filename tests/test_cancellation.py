@@ -0,0 +1,111 @@
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema.messages import AIMessage, AIMessageChunk
+from langchain.schema.output import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import main
+from cancellation import CancelToken
+from model_router import ModelRouter
+from story_store import StoryStore
+
+CHUNKS = 200
+
+
+class SlowStreamingModel(BaseChatModel):
+    """
+    Streams a long story one short chunk at a time, recording how far it got.
+    """
+
+    started: threading.Event = None
+    streamed: int = 0
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self):
+        return "slow-streaming"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Once upon a time."))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        for i in range(CHUNKS):
+            self.started.set()
+            self.streamed += 1
+            time.sleep(0.01)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=f"word{i} "))
+
+
+class RecordingToken(CancelToken):
+    tokens = []
+
+    def __init__(self):
+        super().__init__()
+        RecordingToken.tokens.append(self)
+
+
+async def call_until_disconnect(app, body, started):
+    """
+    Send a request to the ASGI app and disconnect once the model starts streaming.
+    Returns the response status.
+    """
+    disconnected = asyncio.Event()
+    sent = []
+    payload = json.dumps(body).encode()
+
+    async def receive():
+        if not sent:
+            sent.append(True)
+            return {"type": "http.request", "body": payload, "more_body": False}
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def disconnect_when_streaming():
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        disconnected.set()
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/getstory/", "raw_path": b"/getstory/", "query_string": b"",
+        "root_path": "", "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+    }
+    await asyncio.gather(app(scope, receive, send), disconnect_when_streaming())
+    return next(m["status"] for m in messages if m["type"] == "http.response.start")
+
+
+def test_disconnect_mid_stream_stops_generation_without_saving(tmp_path, monkeypatch):
+    store = StoryStore(str(tmp_path / "stories.sqlite3"))
+    monkeypatch.setattr(main, "story_store", store)
+    monkeypatch.setattr(main, "prefetcher", None)
+    monkeypatch.setattr(main.admission.quota, "take", lambda client: None)
+    monkeypatch.setattr(main, "CancelToken", RecordingToken)
+    RecordingToken.tokens = []
+    model = SlowStreamingModel(started=threading.Event())
+    monkeypatch.setattr(ModelRouter, "_shared", ModelRouter(factory=lambda name: model))
+
+    body = {"query": "", "age": "adult", "language": "english", "imageGenStyle": "Comic",
+            "color": "Color", "episode": 1}
+    status = asyncio.run(call_until_disconnect(main.app, body, model.started))
+
+    assert status == main.CLIENT_CLOSED_REQUEST
+    assert len(RecordingToken.tokens) == 1 and RecordingToken.tokens[0].cancelled
+    # The stream was closed early instead of running to the end.
+    time.sleep(0.2)
+    assert 0 < model.streamed < CHUNKS
+    assert store.count() == 0
+    assert store._connection().execute("SELECT COUNT(*) FROM story_texts").fetchone()[0] == 0
+    assert main.admission.stages["request"].pending == 0
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from character_parser import CharacterParser
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "characters")
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name, valid, invalid", [
+    ("prose_wrapped.txt", ["karna"], []),
+    ("code_fence.txt", ["Kunti"], []),
+    ("truncated_entry.txt", ["karna"], ["kunti"]),
+    ("braces_in_prose.txt", ["arjuna"], []),
+    ("schema_drift.txt", ["Drona"], ["Bhima"]),
+    ("trailing_comma_cut.txt", ["Bhishma"], ["Shikhandi"]),
+    ("no_json.txt", [], []),
+])
+def test_parse_malformed_outputs(name, valid, invalid):
+    (parsed_valid, parsed_invalid) = CharacterParser().parse(fixture(name))
+    assert sorted(parsed_valid) == valid
+    assert sorted(parsed_invalid) == invalid
+
+
+def test_truncated_entry_keeps_complete_keys():
+    (valid, invalid) = CharacterParser().parse('Sure! {"karna": {"name": "Karna", "age": "30"')
+    assert valid == {}
+    assert invalid == {"karna": {"name": "Karna", "age": "30"}}
+
+
+def test_truncated_string_value_is_dropped():
+    (_, invalid) = CharacterParser().parse(fixture("truncated_entry.txt"))
+    assert invalid["kunti"] == {"name": "Kunti"}
+
+
+def test_valid_entries_are_stringified():
+    (valid, _) = CharacterParser().parse(fixture("schema_drift.txt"))
+    assert valid["Drona"]["age"] == "60"
+
+
+def test_loads_skips_braces_that_are_not_json():
+    assert CharacterParser().loads("{hero} and [1] then {\"a\": {\"name\": \"A\"}}") == {"a": {"name": "A"}}
+
+
+def test_loads_returns_none_without_json():
+    assert CharacterParser().loads("no characters here") is None
+    assert CharacterParser().loads("") is None
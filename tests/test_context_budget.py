@@ -0,0 +1,86 @@
+import json
+
+import pytest
+
+from context_budget import CharacterMatcher, ContextBudget, DESCRIPTION_BUDGET
+
+CHARACTERS = {
+    "karna": {"name": "Karna", "description": "tall, golden armour"},
+    "kunti": {"name": "Kunti", "description": "graceful, sorrowful eyes"},
+    "surya": {"name": "Surya Deva", "description": "radiant, fiery crown"},
+    "drona": {"name": "Dronacharya", "description": "old, white beard"},
+}
+
+
+@pytest.fixture
+def estimated():
+    """
+    A budget that estimates four characters per token, as without tiktoken.
+    """
+    budget = ContextBudget(100)
+    budget.encoding = None
+    return budget
+
+
+def test_matcher_finds_keys_and_names_in_order_of_first_mention():
+    matcher = CharacterMatcher(CHARACTERS)
+    text = "KUNTI prayed to surya deva, and the sun god Surya Deva gave her Karna. Kunti wept."
+    assert matcher.mentioned(text) == ["kunti", "surya", "karna"]
+    # A name matches as a whole word, under its key or its name.
+    assert matcher.mentioned("Dronacharya taught; drona smiled.") == ["drona"]
+    assert matcher.mentioned("Karnas and Dronas") == []
+    assert CharacterMatcher({}).mentioned("Karna") == []
+
+
+def test_matcher_prefers_the_longest_name():
+    matcher = CharacterMatcher({"surya": {"name": "Surya"}, "suryaputra": {"name": "Surya Putra"}})
+    assert matcher.mentioned("Surya Putra bowed to Surya.") == ["suryaputra", "surya"]
+
+
+def test_compact_characters_keeps_mentioned_characters_in_order_of_mention(estimated):
+    compact = json.loads(estimated.compact_characters(CHARACTERS, "Drona tested Karna, then Kunti."))
+    assert list(compact) == ["drona", "karna", "kunti"]
+    assert compact["karna"] == CHARACTERS["karna"]
+
+
+def test_compact_characters_drops_the_last_mentioned_until_it_fits(estimated):
+    text = "Drona tested Karna, then Kunti."
+    entry = len(json.dumps({"drona": CHARACTERS["drona"]}))
+    estimated.max_tokens = (entry * 2 + 2) // 4 + 1
+    assert list(json.loads(estimated.compact_characters(CHARACTERS, text))) == ["drona", "karna"]
+    estimated.max_tokens = 0
+    assert estimated.compact_characters(CHARACTERS, text) == "{}"
+
+
+def test_compact_characters_truncates_descriptions(estimated):
+    characters = {"karna": {"name": "Karna", "description": "golden " * 100}}
+    compact = json.loads(estimated.compact_characters(characters, "Karna"))
+    assert compact["karna"]["description"] == ("golden " * 100)[:DESCRIPTION_BUDGET * 4]
+
+
+def test_truncate_estimates_four_characters_per_token(estimated):
+    assert estimated.count("x" * 40) == 11
+    assert estimated.truncate("x" * 40, 10) == "x" * 40
+    assert estimated.truncate("x" * 41, 10) == "x" * 40
+
+
+class WordEncoding:
+    """
+    A tokenizer with one token per space-separated word.
+    """
+
+    def encode(self, text):
+        return text.split(" ")
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+def test_truncate_cuts_at_the_token_limit():
+    budget = ContextBudget(0)
+    budget.encoding = WordEncoding()
+    text = "Karna gave away his golden armour to Indra."
+    assert budget.count(text) == 8
+    assert budget.truncate(text, 8) == text
+    assert budget.truncate(text, 9) == text
+    assert budget.truncate(text, 3) == "Karna gave away..."
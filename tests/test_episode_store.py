@@ -0,0 +1,62 @@
+import sqlite3
+
+import pytest
+
+from episode_store import EpisodeStore
+
+DB_PATH = "db/chroma.sqlite3"
+
+
+@pytest.fixture(scope="module")
+def store():
+    return EpisodeStore()
+
+
+def stored_chunks():
+    """
+    Yield (source, chunk) for every chunk in the committed vector store, read
+    straight from its SQLite file so that the test needs no embeddings.
+    """
+    connection = sqlite3.connect(f"file:{DB_PATH}?mode=ro", uri=True)
+    rows = connection.execute("""
+        SELECT source.string_value, document.string_value
+        FROM embedding_metadata AS source
+        JOIN embedding_metadata AS document ON document.id = source.id
+        WHERE source.key = 'source' AND document.key = 'chroma:document'
+    """).fetchall()
+    connection.close()
+    return rows
+
+
+def test_every_stored_chunk_returns_its_complete_episode(store):
+    chunks = stored_chunks()
+    assert len(chunks) == 144
+    for (source, chunk) in chunks:
+        episode = store.stitch(source, chunk)
+        assert episode == store.episode(source)
+        assert chunk.strip() in episode
+
+
+def test_every_chunk_of_the_corpus_returns_its_complete_episode(store):
+    for name in store.order:
+        source = f"corpus/Mahabharata/{name}"
+        for (i, (start, end)) in enumerate(store.chunk_spans(name)):
+            chunk = store.episodes[name][start:end]
+            assert store.stitch(source, chunk, chunk_index=i) == store.episodes[name]
+
+
+def test_window_is_sentence_aligned_around_the_indexed_chunk(store):
+    name = max(store.order, key=lambda name: len(store.chunk_spans(name)))
+    text = store.episodes[name]
+    spans = store.chunk_spans(name)
+    assert len(spans) > 1
+    (start, end) = spans[1]
+    stitched = store.stitch(f"corpus/Mahabharata/{name}", "not in the episode", window=50, chunk_index=1)
+    assert text[start:end].strip() in stitched
+    assert len(stitched) < len(text)
+    begin = text.index(stitched)
+    assert begin == 0 or text[begin - 1] in " \n"
+
+
+def test_unknown_episode_returns_the_chunk(store):
+    assert store.stitch("corpus/Mahabharata/missing.txt", "a chunk") == "a chunk"
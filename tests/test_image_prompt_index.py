@@ -0,0 +1,66 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from image_prompt_index import ImagePromptIndex, HashingEmbeddings, REUSE_THRESHOLDS
+
+PROMPT = "Krishna addressing the Pandavas at court, comic, color ::3 --seed 100"
+
+
+def index(tmp_path, **kwargs):
+    return ImagePromptIndex(path=str(tmp_path / "prompts.sqlite3"), embeddings=HashingEmbeddings(), **kwargs)
+
+
+def test_threshold_defaults_to_the_embedders_calibration(tmp_path, monkeypatch):
+    monkeypatch.setattr("image_prompt_index.REUSE_THRESHOLD", None)
+    assert index(tmp_path).threshold == REUSE_THRESHOLDS["HashingEmbeddings"]
+    monkeypatch.setattr("image_prompt_index.REUSE_THRESHOLD", "0.8")
+    assert index(tmp_path).threshold == 0.8
+    assert index(tmp_path, threshold=0.5).threshold == 0.5
+
+
+class UncalibratedEmbeddings(HashingEmbeddings):
+    pass
+
+
+def test_default_embedder_is_the_calibrated_local_one():
+    env = {key: value for (key, value) in os.environ.items() if key not in ("IMAGE_PROMPT_EMBEDDER", "IMAGE_REUSE_THRESHOLD")}
+    code = (
+        "import image_prompt_index as i; e = i._default_embeddings(); "
+        "print(type(e).__name__, i.REUSE_THRESHOLDS[type(e).__name__])"
+    )
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, env=env)
+    assert result.stdout.strip() == "HashingEmbeddings 0.97"
+
+
+def test_uncalibrated_embedder_never_reuses_images(tmp_path, monkeypatch):
+    monkeypatch.setattr("image_prompt_index.REUSE_THRESHOLD", None)
+    prompts = ImagePromptIndex(path=str(tmp_path / "prompts.sqlite3"), embeddings=UncalibratedEmbeddings())
+    assert prompts.threshold is None
+    prompts.add(PROMPT, "COMIC", "Color", "/assets/court")
+    assert prompts.match(PROMPT, "COMIC", "Color") is None
+    assert prompts.stats == {"reused": 0, "rendered": 1}
+
+
+def test_add_appends_to_a_loaded_scope_without_reloading(tmp_path, monkeypatch):
+    prompts = index(tmp_path)
+    assert prompts.match(PROMPT, "COMIC", "Color") is None
+    scope = prompts.scopes[("COMIC", "Color")]
+
+    for n in range(40):
+        prompts.add(f"Scene number {n} of the war, comic, color", "COMIC", "Color", f"/assets/{n}")
+    prompts.add(PROMPT, "COMIC", "Color", "/assets/court")
+    prompts.add(PROMPT, "COMIC", "Color", "/assets/court-2")
+    assert prompts.scopes[("COMIC", "Color")] is scope
+    assert len(scope.prompts) == scope.matrix().shape[0] == 41
+    assert prompts.match(PROMPT.replace("::3 --seed 100", "::3 --seed 7"), "COMIC", "Color") == "/assets/court-2"
+
+    # A fresh index loading the scope from disk sees the same entries.
+    reloaded = index(tmp_path)
+    reloaded.match(PROMPT, "COMIC", "Color")
+    entries = reloaded.scopes[("COMIC", "Color")]
+    assert dict(zip(entries.prompts, entries.urls)) == dict(zip(scope.prompts, scope.urls))
+    for (row, prompt) in enumerate(entries.prompts):
+        assert np.allclose(entries.matrix()[row], scope.matrix()[scope.prompts.index(prompt)])
@@ -0,0 +1,72 @@
+import io
+
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+from image_store import ImageStore
+
+
+def png(width=600, height=400):
+    image = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 80, 40)).save(image, format="PNG")
+    return image.getvalue()
+
+
+@pytest.fixture
+def image_store(tmp_path, monkeypatch):
+    store = ImageStore(root=tmp_path / "assets")
+    monkeypatch.setattr(ImageStore, "_shared", store)
+    return store
+
+
+@pytest.fixture
+def app():
+    import main
+
+    return TestClient(main.app)
+
+
+def test_generated_variants_are_immutable_and_revalidated_by_etag(app, image_store):
+    digest = image_store.put(png())
+    # Wait for the variants.
+    image_store.pool.shutdown(wait=True)
+
+    response = app.get(f"/assets/{digest}/thumb.webp")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "image/webp"
+    assert response.headers["cache-control"] == "public, max-age=31536000, immutable"
+    etag = response.headers["etag"]
+    assert etag == f'"{digest}-thumb.webp"'
+    with Image.open(io.BytesIO(response.content)) as thumb:
+        assert thumb.width == 256
+
+    revalidated = app.get(f"/assets/{digest}/thumb.webp", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.content == b""
+    assert revalidated.headers["etag"] == etag
+    assert app.get(f"/assets/{digest}/thumb.webp", headers={"If-None-Match": '"other"'}).status_code == 200
+
+
+def test_a_variant_not_generated_yet_falls_back_to_the_original_briefly(app, image_store, monkeypatch):
+    monkeypatch.setattr(ImageStore, "_make_variants", lambda self, digest: None)
+    data = png()
+    digest = image_store.put(data)
+
+    response = app.get(f"/assets/{digest}/page.jpeg")
+    assert response.status_code == 200
+    assert response.content == data
+    assert response.headers["content-type"] == "image/png"
+    assert response.headers["cache-control"] == "public, max-age=60"
+    # The ETag names the file served, so the variant is fetched once it exists.
+    assert response.headers["etag"] == f'"{digest}-original"'
+
+    original = app.get(f"/assets/{digest}/original")
+    assert original.headers["cache-control"] == "public, max-age=31536000, immutable"
+
+
+def test_unknown_assets_are_not_found(app, image_store):
+    digest = image_store.put(png())
+    assert app.get(f"/assets/{'0' * 64}/original").status_code == 404
+    assert app.get(f"/assets/{digest}/huge.webp").status_code == 404
+    assert app.get("/assets/not-a-digest/original").status_code == 404
@@ -0,0 +1,102 @@
+from types import SimpleNamespace
+
+import pytest
+from langchain.chat_models import FakeListChatModel
+
+import llm_cache
+from llm_cache import LLMCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Control the time LLMCache sees.
+    """
+    now = [1_000_000.0]
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def cache_at(tmp_path, isolated_state, **kwargs):
+    return LLMCache(path=str(tmp_path / "llm_cache.sqlite3"), state=isolated_state, **kwargs)
+
+
+def rows(cache):
+    return [key for (key,) in cache.connection.execute("SELECT key FROM responses ORDER BY created_at")]
+
+
+def test_responses_are_keyed_by_model_parameters_and_prompt(isolated_state):
+    cache = LLMCache(path=None, state=isolated_state)
+    llm = FakeListChatModel(responses=["first", "second", "third"])
+    assert cache.predict(llm, "Tell me about Karna.", "build_story") == "first"
+    assert cache.predict(llm, "Tell me about Karna.", "build_story") == "first"
+    assert cache.predict(llm, "Tell me about Kunti.", "build_story") == "second"
+    other = FakeListChatModel(responses=["other"])
+    assert cache.key(other, "Tell me about Karna.") != cache.key(llm, "Tell me about Karna.")
+
+
+def test_memory_tier_evicts_the_least_recently_used_entry(isolated_state):
+    cache = LLMCache(path=None, max_entries=2, state=isolated_state)
+    cache.set("a", "site", "A")
+    cache.set("b", "site", "B")
+    assert cache.get("a") == "A"
+    cache.set("c", "site", "C")
+    assert list(cache.memory) == ["a", "c"]
+    assert cache.get("b") is None
+
+
+def test_disk_tier_serves_what_memory_evicted(tmp_path, isolated_state):
+    cache = cache_at(tmp_path, isolated_state, max_entries=1)
+    cache.set("a", "site", "A")
+    cache.set("b", "site", "B")
+    assert "a" not in cache.memory
+    assert cache.get("a") == "A"
+    # Another worker, or a restart, reads the same tier.
+    assert cache_at(tmp_path, isolated_state).get("b") == "B"
+
+
+def test_stale_responses_are_never_served(tmp_path, isolated_state, clock):
+    cache = cache_at(tmp_path, isolated_state, max_age=60)
+    cache.set("a", "site", "A")
+    clock[0] += 60
+    assert cache.get("a") == "A"
+    clock[0] += 1
+    assert cache.get("a") is None
+    assert "a" not in cache.memory
+    assert cache_at(tmp_path, isolated_state, max_age=60).get("a") is None
+
+
+def test_pruning_deletes_stale_rows_and_keeps_the_newest_max_rows(tmp_path, isolated_state, clock):
+    cache = cache_at(tmp_path, isolated_state, max_rows=50, max_age=3600)
+    cache.set("stale", "site", "old")
+    clock[0] += 3601
+    for i in range(98):
+        cache.set(f"k{i}", "site", str(i))
+        clock[0] += 1
+    # Pruning runs every 100 writes.
+    assert len(rows(cache)) == 99
+    cache.set("k98", "site", "98")
+    assert rows(cache) == [f"k{i}" for i in range(49, 99)]
+
+
+def test_bypassed_sites_always_call_the_model(monkeypatch, isolated_state):
+    monkeypatch.setattr(llm_cache, "BYPASS_SITES", " characters, illustration_prompt ")
+    cache = LLMCache(path=None, state=isolated_state)
+    assert cache.bypass == {"characters", "illustration_prompt"}
+    llm = FakeListChatModel(responses=["first", "second"])
+    assert cache.predict(llm, "Describe Karna.", "characters") == "first"
+    assert cache.predict(llm, "Describe Karna.", "characters") == "second"
+    assert "characters" not in cache.stats
+    assert cache.get(cache.key(llm, "Describe Karna.")) is None
+
+
+def test_stats_count_hits_and_misses_per_site(isolated_state):
+    cache = LLMCache(path=None, state=isolated_state)
+    llm = FakeListChatModel(responses=["story", "query", "story again"])
+    for _ in range(3):
+        cache.predict(llm, "Tell me about Karna.", "build_story")
+    cache.predict(llm, "karna", "story_query")
+    assert cache.stats == {
+        "build_story": {"hits": 2, "misses": 1},
+        "story_query": {"hits": 0, "misses": 1},
+    }
@@ -0,0 +1,46 @@
+import json
+
+from image_store import ImageStore, ASSET_PREFIX
+from migrate_story_jsons import migrate
+from story import Illustration
+from story_store import StoryStore
+
+REMOTE = "https://cdn.midjourney.com/example/0_0.png"
+
+
+class FakeResponse:
+    content = b"image bytes"
+
+    def raise_for_status(self):
+        pass
+
+
+def legacy_story(directory):
+    path = directory / "legacy.json"
+    path.write_text(json.dumps({
+        "config": {"age": "Adult", "language": "English", "text": "Arjuna drew his bow.",
+                   "img_style": "COMIC", "color": "Color", "sz": "small"},
+        "pages": [{"content": {"text": "Arjuna drew his bow.", "imageURL": REMOTE}, "pageNo": 1}],
+    }))
+
+
+def test_migrate_localizes_page_images(tmp_path, monkeypatch):
+    (tmp_path / "jsons").mkdir()
+    legacy_story(tmp_path / "jsons")
+    image_store = ImageStore(root=tmp_path / "assets")
+    monkeypatch.setattr(image_store.session, "get", lambda url, timeout: FakeResponse())
+    store = StoryStore(str(tmp_path / "stories.sqlite3"))
+
+    assert migrate(tmp_path / "jsons", store, image_store=image_store) == (1, 0)
+    (story,) = store.find()
+    assert story.illustration == Illustration.FULL
+    assert story.pages[0].content.imageURL.startswith(ASSET_PREFIX)
+
+
+def test_migrate_keeps_remote_urls_by_default(tmp_path):
+    (tmp_path / "jsons").mkdir()
+    legacy_story(tmp_path / "jsons")
+    store = StoryStore(str(tmp_path / "stories.sqlite3"))
+
+    migrate(tmp_path / "jsons", store)
+    assert store.find()[0].pages[0].content.imageURL == REMOTE
@@ -0,0 +1,106 @@
+import subprocess
+import sys
+import time
+
+from langchain.chat_models import FakeListChatModel
+
+from context_budget import ContextBudget
+from model_router import ModelRouter, SMALL_MODEL, LARGE_MODEL
+
+
+class SleepyModel(FakeListChatModel):
+    """
+    A FakeListChatModel that takes the given number of seconds per call.
+    """
+
+    seconds: float = 0.0
+
+    def _call(self, *args, **kwargs):
+        time.sleep(self.seconds)
+        return super()._call(*args, **kwargs)
+
+
+def router(responses, routes=None):
+    """
+    A router whose models answer with responses[name] in turn.
+    """
+    return ModelRouter(routes=routes, factory=lambda name: FakeListChatModel(responses=list(responses[name])))
+
+
+def test_sites_share_one_model_per_name():
+    models = router({SMALL_MODEL: ["small"], LARGE_MODEL: ["large"]}, routes={"story_query": [LARGE_MODEL]})
+    assert models.model("story_query") is models.model("characters", tier=1)
+    assert models.model("multi_query") is models.model("characters")
+    assert models.route("no_such_site") == [SMALL_MODEL]
+    assert models.predict("story_query", "Rewrite the query.") == "large"
+
+
+def test_invalid_output_escalates_to_the_next_model():
+    models = router({SMALL_MODEL: ["not json"], LARGE_MODEL: ['{"karna": {}}']})
+    output = models.call("characters", "Find the characters.", lambda llm: llm.predict("Find the characters."),
+                         validate=lambda text: text.startswith("{"))
+    assert output == '{"karna": {}}'
+    assert models.stats[("characters", SMALL_MODEL)]["escalations"] == 1
+    assert models.stats[("characters", LARGE_MODEL)]["calls"] == 1
+
+
+def test_last_model_output_is_returned_when_none_is_valid():
+    models = router({SMALL_MODEL: ["bad"], LARGE_MODEL: ["worse"]})
+    assert models.call("characters", "Find them.", lambda llm: llm.predict("Find them."),
+                       validate=lambda text: False) == "worse"
+
+
+def test_repeated_calls_are_served_from_the_cache():
+    models = router({SMALL_MODEL: ["first", "second"]})
+    assert models.predict("story_query", "Same prompt.") == "first"
+    assert models.predict("story_query", "Same prompt.") == "first"
+    stats = models.stats[("story_query", SMALL_MODEL)]
+    assert stats["calls"] == 2 and stats["cache_hits"] == 1
+
+
+def test_report_accounts_escalations_latency_and_cache_hits():
+    # A fast small model that fails validation, and a slow large one that passes.
+    responses = {SMALL_MODEL: ["not json"], LARGE_MODEL: ['{"karna": {}}']}
+    seconds = {SMALL_MODEL: 0.01, LARGE_MODEL: 0.1}
+    models = ModelRouter(factory=lambda name: SleepyModel(responses=responses[name], seconds=seconds[name]))
+    for _ in range(2):
+        output = models.call("characters", "Find the characters.", lambda llm: llm.predict("Find the characters."),
+                             validate=lambda text: text.startswith("{"))
+        assert output == '{"karna": {}}'
+
+    report = models.report()
+    small = report[f"characters/{SMALL_MODEL}"]
+    large = report[f"characters/{LARGE_MODEL}"]
+    # The second call is served from the cache by both models, and escalates again.
+    assert (small["calls"], small["cache_hits"], small["escalations"]) == (2, 1, 2)
+    assert (large["calls"], large["cache_hits"]) == (2, 1)
+    assert "escalations" not in large
+    # Latency is averaged over the calls that reached a model.
+    assert 0.01 <= small["mean_seconds"] < 0.1 <= large["mean_seconds"]
+    assert large["seconds"] == large["mean_seconds"]
+    assert large["prompt_tokens"] == small["prompt_tokens"] == ContextBudget(0).count("Find the characters.")
+    assert large["dollars"] > small["dollars"] > 0
+
+
+def test_report_of_cache_hits_only_has_no_latency():
+    models = router({SMALL_MODEL: ["first"]})
+    models.predict("story_query", "Same prompt.")
+    models.stats.clear()
+    models.predict("story_query", "Same prompt.")
+    assert models.report() == {f"story_query/{SMALL_MODEL}": {"calls": 1, "cache_hits": 1, "mean_seconds": 0.0}}
+
+
+def test_fit_story_summarizes_through_the_given_router():
+    models = router({SMALL_MODEL: ["Karna fought Arjuna."]})
+    budget = ContextBudget(40)
+    assert budget.fit_story("A short story.", models) == "A short story."
+    assert not models.stats
+
+    long_story = "\n\n".join(f"Paragraph {n} about Karna and Arjuna at Kurukshetra." for n in range(30))
+    assert budget.fit_story(long_story, models) == "Karna fought Arjuna."
+    assert models.stats[("story_summary", SMALL_MODEL)]["calls"] > 1
+
+
+def test_context_budget_does_not_import_the_router():
+    code = "import sys, context_budget; print('model_router' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code], capture_output=True, text=True).stdout.strip() == "False"
@@ -0,0 +1,104 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from episode_store import EpisodeStore
+from prefetcher import Prefetcher
+from shared_state import SQLiteState
+from story import Story, Illustration
+from story_config import StoryConfig
+from story_store import StoryStore
+
+EPISODE = 1
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = StoryStore(str(tmp_path / "stories.sqlite3"))
+    monkeypatch.setattr(main, "story_store", store)
+    monkeypatch.setattr(main.admission.quota, "take", lambda client: None)
+    return store
+
+
+def prefetched_story(store, state):
+    """
+    Save the text-only story a prefetch of EPISODE would have written, marked as prefetched.
+    """
+    episodes = EpisodeStore.shared()
+    text = episodes.episodes[episodes.by_number(EPISODE)]
+    story = Story(StoryConfig("adult", "english", text, "COMIC", "Color"))
+    story.text = "A prefetched page."
+    story.build_pages()
+    store.save_text(story)
+    store.save(story)
+    state.set(f"prefetched:{story.key()}", "1")
+    return story
+
+
+def request(illustrate):
+    return {"query": "", "age": "adult", "language": "english", "imageGenStyle": "Comic", "color": "Color",
+            "episode": EPISODE, "illustrate": illustrate}
+
+
+def test_prefetched_text_story_is_served_to_text_requests(store, isolated_state, monkeypatch):
+    prefetcher = Prefetcher(store, state=isolated_state)
+    monkeypatch.setattr(main, "prefetcher", prefetcher)
+    story = prefetched_story(store, isolated_state)
+
+    body = TestClient(main.app).post("/getstory/", json=request(illustrate=False)).json()
+    assert body["name"] == story.key()
+    assert prefetcher.stats["hits"] == 1
+
+
+def test_prefetched_text_story_is_not_served_to_illustrated_requests(store, isolated_state, monkeypatch, fake_models):
+    prefetcher = Prefetcher(store, state=isolated_state)
+    monkeypatch.setattr(main, "prefetcher", prefetcher)
+    monkeypatch.setattr(main, "illustrate", lambda story, config, cancel_token, render_faces=True: Illustration.FULL)
+    story = prefetched_story(store, isolated_state)
+    fake_models(["A freshly written page."])
+
+    body = TestClient(main.app).post("/getstory/", json=request(illustrate=True)).json()
+    assert body["name"] == story.key(Illustration.FULL)
+    assert body["illustration"] == "full"
+    # The prefetched text was reused, and the text-only copy is still stored.
+    assert body["pages"][0]["content"]["text"] == "A prefetched page."
+    assert store.get(story.key()).illustration == Illustration.NONE
+    assert prefetcher.stats["hits"] == 0
+
+
+def test_failed_prefetch_can_be_queued_again(store, isolated_state, monkeypatch):
+    prefetcher = Prefetcher(store, state=isolated_state)
+    monkeypatch.setattr(prefetcher, "_spend", lambda: None)
+    episodes = EpisodeStore.shared()
+    text = episodes.episodes[episodes.by_number(EPISODE)]
+    options = ("adult", "english", "COMIC", "Color", "small")
+    prefetcher._enqueue(0, text, options, None)
+    job = isolated_state.pop("prefetch", timeout=0)
+
+    def fail(self, story, **kwargs):
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr("prefetcher.StoryVariants.build", fail)
+    prefetcher._run(job)
+    assert prefetcher.stats["generated"] == 0
+    prefetcher._enqueue(0, text, options, None)
+    assert prefetcher.stats["queued"] == 2
+    assert isolated_state.pop("prefetch", timeout=0) == job
+
+
+def test_hourly_budget_is_shared_by_every_worker(store, tmp_path, monkeypatch):
+    path = str(tmp_path / "state.sqlite3")
+    workers = [Prefetcher(store, budget=3, state=SQLiteState(path)) for _ in range(2)]
+    for prefetcher in (workers[0], workers[1], workers[0]):
+        prefetcher._spend()
+
+    class OverBudget(Exception):
+        pass
+
+    def sleep(seconds):
+        raise OverBudget()
+
+    monkeypatch.setattr("prefetcher.time.sleep", sleep)
+    for prefetcher in workers:
+        with pytest.raises(OverBudget):
+            prefetcher._spend()
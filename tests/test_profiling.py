@@ -0,0 +1,152 @@
+import json
+import re
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+from profiling import NULL_PROFILE, RequestProfiler
+
+FOLDED_LINE = re.compile(r"^(\S.*) (\d+)$")
+
+
+def waiting_for_images(seconds):
+    time.sleep(seconds)
+
+
+def handle_request(profile, seconds):
+    with profile.stage("illustrate"):
+        waiting_for_images(seconds)
+
+
+def other_thread_work(stop):
+    while not stop.is_set():
+        time.sleep(0.001)
+
+
+def read_folded(path):
+    samples = {}
+    for line in path.read_text(encoding="utf-8").splitlines():
+        match = FOLDED_LINE.match(line)
+        assert match, line
+        samples[match.group(1)] = int(match.group(2))
+    return samples
+
+
+@pytest.fixture
+def profiles(tmp_path):
+    return tmp_path / "profiles"
+
+
+@pytest.fixture
+def profiler(profiles):
+    return RequestProfiler(directory=profiles, rate=1.0, interval=0.002, keep=2)
+
+
+def test_unsampled_requests_get_the_null_profile(profiles):
+    profiler = RequestProfiler(directory=profiles, rate=0)
+    profile = profiler.start("r1")
+    assert profile is NULL_PROFILE
+    with profile, profile.stage("build_story"):
+        pass
+    assert not profiles.exists()
+
+
+def test_sampler_records_the_wall_time_stack_of_the_request_thread_only(profiler, profiles):
+    stop = threading.Event()
+    other = threading.Thread(target=other_thread_work, args=(stop,))
+    other.start()
+    try:
+        with profiler.start("r1") as profile:
+            handle_request(profile, 0.2)
+    finally:
+        stop.set()
+        other.join()
+
+    [stem] = profiler.profiles()
+    assert stem.endswith("_r1")
+    samples = read_folded(profiles / f"{stem}.folded")
+    assert samples == dict(profile.samples)
+    # A sleeping thread is sampled, so most samples are inside the sleep.
+    sleeping = sum(count for (stack, count) in samples.items() if "waiting_for_images (test_profiling.py:" in stack)
+    assert sleeping >= 10
+    assert sleeping * 2 > sum(samples.values())
+    assert not any("other_thread_work" in stack for stack in samples)
+    for stack in samples:
+        frames = stack.split(";")
+        # Folded stacks run from the outermost frame to the innermost one.
+        if "waiting_for_images" in stack:
+            caller = next(i for (i, frame) in enumerate(frames) if frame.startswith("handle_request ("))
+            callee = next(i for (i, frame) in enumerate(frames) if frame.startswith("waiting_for_images ("))
+            assert caller < callee
+        assert all(re.match(r"^\S+ \(.+:\d+\)$", frame) for frame in frames)
+
+
+def test_summary_has_the_stage_timings_and_sample_count(profiler, profiles):
+    with profiler.start("r1") as profile:
+        handle_request(profile, 0.05)
+
+    [stem] = profiler.profiles()
+    summary = json.loads((profiles / f"{stem}.json").read_text(encoding="utf-8"))
+    assert summary["request_id"] == "r1"
+    assert summary["status"] == "ok"
+    assert summary["samples"] == sum(read_folded(profiles / f"{stem}.folded").values())
+    [stage] = summary["stages"]
+    assert stage["stage"] == "illustrate"
+    assert 0.05 <= stage["seconds"] <= summary["seconds"]
+
+
+def test_failed_requests_are_written_and_old_profiles_deleted(profiler, profiles):
+    for request_id in ("r1", "r2"):
+        with profiler.start(request_id) as profile:
+            handle_request(profile, 0.01)
+        time.sleep(0.002)
+    with pytest.raises(ValueError):
+        with profiler.start("r3") as profile:
+            raise ValueError("no story")
+
+    assert [stem.split("_")[-1] for stem in profiler.profiles()] == ["r3", "r2"]
+    assert len(list(profiles.glob("*.json"))) == 2
+    assert not list(profiles.glob("*.tmp"))
+    summary = json.loads((profiles / f"{profiler.profiles()[0]}.json").read_text(encoding="utf-8"))
+    assert summary["status"] == "ValueError"
+
+
+@pytest.fixture
+def app(profiles, tmp_path, monkeypatch, fake_models):
+    import main
+    from story_store import StoryStore
+
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(main, "story_store", StoryStore(str(tmp_path / "stories.sqlite3")))
+    monkeypatch.setattr(main, "prefetcher", None)
+    monkeypatch.setattr(main, "StoryRetriever", lambda query: SimpleNamespace(retrieve=lambda: f"The source of {query}."))
+    monkeypatch.setattr(RequestProfiler, "_shared", RequestProfiler(directory=profiles, interval=0.001))
+    fake_models(["Karna was born.\n\nKunti set him adrift."])
+    return TestClient(main.app)
+
+
+def test_sampled_getstory_requests_write_a_profile_tagged_with_the_request_id(app, profiles, isolated_state):
+    assert app.post("/admin/profiling", json={"rate": 1}).status_code == 404
+    assert app.post("/admin/profiling", json={"rate": 1}, headers={"X-Admin-Token": "wrong"}).status_code == 404
+    assert app.post("/admin/profiling", json={"rate": 1}, headers={"X-Admin-Token": "secret"}).json() == {"rate": 1}
+    # The rate is shared with every worker.
+    assert RequestProfiler(directory=profiles, rate=0, state=isolated_state).rate == 1
+
+    response = app.post("/getstory/", json={
+        "query": "karna", "age": "adult", "language": "english", "imageGenStyle": "Comic", "color": "Color",
+    })
+    assert response.status_code == 200
+    request_id = response.headers["X-Request-ID"]
+
+    [stem] = RequestProfiler.shared().profiles()
+    assert stem.endswith(f"_{request_id}")
+    assert (profiles / f"{stem}.folded").exists()
+    summary = json.loads((profiles / f"{stem}.json").read_text(encoding="utf-8"))
+    assert summary["request_id"] == request_id
+    assert [stage["stage"] for stage in summary["stages"]] == ["retrieve", "story", "build_pages", "save"]
+
+    profiling = app.get("/admin/profiling", headers={"X-Admin-Token": "secret"}).json()
+    assert profiling == {"rate": 1, "profiles": [stem]}
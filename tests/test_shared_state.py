@@ -0,0 +1,215 @@
+import multiprocessing
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import shared_state
+from cancellation import CancelToken, Cancelled
+from llm_cache import LLMCache
+from shared_state import RedisState, SharedState, SQLiteState
+
+WORKERS = 6
+
+# Seconds the shared piece of work takes, long enough for every worker to miss on it.
+WORK_SECONDS = 0.5
+
+
+def sqlite_worker(state_path, cache_path, calls_path, barrier, results):
+    """
+    One uvicorn worker: its own SharedState connection and LLMCache over the same files.
+    """
+    cache = LLMCache(path=cache_path, state=SQLiteState(state_path))
+
+    def compute():
+        with open(calls_path, "a", encoding="utf-8") as calls:
+            calls.write("call\n")
+        time.sleep(WORK_SECONDS)
+        return "Once upon a time."
+
+    barrier.wait()
+    results.put(cache.get_or_compute("build_story", "same-prompt", compute))
+
+
+@pytest.fixture
+def redis_states(monkeypatch):
+    """
+    Return a function creating RedisStates that talk to one in-process fake server.
+    """
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    fake = SimpleNamespace(Redis=SimpleNamespace(
+        from_url=lambda url, **kwargs: fakeredis.FakeRedis(server=server, **kwargs)
+    ))
+    monkeypatch.setattr(shared_state, "redis", fake)
+    return lambda: RedisState("redis://fake:6379/0")
+
+
+def test_shared_state_is_abstract():
+    with pytest.raises(TypeError):
+        SharedState()
+
+
+def test_identical_llm_work_runs_once_across_sqlite_worker_processes(tmp_path):
+    context = multiprocessing.get_context("fork")
+    barrier = context.Barrier(WORKERS)
+    results = context.Queue()
+    calls_path = tmp_path / "calls.txt"
+    args = (str(tmp_path / "state.sqlite3"), str(tmp_path / "llm_cache.sqlite3"), str(calls_path), barrier, results)
+    workers = [context.Process(target=sqlite_worker, args=args) for _ in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    responses = [results.get(timeout=30) for _ in workers]
+    for worker in workers:
+        worker.join(timeout=10)
+
+    assert responses == ["Once upon a time."] * WORKERS
+    assert calls_path.read_text(encoding="utf-8").splitlines() == ["call"]
+    assert all(worker.exitcode == 0 for worker in workers)
+
+
+def test_identical_llm_work_runs_once_across_redis_workers(redis_states):
+    calls = []
+    responses = []
+    barrier = threading.Barrier(WORKERS)
+
+    def compute():
+        calls.append(1)
+        time.sleep(WORK_SECONDS)
+        return "Once upon a time."
+
+    def worker():
+        cache = LLMCache(path=None, state=redis_states())
+        barrier.wait()
+        responses.append(cache.get_or_compute("build_story", "same-prompt", compute))
+
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert responses == ["Once upon a time."] * WORKERS
+    assert len(calls) == 1
+
+
+def test_waiting_worker_stops_when_its_request_is_cancelled(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    release = threading.Event()
+    started = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait()
+        return "Once upon a time."
+
+    owner = threading.Thread(target=LLMCache(path=None, state=SQLiteState(path)).get_or_compute,
+                             args=("build_story", "same-prompt", compute))
+    owner.start()
+    started.wait()
+    token = CancelToken()
+    threading.Timer(0.2, token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(Cancelled):
+        LLMCache(path=None, state=SQLiteState(path)).get_or_compute(
+            "build_story", "same-prompt", lambda: pytest.fail("computed twice"), token
+        )
+    assert time.monotonic() - start < 1
+    release.set()
+    owner.join()
+
+
+def test_waiting_worker_takes_over_when_the_claimed_work_fails(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    started = threading.Event()
+
+    def fail():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError("model unavailable")
+
+    def run_failing():
+        with pytest.raises(RuntimeError):
+            LLMCache(path=None, state=SQLiteState(path)).get_or_compute("build_story", "same-prompt", fail)
+
+    owner = threading.Thread(target=run_failing)
+    owner.start()
+    started.wait()
+    response = LLMCache(path=None, state=SQLiteState(path)).get_or_compute(
+        "build_story", "same-prompt", lambda: "Once upon a time."
+    )
+    owner.join()
+    assert response == "Once upon a time."
+
+
+def test_claim_is_renewed_while_its_work_outlives_the_lease(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    state = SQLiteState(path)
+    with state.claim("work", lease=0.2) as claimed:
+        assert claimed
+        time.sleep(0.7)
+        with SQLiteState(path).claim("work", lease=0.2) as other:
+            assert not other
+    assert not state.claimed("work")
+    with SQLiteState(path).claim("work", lease=0.2) as other:
+        assert other
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "redis"])
+def test_take_returns_a_value_to_only_one_worker(backend, tmp_path, request):
+    if backend == "sqlite":
+        states = [SQLiteState(str(tmp_path / "state.sqlite3")) for _ in range(WORKERS)]
+    else:
+        make = request.getfixturevalue("redis_states")
+        states = [make() for _ in range(WORKERS)]
+    states[0].set("prefetched:story", "1")
+    taken = []
+    barrier = threading.Barrier(WORKERS)
+
+    def worker(state):
+        barrier.wait()
+        taken.append(state.take("prefetched:story"))
+
+    threads = [threading.Thread(target=worker, args=(state,)) for state in states]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(taken, key=str) == ["1"] + [None] * (WORKERS - 1)
+    assert states[0].get("prefetched:story") is None
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "redis"])
+def test_incr_counts_across_workers_and_restarts_after_expiry(backend, tmp_path, request):
+    if backend == "sqlite":
+        states = [SQLiteState(str(tmp_path / "state.sqlite3")) for _ in range(WORKERS)]
+    else:
+        make = request.getfixturevalue("redis_states")
+        states = [make() for _ in range(WORKERS)]
+    counts = []
+    barrier = threading.Barrier(WORKERS)
+
+    def worker(state):
+        barrier.wait()
+        counts.extend(state.incr("spent", ttl=0.5) for _ in range(10))
+
+    threads = [threading.Thread(target=worker, args=(state,)) for state in states]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(counts) == list(range(1, WORKERS * 10 + 1))
+    time.sleep(0.6)
+    assert states[0].incr("spent", ttl=0.5) == 1
+
+
+def test_sqlite_writes_delete_expired_entries(tmp_path):
+    state = SQLiteState(str(tmp_path / "state.sqlite3"))
+    for i in range(10):
+        state.set(f"claim:{i}", "owner", ttl=0.05)
+    state.set("kept", "value")
+    time.sleep(0.1)
+    state.set("fresh", "value", ttl=60)
+    keys = [key for (key,) in state._connection().execute("SELECT key FROM entries ORDER BY key")]
+    assert keys == ["fresh", "kept"]
@@ -0,0 +1,82 @@
+import json
+import shutil
+import threading
+import time
+
+import pytest
+
+import story_characters
+from cancellation import CancelToken, Cancelled
+from story import Story
+from story_characters import StoryCharacters
+from story_config import StoryConfig
+
+
+@pytest.fixture
+def character_map(tmp_path, monkeypatch):
+    path = tmp_path / "character_map.json"
+    shutil.copy(story_characters.CHARACTER_MAP_PATH, path)
+    monkeypatch.setattr(story_characters, "CHARACTER_MAP_PATH", str(path))
+    return path
+
+
+def test_new_faces_are_rendered_once_and_saved_to_the_character_map(character_map, fake_models, monkeypatch):
+    fake_models(["{}"])
+    seed = json.loads(character_map.read_text(encoding="utf-8"))
+    rendered = []
+
+    def render(self, character):
+        rendered.append(character)
+        return f"https://faces.example/{character}.png"
+
+    monkeypatch.setattr(StoryCharacters, "_generateCharacterFace", render)
+    config = StoryConfig("adult", "english", "Amba and Shikhandin.", "COMIC", "Color")
+    barrier = threading.Barrier(4)
+
+    def worker(names):
+        characters = StoryCharacters(Story(config), config=config)
+        characters.json = {name: {} for name in names}
+        barrier.wait()
+        characters.generateCharacterFaces()
+
+    threads = [threading.Thread(target=worker, args=(names,)) for names in (["Amba"], ["amba"], ["Shikhandin"], ["Karna"])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(rendered) == ["amba", "shikhandin"]
+    saved = json.loads(character_map.read_text(encoding="utf-8"))
+    assert saved == {**seed, "amba": "https://faces.example/amba.png", "shikhandin": "https://faces.example/shikhandin.png"}
+
+
+def test_worker_waiting_for_the_same_face_stops_when_cancelled(character_map, fake_models, monkeypatch):
+    fake_models(["{}"])
+    started = threading.Event()
+    release = threading.Event()
+
+    def render(self, character):
+        started.set()
+        release.wait()
+        return f"https://faces.example/{character}.png"
+
+    monkeypatch.setattr(StoryCharacters, "_generateCharacterFace", render)
+    config = StoryConfig("adult", "english", "Amba's vow.", "COMIC", "Color")
+
+    def characters(cancel_token=None):
+        characters = StoryCharacters(Story(config), config=config, cancel_token=cancel_token)
+        characters.json = {"amba": {}}
+        return characters
+
+    first = threading.Thread(target=characters().generateCharacterFaces)
+    first.start()
+    started.wait()
+    token = CancelToken()
+    threading.Timer(0.2, token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(Cancelled):
+        characters(token).generateCharacterFaces()
+    assert time.monotonic() - start < 1
+    release.set()
+    first.join()
+    assert characters().generateCharacterFaces() == {"amba": "https://faces.example/amba.png"}
@@ -0,0 +1,56 @@
+import pytest
+
+import story_config
+from story import Story
+from story_codec import StoryCodec
+from story_config import StoryConfig, AgeRange, Language, ImageGenStyle, Color, PageSz
+
+TEXT = "Karna met Krishna by the river."
+
+
+@pytest.mark.parametrize("options", [
+    (AgeRange.TEEN, Language.HINDI, ImageGenStyle.COMIC, Color.BW, PageSz.SM),
+    ("Teens", "Hindi", "COMIC", "Black and White", "small"),
+    ("teenagers", "Hindi", "Comic book panel, illustrated by Steve Ditko", "Black and White", "small"),
+])
+def test_options_resolve_to_enums(options):
+    config = StoryConfig(options[0], options[1], TEXT, options[2], options[3], options[4])
+    assert (config.age, config.language, config.img_style, config.color, config.sz) == \
+        (AgeRange.TEEN, Language.HINDI, ImageGenStyle.COMIC, Color.BW, PageSz.SM)
+
+
+@pytest.mark.parametrize("options", [
+    (AgeRange.PRETEEN, Language.ENGLISH, ImageGenStyle.WATER, Color.COLOR, PageSz.LG),
+    ("Preteens", "English", "WATER", "Color", "large"),
+    ("Adult", "English", "a free-form style", "Color", "med"),
+])
+def test_round_trip_keeps_options_and_story_name(options):
+    config = StoryConfig(options[0], options[1], TEXT, options[2], options[3], options[4], max_pages=3)
+    restored = StoryConfig.from_json(config.to_json(), TEXT)
+    for field in ("age", "language", "img_style", "color", "sz", "max_pages", "text_id"):
+        assert getattr(restored, field) == getattr(config, field)
+    assert Story(restored).name == Story(config).name
+    assert Story.from_json(Story(config).to_json()).name == Story(config).name
+    assert StoryCodec().decode(StoryCodec().encode(Story(config))).name == Story(config).name
+
+
+def test_unknown_options_stay_strings():
+    config = StoryConfig("Adult", "English", TEXT, "a free-form style", "Color", "med")
+    assert config.img_style == "a free-form style"
+    assert config.sz == "med"
+
+
+def test_text_cache_is_bounded_and_configs_keep_their_text(monkeypatch):
+    monkeypatch.setattr(story_config, "MAX_TEXTS", 3)
+    monkeypatch.setattr(StoryConfig, "texts", StoryConfig.texts.__class__())
+    configs = [StoryConfig("Adult", "English", f"text {i}", "COMIC") for i in range(10)]
+    assert len(StoryConfig.texts) == 3
+    assert [config.text for config in configs] == [f"text {i}" for i in range(10)]
+    assert StoryConfig.cached_text(configs[0].text_id) is None
+    assert StoryConfig.cached_text(configs[-1].text_id) == "text 9"
+
+
+def test_configs_share_one_copy_of_a_text():
+    first = StoryConfig("Adult", "English", "".join(["shared ", "text"]), "COMIC")
+    second = StoryConfig("Teens", "Hindi", "".join(["shared ", "text"]), "WATER")
+    assert first.text is second.text
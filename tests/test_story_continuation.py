@@ -0,0 +1,60 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from page import Page
+from page_content import PageContent
+from story import Story
+from story_config import StoryConfig
+from story_store import StoryStore
+
+TEXT = "Karna met Krishna by the river, and Krishna told him the truth of his birth."
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "story_store", StoryStore(str(tmp_path / "stories.sqlite3")))
+    monkeypatch.setattr(main.admission.quota, "take", lambda client: None)
+    return TestClient(main.app)
+
+
+def saved_story(max_pages):
+    story = Story(StoryConfig("Adult", "English", TEXT, "COMIC", "Color", "small", max_pages=max_pages))
+    story.text = "Page one.\n\nPage two."
+    story.build_pages()
+    main.story_store.save(story)
+    return story
+
+
+def test_story_name_tells_page_limits_and_languages_apart():
+    names = {
+        Story(StoryConfig("Adult", language, TEXT, "COMIC", "Color", "small", max_pages=max_pages)).name
+        for language in ("English", "Hindi")
+        for max_pages in (None, 5)
+    }
+    assert len(names) == 4
+
+
+def test_continue_appends_pages_and_saves_them(client, fake_models):
+    story = saved_story(max_pages=2)
+    fake_models(["Page three.\n\nPage four."])
+    response = client.post("/continuestory/", json={"name": story.key(), "pages": 2})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["name"] == story.key()
+    assert [page["content"]["text"] for page in body["pages"]] == ["Page one.", "Page two.", "Page three.", "Page four."]
+    assert [page.pageNo for page in main.story_store.get(story.key()).pages] == [1, 2, 3, 4]
+
+
+def test_continue_rejects_unknown_complete_and_oversized_requests(client):
+    complete = saved_story(max_pages=None)
+    assert client.post("/continuestory/", json={"name": "missing", "pages": 2}).status_code == 404
+    assert client.post("/continuestory/", json={"name": complete.key(), "pages": 2}).status_code == 409
+    assert client.post("/continuestory/", json={"name": complete.key(), "pages": 0}).status_code == 422
+
+
+def test_images_for_continued_pages_land_on_those_pages():
+    story = Story(StoryConfig("Adult", "English", TEXT, "COMIC", "Color", "small", max_pages=2))
+    story.pages = [Page(PageContent(f"Page {n}.", None), pageNo=n) for n in (1, 2, 3)]
+    story.populate_images(type("Illustrator", (), {"store": {2: "/assets/three.png"}})())
+    assert [page.content.imageURL for page in story.pages] == [None, None, "/assets/three.png"]
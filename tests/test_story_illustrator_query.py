@@ -0,0 +1,26 @@
+from types import SimpleNamespace
+
+import pytest
+
+from page import Page
+from page_content import PageContent
+from story_config import StoryConfig
+from story_illustrator_query import StoryIllustratorQuery
+
+
+@pytest.mark.parametrize("color, expected", [("Color", "Color"), ("bw", "Black and White")])
+def test_prompt_names_the_color_and_style_by_value(color, expected, fake_models, monkeypatch):
+    router = fake_models(["Karna stands on the riverbank"])
+    prompts = []
+    predict = router.predict
+    monkeypatch.setattr(router, "predict", lambda site, prompt: prompts.append(prompt) or predict(site, prompt))
+    config = StoryConfig("adult", "english", "Karna's birth.", "Watercolor", color)
+    page = Page(content=PageContent("Karna stood on the riverbank.", None), pageNo=1)
+    characters = SimpleNamespace(json={"karna": {"name": "Karna", "description": "tall"}})
+
+    result = StoryIllustratorQuery(page, characters, config).generatePrompt()
+
+    [prompt] = prompts
+    assert f"The image should be {expected} and in this style Watercolor." in prompt
+    assert "Color.COLOR" not in prompt and "Color.BW" not in prompt
+    assert result == "Karna stands on the riverbank::3 --seed 100"
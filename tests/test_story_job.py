@@ -0,0 +1,80 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+from langchain.chat_models.base import BaseChatModel
+from langchain.schema.messages import AIMessage, AIMessageChunk
+from langchain.schema.output import ChatGeneration, ChatGenerationChunk, ChatResult
+
+import story_job
+from model_router import ModelRouter
+from story_job import StoryJob
+
+
+class GatedStoryModel(BaseChatModel):
+    """
+    Streams the first page, then waits for release before streaming the second.
+    """
+
+    release: threading.Event = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    @property
+    def _llm_type(self):
+        return "gated-story"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="Page one.\n\nPage two."))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        yield ChatGenerationChunk(message=AIMessageChunk(content="Page one."))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="\n\nPage"))
+        self.release.wait(5)
+        yield ChatGenerationChunk(message=AIMessageChunk(content=" two.\n\n"))
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def model(monkeypatch):
+    model = GatedStoryModel(release=threading.Event())
+    monkeypatch.setattr(ModelRouter, "_shared", ModelRouter(factory=lambda name: model))
+    monkeypatch.setattr(story_job, "StoryRetriever",
+                        lambda query, vectordb=None: SimpleNamespace(retrieve=lambda: "Karna was born with armour."))
+    return model
+
+
+def test_pages_are_available_as_soon_as_they_are_streamed(model):
+    job = StoryJob("Karna", "Adult", "English", "COMIC", "Color", "small", max_pages=5, illustrate=False).start()
+
+    wait_for(lambda: len(job.pages) == 1)
+    assert job.status == StoryJob.STATUS_WRITING and job.story is None
+    assert job.pages[0].content.text == "Page one."
+
+    model.release.set()
+    wait_for(lambda: job.done)
+    assert job.status == StoryJob.STATUS_DONE
+    assert [(page.pageNo, page.content.text) for page in job.pages] == [(1, "Page one."), (2, "Page two.")]
+
+
+def test_continued_pages_are_numbered_after_the_story(model):
+    model.release.set()
+    job = StoryJob("Karna", "Adult", "English", "COMIC", "Color", "small", max_pages=2, illustrate=False).start()
+    wait_for(lambda: job.done)
+    model.release.clear()
+
+    more = StoryJob.continuation(job.story, pages=2, illustrate=False).start()
+    wait_for(lambda: len(more.pages) == 3)
+    assert more.pages[2].pageNo == 3 and more.status == StoryJob.STATUS_WRITING
+
+    model.release.set()
+    wait_for(lambda: more.done)
+    assert [page.pageNo for page in more.pages] == [1, 2, 3, 4]
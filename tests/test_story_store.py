@@ -0,0 +1,117 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from page import Page
+from page_content import PageContent
+from story import Story
+from story_config import StoryConfig, AgeRange
+from story_store import StoryStore
+
+TEXTS = ["Karna was born to Kunti.", "Drona taught the princes archery."]
+AGES = ["preteen", "teen", "adult"]
+
+
+def story(text, age, page="A page."):
+    story = Story(StoryConfig(age, "english", text, "COMIC", "Color"))
+    story.text = page
+    story.pages = [Page(PageContent(page, None), pageNo=1)]
+    return story
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StoryStore(str(tmp_path / "stories.sqlite3"))
+
+
+@pytest.fixture
+def filled(store):
+    """
+    Save one story per text and age, oldest first.
+    """
+    saved = []
+    for text in TEXTS:
+        for age in AGES:
+            saved.append(story(text, age, page=f"{age}: {text}"))
+            store.save(saved[-1])
+            time.sleep(0.002)
+    return saved
+
+
+def test_get_returns_the_saved_story_with_its_source_text(store):
+    saved = story(TEXTS[0], "adult")
+    store.save(saved)
+    loaded = store.get(saved.key())
+    assert loaded.config.text == TEXTS[0]
+    assert loaded.pages[0].content.text == "A page."
+    assert store.get("missing") is None
+
+
+def test_find_matches_config_fields_newest_first(store, filled):
+    text_id = filled[0].config.text_id
+    found = store.find(text_id=text_id)
+    assert [s.key() for s in found] == [s.key() for s in reversed(filled[:3])]
+    assert [s.key() for s in store.find(age=AgeRange.ADULT)] == [filled[5].key(), filled[2].key()]
+    assert [s.key() for s in store.find(text_id=text_id, age=AgeRange.TEEN)] == [filled[1].key()]
+    assert store.find(text_id="unknown") == []
+
+
+def test_find_and_names_paginate(store, filled):
+    newest_first = [s.key() for s in reversed(filled)]
+    pages = [store.names(limit=4, offset=offset) for offset in (0, 4, 8)]
+    assert pages == [newest_first[:4], newest_first[4:], []]
+    found = [s.key() for offset in (0, 2, 4) for s in store.find(limit=2, offset=offset)]
+    assert found == newest_first
+    assert store.count() == len(filled)
+
+
+def test_find_rejects_unknown_fields(store):
+    with pytest.raises(ValueError):
+        store.find(name="x")
+
+
+def test_saving_again_replaces_the_story(store):
+    store.save(story(TEXTS[0], "adult", page="First draft."))
+    store.save(story(TEXTS[0], "adult", page="Second draft."))
+    assert store.count() == 1
+    assert store.find()[0].pages[0].content.text == "Second draft."
+
+
+def test_story_texts_are_shared_by_text_name(store):
+    saved = story(TEXTS[0], "adult", page="Karna's story.")
+    assert store.get_text(saved.text_name) is None
+    store.save_text(saved)
+    other_style = Story(StoryConfig("adult", "english", TEXTS[0], "Watercolor", "Black and White"))
+    assert other_style.text_name == saved.text_name
+    assert store.get_text(other_style.text_name) == "Karna's story."
+    saved.text = "Karna's story, rewritten."
+    store.save_text(saved)
+    assert store.get_text(saved.text_name) == "Karna's story, rewritten."
+
+
+def test_readers_are_not_blocked_by_a_writer(store, filled):
+    # Hold a write transaction open from another connection, as a long save_many would.
+    writer = sqlite3.connect(store.path, timeout=30, isolation_level=None)
+    writer.execute("BEGIN IMMEDIATE")
+    writer.execute("DELETE FROM stories")
+    results = []
+
+    def read():
+        start = time.monotonic()
+        results.append((store.count(), len(store.find(limit=100)), store.get(filled[0].key()) is not None,
+                        time.monotonic() - start))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    # Readers see the last committed state, without waiting for the writer.
+    assert [result[:3] for result in results] == [(len(filled), len(filled), True)] * 4
+    assert max(result[3] for result in results) < 1
+
+    writer.execute("COMMIT")
+    writer.close()
+    assert store.count() == 0
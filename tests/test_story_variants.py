@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+
+from cancellation import CancelToken, Cancelled
+from story import Story
+from story_config import StoryConfig
+from story_store import StoryStore
+from shared_state import SQLiteState
+from story_variants import StoryVariants
+
+TEXT = "Drona taught the princes archery in Hastinapura."
+
+
+def story(age="Preteens", sz="small"):
+    return Story(StoryConfig(age, "English", TEXT, "COMIC", "Color", sz, max_pages=2))
+
+
+@pytest.fixture
+def store(tmp_path):
+    return StoryStore(str(tmp_path / "stories.sqlite3"))
+
+
+def prompts(router):
+    """
+    Record the prompts streamed by every model the router creates.
+    """
+    seen = []
+    for model in router.models.values():
+        original = model.stream
+        object.__setattr__(model, "stream", lambda prompt, original=original: seen.append(prompt) or original(prompt))
+    return seen
+
+
+def test_cold_variant_is_generated_directly(store, fake_models):
+    router = fake_models(["Drona set a bird on a branch.\n\nOnly Arjuna saw its eye.\n\nA third page."])
+    router.model("build_story")
+    seen = prompts(router)
+    variant = story()
+
+    StoryVariants(store).build(variant)
+    assert variant.text == "Drona set a bird on a branch.\n\nOnly Arjuna saw its eye."
+    assert len(seen) == 1 and "Rewrite" not in seen[0]
+    assert store.get_text(StoryVariants(store).base_story(variant.config).text_name) is None
+    assert store.get_text(variant.text_name) == variant.text
+
+
+def test_variant_is_derived_from_a_stored_base(store, fake_models):
+    base = StoryVariants(store).base_story(story().config)
+    base.text = "The base story.\n\nIts second page."
+    store.save_text(base)
+    router = fake_models(["A simpler page.\n\nAnother simple page."])
+    router.model("story_variant")
+    seen = prompts(router)
+    variant = story()
+
+    StoryVariants(store).build(variant)
+    assert variant.text == "A simpler page.\n\nAnother simple page."
+    assert len(seen) == 1 and "Rewrite" in seen[0] and "The base story." in seen[0]
+
+
+def test_derive_stops_when_cancelled(store, fake_models):
+    base = StoryVariants(store).base_story(story().config)
+    base.text = "The base story.\n\nIts second page."
+    store.save_text(base)
+    fake_models(["A simpler page.\n\nAnother simple page."])
+    token = CancelToken()
+    token.cancel()
+    variant = story()
+
+    with pytest.raises(Cancelled):
+        StoryVariants(store).build(variant, cancel_token=token)
+    assert store.get_text(variant.text_name) is None
+
+
+def test_worker_waiting_for_the_same_text_stops_when_cancelled(store, tmp_path, monkeypatch):
+    path = str(tmp_path / "state.sqlite3")
+    started = threading.Event()
+    release = threading.Event()
+    writes = []
+
+    def write(self, story, cancel_token, on_segment):
+        writes.append(story.text_name)
+        started.set()
+        release.wait()
+        story.text = "Drona set a bird on a branch."
+        self.story_store.save_text(story)
+
+    monkeypatch.setattr(StoryVariants, "_write", write)
+    first = threading.Thread(target=StoryVariants(store, state=SQLiteState(path)).build, args=(story(),))
+    first.start()
+    started.wait()
+    token = CancelToken()
+    threading.Timer(0.2, token.cancel).start()
+    start = time.monotonic()
+    with pytest.raises(Cancelled):
+        StoryVariants(store, state=SQLiteState(path)).build(story(), cancel_token=token)
+    assert time.monotonic() - start < 1
+
+    release.set()
+    first.join()
+    waiting = story()
+    StoryVariants(store, state=SQLiteState(path)).build(waiting)
+    assert waiting.text == "Drona set a bird on a branch."
+    assert len(writes) == 1
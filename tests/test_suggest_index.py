@@ -0,0 +1,82 @@
+from collections import Counter
+
+import pytest
+from fastapi.testclient import TestClient
+
+from episode_store import EpisodeStore
+from suggest_index import SuggestIndex, _body
+
+
+@pytest.fixture(scope="module")
+def index():
+    return SuggestIndex()
+
+
+def characters(index):
+    return [entry["label"] for entry in index.entries if entry["kind"] == "character"]
+
+
+def test_body_drops_credits_run_on_to_the_last_sentence():
+    text = (
+        "Laura Gibbs · 7. Ganga's Sons\n"
+        "Shantanu was king of Hastinapura.Inspired by: Jaya: An Illustrated Retelling of the "
+        "Mahabharataby Devdutt Pattanaik.Notes: This story is from Chapter 8.\nDevavrata\n"
+    )
+    assert _body(text) == "Shantanu was king of Hastinapura."
+
+
+def test_credits_are_not_suggested_as_characters(index):
+    labels = characters(index)
+    for word in ("Illustrated", "Retelling", "Pattanaik", "Mahabharataby", "Devdutt"):
+        assert word not in labels
+    assert index.suggest("ret")[0]["label"].startswith("178. The Pandavas Return")
+
+
+def test_places_peoples_and_weapons_are_not_suggested_as_characters(index):
+    labels = characters(index)
+    for word in ("Hastinapura", "Kurukshetra", "Kauravas", "Brahmastra"):
+        assert word not in labels
+    assert "Karna" in labels
+    assert "Draupadi" in labels
+
+
+def test_every_character_is_suggested_once(index):
+    labels = characters(index)
+    assert [label for (label, count) in Counter(labels).items() if count > 1] == []
+    assert [label for label in labels if label.startswith("Devavrata")] == ["Devavrata (Bhishma)"]
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    import main
+    from story_store import StoryStore
+
+    def retriever(query):
+        raise AssertionError(f"StoryRetriever was called for {query!r}")
+
+    monkeypatch.setattr(main, "story_store", StoryStore(str(tmp_path / "stories.sqlite3")))
+    monkeypatch.setattr(main, "prefetcher", None)
+    monkeypatch.setattr(main, "StoryRetriever", retriever)
+    return TestClient(main.app)
+
+
+def test_a_suggested_episode_is_built_without_retrieval(app, fake_models, monkeypatch):
+    import story_query
+
+    monkeypatch.setattr(story_query.StoryQuery, "transform_prompt", lambda self: pytest.fail("StoryQuery was called"))
+    fake_models(["Draupadi was won at the svayamvara.\n\nShe married the five brothers."])
+    [suggestion] = app.get("/suggest", params={"q": "draupdi", "limit": 1}).json()["suggestions"]
+    assert suggestion["label"] == "Draupadi"
+    episode = suggestion["episode"]
+    assert episode is not None
+
+    body = {"query": "draupdi", "age": "adult", "language": "english", "imageGenStyle": "Comic", "color": "Color"}
+    response = app.post("/getstory/", json={**body, "episode": episode})
+    assert response.status_code == 200
+    assert response.json()["pages"][0]["content"]["text"] == "Draupadi was won at the svayamvara."
+    # The story was written from the episode's own text, without a query transform.
+    episodes = EpisodeStore.shared()
+    assert list(response.json()["texts"].values()) == [episodes.episodes[episodes.by_number(episode)]]
+
+    assert app.post("/getstory/", json={**body, "episode": 100000}).status_code == 404
+
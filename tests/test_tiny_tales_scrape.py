@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import json
+import re
+
+from aiohttp import web
+
+from corpus.tiny_tales_scrape import Scraper
+
+STORY = """<html><body><h3>{title}</h3><div class="post-body">{text}</div></body></html>"""
+
+
+class FixtureBlog:
+    """
+    Serves an index page and story pages with ETags, answering 304 to a matching
+    If-None-Match, and counts the full responses per path.
+    """
+
+    def __init__(self):
+        self.pages = {
+            "/index.html": '<a href="{base}/story/1.html">1</a> <a href="{base}/story/2.html">2</a>',
+            "/story/1.html": STORY.format(title="1. Karna's Birth", text="Kunti set the baby adrift."),
+            "/story/2.html": "<html><body>Under maintenance</body></html>",
+        }
+        self.full = {}
+
+    async def handle(self, request):
+        body = self.pages[request.path].replace("{base}", self.base).encode("utf-8")
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        self.full[request.path] = self.full.get(request.path, 0) + 1
+        return web.Response(body=body, content_type="text/html", headers={"ETag": etag})
+
+
+async def scrape_twice(tmp_path, blog, between):
+    """
+    Run the scraper against the fixture blog, call between(), and run it again.
+    Returns the two scrapers.
+    """
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", blog.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    blog.base = f"http://127.0.0.1:{port}"
+    scrapers = []
+    try:
+        for run in range(2):
+            if run:
+                between()
+            scraper = Scraper(index_url=f"{blog.base}/index.html", corpus_dir=tmp_path / "corpus",
+                              manifest_path=tmp_path / "manifest.json",
+                              story_pattern=re.compile(re.escape(blog.base) + r"/story/.*"))
+            await scraper.run()
+            scrapers.append(scraper)
+    finally:
+        await runner.cleanup()
+    return scrapers
+
+
+def test_unchanged_pages_are_revalidated_without_rewriting(tmp_path):
+    blog = FixtureBlog()
+    (first, second) = asyncio.run(scrape_twice(tmp_path, blog, lambda: None))
+    assert [p.rsplit("/", 1)[-1] for p in first.changed] == ["1. Karna's Birth.txt"]
+    assert second.changed == []
+    assert blog.full["/index.html"] == 1 and blog.full["/story/1.html"] == 1
+
+
+def test_page_without_a_story_is_fetched_in_full_again(tmp_path):
+    blog = FixtureBlog()
+
+    def publish():
+        manifest = json.loads((tmp_path / "manifest.json").read_text())
+        assert "etag" not in manifest[f"{blog.base}/story/2.html"]
+        blog.pages["/story/2.html"] = STORY.format(title="2. The Tournament", text="Karna challenged Arjuna.")
+
+    (first, second) = asyncio.run(scrape_twice(tmp_path, blog, publish))
+    assert first.stats["failed"] == 1
+    assert [p.rsplit("/", 1)[-1] for p in second.changed] == ["2. The Tournament.txt"]
+    assert (tmp_path / "corpus" / "2. The Tournament.txt").read_text() == "Karna challenged Arjuna."
+
+
+def test_deleted_episode_file_is_written_again(tmp_path):
+    blog = FixtureBlog()
+    episode = tmp_path / "corpus" / "1. Karna's Birth.txt"
+    (first, second) = asyncio.run(scrape_twice(tmp_path, blog, episode.unlink))
+    assert blog.full["/story/1.html"] == 2
+    assert [p.rsplit("/", 1)[-1] for p in second.changed] == ["1. Karna's Birth.txt"]
+    assert episode.read_text() == "Kunti set the baby adrift."
@@ -0,0 +1,52 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+AppTest = pytest.importorskip("streamlit.testing.v1").AppTest
+
+import streamlit as st
+
+import story_job
+import story_store
+from image_prompt_index import ImagePromptIndex
+from image_store import ImageStore
+from story_job import StoryJob
+from story_retriever import StoryRetriever
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, fake_models):
+    st.cache_resource.clear()
+    store = story_store.StoryStore(str(tmp_path / "stories.sqlite3"))
+    monkeypatch.setattr(story_store, "StoryStore", lambda: store)
+    monkeypatch.setattr(ImageStore, "_shared", ImageStore(root=tmp_path / "assets"))
+    monkeypatch.setattr(ImagePromptIndex, "_shared", SimpleNamespace())
+    monkeypatch.setattr(StoryRetriever, "open_vectordb", staticmethod(lambda: None))
+    monkeypatch.setattr(story_job, "StoryRetriever",
+                        lambda query, vectordb=None: SimpleNamespace(retrieve=lambda: "Karna was born with armour."))
+    monkeypatch.setattr(StoryJob, "_illustrate", lambda self, story, pages: None)
+    fake_models(["Page one.\n\nPage two.\n\n", "Page three.\n\n"])
+    yield AppTest.from_file(os.path.join(ROOT, "visualizer.py"), default_timeout=30)
+    st.cache_resource.clear()
+
+
+def texts(at):
+    return [element.value for element in at.markdown]
+
+
+def test_submit_shows_the_story_and_continues_it(app):
+    app.run()
+    app.sidebar.text_input[0].input("Karna")
+    app.sidebar.radio[0].set_value("Adult").run()
+    app.sidebar.button[0].click().run()
+    assert not app.exception
+    assert "Page one." in texts(app) and "Page two." in texts(app)
+
+    (continue_button,) = [button for button in app.button if button.label == "Continue story"]
+    continue_button.click().run()
+    assert not app.exception
+    assert "Page three." in texts(app)
+    assert "Page 3" in texts(app)
@@ -1,14 +1,60 @@
 import streamlit as st
 from story_retriever import StoryRetriever
-from story_config import StoryConfig
-from story import Story
-from story_config import ImageGenStyle
-from story_characters import StoryCharacters
-from story_illustrator import StoryIllustrator
-import logging
+from story_store import StoryStore
+from image_store import ImageStore
+from image_prompt_index import ImagePromptIndex
+from story_job import StoryJob
+from model_router import ModelRouter
+from llm_cache import LLMCache
+import time
 
+# Seconds between reruns while a story is being generated.
+POLL_INTERVAL = 1
 
 
+@st.cache_resource
+def get_vectordb():
+    return StoryRetriever.open_vectordb()
+
+
+@st.cache_resource
+def get_story_store():
+    return StoryStore()
+
+
+@st.cache_resource
+def get_image_store():
+    return ImageStore.shared()
+
+
+@st.cache_resource
+def get_prompt_index():
+    return ImagePromptIndex.shared()
+
+
+# Stories and illustrators route their calls through the shared router and cache, so
+# their LLM clients are created once per server rather than once per rerun.
+@st.cache_resource
+def get_model_router():
+    return ModelRouter.shared()
+
+
+@st.cache_resource
+def get_llm_cache():
+    return LLMCache.shared()
+
+
+def rerun():
+    # st.rerun replaced st.experimental_rerun in later Streamlit releases.
+    if hasattr(st, "rerun"):
+        st.rerun()
+    else:
+        st.experimental_rerun()
+
+
+get_model_router()
+get_llm_cache()
+
 st.title('Katha GPT Visualizer')
 
 
@@ -59,38 +105,56 @@ size = st.sidebar.radio(
 submit = st.sidebar.button("Submit", type="primary")
 
 
+# Generation runs in a StoryJob thread kept in session state, so widget interactions
+# rerun this script without throwing the work away.
 if submit and query:
-    most_relevant_content = StoryRetriever(query).retrieve()
-    config = StoryConfig(
-	    age,
-	    language, 
-	    most_relevant_content, 
-	    "COMIC", #stick to only comic style.
+    previous = st.session_state.get("job")
+    if previous is not None and not previous.done:
+        previous.cancel()
+    st.session_state["job"] = StoryJob(
+        query,
+        age,
+        language,
+        "COMIC", #stick to only comic style.
         "Color", #and only in color
-        size
-	)
-    story = Story(config=config)
-    story.build_story()
-    logging.info(story.text)
-    story.build_pages()
-    story.pages = story.pages[:5]
-    characters = StoryCharacters(story, config=config)
-    characters.fetchCharacters()
-    characters.generateCharacterFaces()
-    illustrator = StoryIllustrator(story, config, characters)
-    illustrator.populateStore()
-    print(illustrator.store)
-    story.populate_images(illustrator)
-    logging.info("Finished generating and populating images...rendering.\n\n\n")
-    story.save_json()
-    st.title("Generated Story")
-    for (i,page) in enumerate(story.pages):
-        st.write(f"Page {i+1}")
-        st.image(page.content.imageURL)
-        st.write(page.content.text)
-        "---"
-    st.title("Source")
-    st.write(most_relevant_content)
-
-
+        size,
+        max_pages=5,
+        story_store=get_story_store(),
+        image_store=get_image_store(),
+        vectordb=get_vectordb(),
+        prompt_index=get_prompt_index()
+    ).start()
 
+job = st.session_state.get("job")
+if job is not None:
+    if not job.done:
+        st.info(f"{job.status}...")
+    elif job.error is not None:
+        st.error(f"Could not generate the story: {job.error}")
+    # Pages are shown as soon as they are streamed, before the whole story is written.
+    pages = job.pages
+    if pages:
+        st.title("Generated Story")
+        for page in pages:
+            st.write(f"Page {page.pageNo}")
+            if page.content.imageURL:
+                st.image(str(get_image_store().path(page.content.imageURL) or page.content.imageURL))
+            st.write(page.content.text)
+            "---"
+        # Later pages are written only when the reader asks for them.
+        if job.status == StoryJob.STATUS_DONE and job.story.config.max_pages is not None:
+            if st.button("Continue story"):
+                st.session_state["job"] = StoryJob.continuation(
+                    job.story,
+                    pages=5,
+                    story_store=get_story_store(),
+                    image_store=get_image_store(),
+                    prompt_index=get_prompt_index()
+                ).start()
+                rerun()
+    if job.source is not None:
+        st.title("Source")
+        st.write(job.source)
+    if not job.done:
+        time.sleep(POLL_INTERVAL)
+        rerun()